@@ -1,24 +1,28 @@
 import sys
-import rasterio
 import os
 from os.path import basename
-from scipy.interpolate import interp1d
 from PyQt5 import QtGui
 from PyQt5.QtCore import Qt
 from PyQt5.QtGui import QColor
-from PyQt5.QtWidgets import QWidget, QGridLayout, QPushButton, QApplication, QListWidget, QVBoxLayout, QHBoxLayout, QLabel, QTextEdit, QPushButton, QSlider, QAbstractItemView, QCheckBox, QFileDialog, QRadioButton
+from PyQt5.QtWidgets import QWidget, QGridLayout, QPushButton, QApplication, QListWidget, QListWidgetItem, QVBoxLayout, QHBoxLayout, QLabel, QTextEdit, QPushButton, QSlider, QAbstractItemView, QCheckBox, QFileDialog, QRadioButton
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.figure import Figure
-from pathplan.path_planner import plan_path
 from pathplan.utils import save_path,read_init_path
-from pathplan.viz import plot2d, plot3d, plot_lidar_penetration, display_surface
-from pathplan.viz import plot_lidar_penetration as plot_lidar
-from pathplan.evaluation import get_comparison_stats, get_individual_stats
+from pathplan.viz import PathView
+from pathplan.lidar import DEFAULT_FOV, DEFAULT_RANGE
+from pathplan.evaluation import get_individual_stats, COMPARISON_METRICS, comparison_metric, format_comparison, path_key
 from main import generate_path, create_test_case, load_test_case, generate_flight
+from pathplan.farm import BASE_PORT, PORT_STRIDE
+from jobs import JobRunner, TaskPool
 import json
+import logging
 
 import random
 
+from pathplan import trace
+
+log = logging.getLogger('pathplan.gui')
+
 colors = ['r', 'b', 'y']
 
 class Gui(QWidget):
@@ -34,33 +38,55 @@ class Gui(QWidget):
         self.current_params = json.load(open(self.default_params))
         self.params = {}
         self.paths = {}
+        self.job_items = {}
+        self.next_path = 0
+        self.next_flight = 0
         self.start_dialogs()
+        self.next_path = len(self.paths)
+
+        self.jobs = JobRunner(parent=self)
+        self.jobs.progress.connect(self.job_progress)
+        self.jobs.finished.connect(self.job_finished)
+        self.jobs.failed.connect(self.job_failed)
+        self.jobs.cancelled.connect(self.job_cancelled)
+
+        #Pairwise metrics keyed by (path hash, path hash, metric name)
+        self.metrics = {}
+        self.path_keys = {}
+        self.metric_pool = TaskPool(parent=self)
+        self.metric_pool.done.connect(self.metric_done)
+        self.metric_pool.failed.connect(self.metric_failed)
 
         self.fig = Figure()
         self.plotter = FigureCanvas(self.fig)
+        self.view = PathView(self.fig)
 
 
         self.surface = None
         self.load_lines()
         self.surface_checked = False
         self.init_ui()
-        print(self.paths, "self.paths")
-        print(self.current_paths, "self.current_paths")
-        print(self.params, "self.params")
-
-    def plot_surface_difference(self, path1, path2, ax):
-        display_surface(path1, path2, ax)
+        log.debug("paths %s", self.paths)
+        log.debug("params %s", self.params)
 
     def load_paths(self):
-        for path in self.tc['results']:
-            print(path)
-            self.paths[path],_  = read_init_path(self.tc['results'][path]['gen-path'])
-            self.params[path] = json.load(open(self.tc['results'][path]['params']))
-
-            if 'flight_path' in self.tc['results'][path]:
-                self.flights[path] = read_init_path(test_dict['results'][path_name]['flight_path'])
+        results = self.case.results
+        for path in results:
+            log.debug("loading result %s", path)
+            self.paths[path] = self.case.result_path(path)
+            self.params[path] = json.load(open(results[path]['params']))
+
+            if 'flight_path' in results[path]:
+                self.flights[path] = self.case.result_path(path, 'flight_path')
             
 
+    def path_key(self, name, path):
+        if name not in self.path_keys or self.path_keys[name][0] is not path:
+            self.path_keys[name] = (path, path_key(path))
+        return self.path_keys[name][1]
+
+    #Shows the cached metrics of the selected paths, the missing pairwise
+    #ones are computed in the background and filled in as they finish
     def update_calculations(self):
         vals = []
         for (name,path) in self.current_paths:
@@ -70,13 +96,28 @@ class Gui(QWidget):
             for j in range(i+1, len(self.current_paths)):
                 n1,p1 = self.current_paths[i]
                 n2,p2 = self.current_paths[j]
-                vals.append(get_comparison_stats(p1, p2, n1, n2))
+                for metric, _ in COMPARISON_METRICS:
+                    key = (self.path_key(n1, p1), self.path_key(n2, p2), metric)
+                    if key in self.metrics:
+                        vals.append(format_comparison(metric, n1, n2, self.metrics[key]))
+                    else:
+                        vals.append(format_comparison(metric, n1, n2, '...'))
+                        self.metric_pool.submit(key, comparison_metric, metric, p1, p2)
+
+        self.metric_printout.setText('\n'.join(vals))
+
+    def metric_done(self, key, val):
+        self.metrics[key] = val
+        self.update_calculations()
 
-        self.metric_printout.setText('\n'.join(vals))        
+    def metric_failed(self, key, error):
+        log.error(error)
+        self.metrics[key] = 'failed'
+        self.update_calculations()
                     
 
     def load_lines(self):
-        self.surface = json.load(open(self.tc['lines']))
+        self.surface = self.case.lines
 
     def change_selected_paths(self):
         selected_items = self.path_list.selectedItems()
@@ -154,7 +195,7 @@ class Gui(QWidget):
         self.flight_checkbox.stateChanged.connect(lambda state: self.flight_checked_change("flight", state))
         vbox.addWidget(self.flight_checkbox)
 
-        self.lidar_checkbox = QCheckBox("Lidar Penetration View")
+        self.lidar_checkbox = QCheckBox("Lidar Coverage View")
         self.lidar_checkbox.stateChanged.connect(lambda state: self.lidar_checked_change(state))
         vbox.addWidget(self.lidar_checkbox)
 
@@ -172,9 +213,6 @@ class Gui(QWidget):
         self.flight_checked = state == Qt.Checked
         self.change_selected_paths()
 
-    def plot_lidar_penetration(self, path, distance, ax):
-        plot_lidar(path, distance, ax=ax)
-
     def surface_checked_change(self, state):
         self.surface_checked = state == Qt.Checked
         self.change_selected_paths()
@@ -188,7 +226,7 @@ class Gui(QWidget):
     def start_dialogs(self):
         fname = QFileDialog.getOpenFileName(self, 'Load In Test Case File', os.getcwd())
          
-        print(fname)
+        log.debug("test case %s", fname)
         if fname[0]:
             self.test_case = fname[0]
             fname = fname[0]
@@ -207,10 +245,10 @@ class Gui(QWidget):
                 sys.exit()
             fname = basename(os.path.splitext(self.path_file)[0]) + ".test"
             create_test_case(fname, self.be_dem, self.path_file, True, 'doesnt matter')
+            self.test_case = fname
 
-        self.init_path, self.alt_dict, self.shapes, self.tif, self.utm_projection, self.tif_projection, self.tc = load_test_case(self.test_case)
-
-        self.raster = rasterio.open(self.tc['tif'])
+        self.case = load_test_case(self.test_case)
+        self.tc = self.case.dict
 
         self.load_paths()
         if 'init' not in self.tc:
@@ -221,61 +259,93 @@ class Gui(QWidget):
         self.current_paths = [val for val in self.paths.items()]
           
           
+    #The first path is the ('surface', lines) profile, shown in 2D
     def plot(self, *paths, **kwargs):
+        surface, paths = paths[0], list(paths[1:])
+        colors = list(kwargs.get('colors', []))
         if self.flight_checked:
             for (name,_) in self.current_paths:
                 if name in self.flights:
-                    paths.append(name+'-flight', self.flights[name])
-        if self.two_d:
-            ax = self.fig.add_subplot(111) 
-            ax.clear()
-            plot2d(*paths, ax=ax, **kwargs)
-
-            if self.lidar_checked:
-                for (name,path) in self.current_paths:
-                    be_buf = self.current_params['be_buffer']
-                    print('plotting lidar')
-                    self.plot_lidar_penetration(path, be_buf,  ax)
+                    paths.append((name+'-flight', self.flights[name]))
+                    colors.append('g')
+
+        if self.lidar_checked:
+            dsm = (self.case.tif[0, :, :], self.case.raster, self.case.proj)
+            lidar = (self.current_params.get('lidar_fov', DEFAULT_FOV), self.current_params.get('lidar_range', DEFAULT_RANGE))
+            self.view.show('coverage', paths, colors, surface=dsm, lidar=lidar)
+        elif self.two_d:
+            self.view.show('2d', paths, colors, surface=surface, surf_color=kwargs.get('surf_color', 'r'))
         else:
-            ax = self.fig.add_subplot(111, projection='3d')
-            ax.clear()
-            if paths[0][0] == 'surface':
-                plot3d(self.tif[0, :, :], self.raster, self.utm_projection, *paths[1:], ax=ax, **kwargs)
-            else:
-                kwargs['plot_surface'] = False
-                plot3d(self.tif[0, :, :], self.raster, self.utm_projection, *paths, ax=ax, **kwargs)
-
-            if self.diff_checked and len(self.current_paths) > 1:
-                for i in range(0, len(self.current_paths)):
-                    for j in range(i+1, len(self.current_paths)):
-                        p1 = self.current_paths[i][1]
-                        p2 = self.current_paths[j][1]
-                        display_surface(p1, p2, ax)
-
-
-        self.plotter.draw()
-        
+            dsm = (self.case.tif[0, :, :], self.case.raster, self.case.proj) if self.surface_checked else None
+            self.view.show('3d', paths, colors, surface=dsm, diffs=self.diff_checked)
 
+    #Queues planning with the current slider values, can be clicked again
+    #while earlier paths are still being planned
     def add_path(self):
         parms = {parm:slider.value() for (parm,(slider,_)) in self.slider_dict.items()}
-        path_name = 'path-{0}'.format(len(self.paths))
+        path_name = 'path-{0}'.format(self.next_path)
+        self.next_path += 1
         filename = 'tests/params/{0}.json'.format(path_name)
         json.dump(parms, open(filename, 'w'))
-        self.paths[path_name] = generate_path(self.test_case, path_name, filename)
         self.params[path_name] = parms
-        self.path_list.addItem(path_name)
-        last_item = self.path_list.item(len(self.path_list)-1)
-        self.path_list.setCurrentItem(last_item)
+        self.jobs.submit('gen:' + path_name, generate_path, self.test_case, path_name, filename)
+
+    #Every flight gets its own SITL instance so several can run at once
+    def fly_path(self, path_name):
+        port = BASE_PORT + PORT_STRIDE * self.next_flight
+        self.next_flight += 1
+        self.jobs.submit('fly:' + path_name, generate_flight, self.test_case, path_name, port)
+
+    def job_progress(self, job_id, status):
+        if job_id not in self.job_items:
+            self.job_items[job_id] = QListWidgetItem(self.job_list)
+        self.job_items[job_id].setText("{0}: {1}".format(job_id, status))
+
+    def remove_job(self, job_id):
+        item = self.job_items.pop(job_id, None)
+        if item is not None:
+            self.job_list.takeItem(self.job_list.row(item))
+
+    def job_finished(self, job_id, result):
+        #the flight farm hands back a failed flight's exception as its result
+        if isinstance(result, Exception):
+            self.job_failed(job_id, repr(result))
+            return
+
+        self.remove_job(job_id)
+        kind, path_name = job_id.split(':', 1)
+
+        if kind == 'gen':
+            self.paths[path_name] = result
+            self.path_list.addItem(path_name)
+            last_item = self.path_list.item(len(self.path_list)-1)
+            self.path_list.setCurrentItem(last_item)
+        elif kind == 'fly':
+            if path_name in self.case.results and 'flight_path' in self.case.results[path_name]:
+                self.flights[path_name] = self.case.result_path(path_name, 'flight_path')
 
         self.change_selected_paths()
-        
 
-        
+    def job_failed(self, job_id, error):
+        log.error("%s failed: %s", job_id, error)
+        self.job_progress(job_id, 'failed')
 
-    def fly_path(self, path_name):
-        flown_path = generate_flight(self.test_case, path_name, 5760, 'tests/flights/{0}'.format(path_name))
+    def job_cancelled(self, job_id):
+        self.remove_job(job_id)
+
+    def cancel_jobs(self):
+        for item in self.job_list.selectedItems():
+            for job_id, job_item in list(self.job_items.items()):
+                if job_item is item:
+                    if job_id in self.jobs.jobs():
+                        self.jobs.cancel(job_id)
+                    else:
+                        self.remove_job(job_id)
 
-        self.flights[path_name] = flown_path
+    def closeEvent(self, event):
+        self.jobs.shutdown()
+        self.metric_pool.shutdown()
+        super(Gui, self).closeEvent(event)
 
         
 
@@ -313,6 +383,14 @@ class Gui(QWidget):
         self.fly_button.clicked.connect(lambda x: self.fly_path(self.path_list.currentItem().text()))
         self.parm_vbox.addWidget(self.fly_button)
 
+        self.job_list = QListWidget(self)
+        self.job_list.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.parm_vbox.addWidget(self.job_list)
+
+        self.cancel_button = QPushButton("Cancel", self)
+        self.cancel_button.clicked.connect(self.cancel_jobs)
+        self.parm_vbox.addWidget(self.cancel_button)
+
         self.param_list.setLayout(self.parm_vbox)
 
         grid.addWidget(self.path_list, 1, 1)
@@ -367,6 +445,7 @@ class Gui(QWidget):
 
 
 if __name__ =='__main__':
+    trace.configure_from_env()
     app = QApplication(sys.argv)
     gui = Gui()
     sys.exit(app.exec_())
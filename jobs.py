@@ -0,0 +1,178 @@
+'''
+Runs the GUI's long tasks (path planning, flights) in worker processes so
+the Qt event loop never blocks on them.
+
+Jobs are queued and started as workers free up. Their progress and results
+come back as Qt signals, delivered on the GUI thread by a polling timer, and
+any job can be cancelled whether it is still queued or already running.
+
+Short tasks (metrics) go to a TaskPool instead, whose worker processes stay
+up between tasks.
+'''
+
+import multiprocessing
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+POLL_INTERVAL = 200
+DEFAULT_WORKERS = 2
+
+
+def _run(conn, fn, args):
+    conn.send(('progress', 'running'))
+    try:
+        conn.send(('finished', fn(*args)))
+    except Exception:
+        conn.send(('failed', traceback.format_exc()))
+    finally:
+        conn.close()
+
+
+class JobRunner(QObject):
+    """
+    Runs fn(*args) jobs on at most `workers` processes at once.
+
+    Signals (all carry the job id first):
+        progress - status message ('queued', 'running')
+        finished - the job's return value
+        failed - the traceback of the exception the job raised
+        cancelled - the job was cancelled
+    """
+
+    progress = pyqtSignal(str, str)
+    finished = pyqtSignal(str, object)
+    failed = pyqtSignal(str, str)
+    cancelled = pyqtSignal(str)
+
+    def __init__(self, workers=DEFAULT_WORKERS, parent=None):
+        super(JobRunner, self).__init__(parent)
+        self.workers = workers
+        self._ctx = multiprocessing.get_context('spawn')
+        self._pending = []
+        self._running = {}
+
+        self._timer = QTimer(self)
+        self._timer.setInterval(POLL_INTERVAL)
+        self._timer.timeout.connect(self._poll)
+
+    def submit(self, job_id, fn, *args):
+        """
+        Queues fn(*args). fn and args must be picklable
+        """
+        self._pending.append((job_id, fn, args))
+        self.progress.emit(job_id, 'queued')
+        self._start_pending()
+
+    def cancel(self, job_id):
+        for job in list(self._pending):
+            if job[0] == job_id:
+                self._pending.remove(job)
+                self.cancelled.emit(job_id)
+                return
+
+        if job_id in self._running:
+            process, conn = self._running.pop(job_id)
+            process.terminate()
+            process.join()
+            conn.close()
+            self.cancelled.emit(job_id)
+            self._start_pending()
+
+    def shutdown(self):
+        for job_id, _, _ in list(self._pending):
+            self.cancel(job_id)
+        for job_id in list(self._running):
+            self.cancel(job_id)
+
+    def jobs(self):
+        """
+        Ids of the running and queued jobs
+        """
+        return list(self._running) + [job_id for job_id, _, _ in self._pending]
+
+    def _start_pending(self):
+        while self._pending and len(self._running) < self.workers:
+            job_id, fn, args = self._pending.pop(0)
+            parent_conn, child_conn = self._ctx.Pipe(duplex=False)
+            process = self._ctx.Process(target=_run, args=(child_conn, fn, args))
+            process.daemon = True
+            process.start()
+            child_conn.close()
+            self._running[job_id] = (process, parent_conn)
+
+        if self._running:
+            self._timer.start()
+        else:
+            self._timer.stop()
+
+    def _poll(self):
+        for job_id, (process, conn) in list(self._running.items()):
+            done = False
+            try:
+                while conn.poll():
+                    kind, value = conn.recv()
+                    if kind == 'progress':
+                        self.progress.emit(job_id, value)
+                    else:
+                        done = True
+                        getattr(self, kind).emit(job_id, value)
+            except EOFError:
+                if not done:
+                    done = True
+                    self.failed.emit(job_id, "worker exited with code {0}".format(process.exitcode))
+
+            if done:
+                process.join()
+                conn.close()
+                del self._running[job_id]
+
+        self._start_pending()
+
+
+class TaskPool(QObject):
+    """
+    Runs short fn(*args) tasks on a pool of long lived worker processes,
+    each task identified by a hashable key. A key that is already running
+    is not submitted again.
+
+    Signals (all carry the task key first):
+        done - the task's return value
+        failed - the traceback of the exception the task raised
+    """
+
+    done = pyqtSignal(object, object)
+    failed = pyqtSignal(object, str)
+
+    def __init__(self, workers=DEFAULT_WORKERS, parent=None):
+        super(TaskPool, self).__init__(parent)
+        self._executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+        self._pending = {}
+
+    def submit(self, key, fn, *args):
+        if key in self._pending:
+            return
+        future = self._executor.submit(fn, *args)
+        self._pending[key] = future
+        # The callback runs on an executor thread, emitting queues the
+        # signal onto the GUI thread
+        future.add_done_callback(lambda future, key=key: self._done(key, future))
+
+    def _done(self, key, future):
+        self._pending.pop(key, None)
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            self.failed.emit(key, ''.join(traceback.format_exception(type(error), error, error.__traceback__)))
+        else:
+            self.done.emit(key, future.result())
+
+    def pending(self):
+        return set(self._pending)
+
+    def shutdown(self):
+        for future in list(self._pending.values()):
+            future.cancel()
+        self._executor.shutdown(wait=False)
@@ -1,125 +1,133 @@
 #WELCOME TO THE MASTER VIZ/EVALUATION SCRIPT
-import subprocess
 import traceback
-from shapely.strtree import STRtree
 import json
-from shapely.geometry import MultiPolygon
-from shapely.wkb import dumps
+import logging
 from os.path import basename, splitext
+import numpy as np
 
-from pathplan.geo import vectorize_raster, shapelify_vector, read_tif, load_shapefile, load_altfile
-from pathplan.path_planner import plan_path
+from pathplan.path_planner import plan_checked_path
 from pathplan.utils import read_init_path, save_path
-import pathplan.sitl as sitl
-from pathplan.evaluation import calculate_intersections, mse, print_comparison_info
+from pathplan.sweep import grid_configs, random_configs, run_sweep
+from pathplan.pathfile import read_path_timestamps
+from pathplan.testcase import TestCase
+from pathplan.results import atomic_json_dump
+from pathplan.farm import FlightFarm, BASE_PORT, PORT_STRIDE
+from pathplan.evaluation import mse, print_comparison_info, score_flight
+from pathplan import trace
 
+log = logging.getLogger('pathplan.main')
 
-#returns path json, alt file, shapefile, and tif
-def load_test_case(case_file):
-    test_dict = json.load(open(case_file))
-    path, pro = read_init_path(test_dict['path'])
-    tif, tif_proj = read_tif(test_dict['tif'])
-    if "shapes" not in test_dict:
-        test_dict['shapes'] = "gen/shapes/{0}.shapes".format(splitext(case_file)[0])
-        test_dict['alts'] = "gen/shapes/{0}.alt.json".format(splitext(case_file)[0])
-        save_test_case(case_file,test_dict)
-
-        vecs = vectorize_raster(test_dict['tif'])
-        shapes, alt = shapelify_vector(vecs, test_dict['proj'])
-        binary = dumps(MultiPolygon(shapes))
-
-        with open(test_dict['shapes'], "wb") as wkb_file:
-            wkb_file.write(binary)
-         	
-        with open(test_dict['alts'], "w") as alt_dict_file:
-            json.dump(alt, alt_dict_file)
-    else:
-        shapes = load_shapefile(test_dict['shapes'])
-        alt = load_altfile(test_dict['alts'])
 
-    return path, alt, shapes, tif, pro, tif_proj, test_dict
+#returns the TestCase, whose paths, tif, shapes and alt dict load on first use
+def load_test_case(case_file):
+    return TestCase.load(case_file)
 
-def gen_path(path, alt, shapes, tif, proj, tif_proj, test_case, path_name, params_file, case_file):
+def gen_path(case, path_name, params_file):
     params = json.load(open(params_file))
-    tree = STRtree(shapes)
+    # The planner and the clearance checks both work off the required altitude
+    # surface, which includes the canopy buffer and everything within
+    # obs_buffer of the path, and both add be_buffer to it
+    with trace.span('index_build'):
+        index = case.required_index(params['be_buffer'], params['obs_buffer'])
+    proj = case.proj
 
-    case_name = basename(splitext(case_file)[0])
+    case_name = basename(splitext(case.case_file)[0])
 
-    gen_path, lines = plan_path(path, tree, alt, params['be_buffer'],params['obs_buffer'], params['min_length'], params['climb_rate'], params['descent_rate'], params['max_speed'], params['min_speed']) 
+    clearance = case.required_clearance(params['be_buffer'], params['obs_buffer'])
+    with trace.span('plan', path=path_name):
+        gen_path, lines, report = plan_checked_path(case.path, index, clearance, params)
+
+    if len(report.violations) > 0:
+        log.warning("%s dips below the clearance envelope over %s", path_name, report.violations)
 
     lines_file = 'tests/lines/{0}.json'.format(case_name)
-    json.dump(lines, open(lines_file, 'w'))
+    atomic_json_dump(lines, lines_file)
 
-    test_case['lines'] = lines_file
+    if case.dict.get('lines') != lines_file:
+        case.dict['lines'] = lines_file
+        case.save()
 
-    path_loc = 'tests/gen-paths/{0}.json'.format(path_name)
-    save_path(path_loc, gen_path,  proj)
-    test_case['results'][path_name] = {}
-    test_case['results'][path_name]['gen-path'] = path_loc
-    test_case['results'][path_name]['params'] = params_file
-    save_test_case(case_file,test_case)
+    path_loc = 'tests/gen-paths/{0}.path'.format(path_name)
+    provenance = {'planner': 'shapely', 'case': case.case_file, 'params': params_file}
+    save_path(path_loc, gen_path,  proj, provenance)
+    info = {'min_clearance': report.min_clearance, 'violations': report.violations}
+    case.record_path(path_name, path_loc, params_file, params, info)
 
     return gen_path
 
 def generate_path(case_file, path_name, params_file): 
-    path, alt, shapes, tif, pro, tif_proj, test_case = load_test_case(case_file)
-    return gen_path(path, alt, shapes, tif, pro, tif_proj, test_case, path_name, params_file, case_file)
+    return gen_path(load_test_case(case_file), path_name, params_file)
+
+def sweep_params(case_file, out_file, params_file, grid=None, ranges=None, count=20, base=None, processes=None):
+    case = load_test_case(case_file)
+    params = json.load(open(params_file))
+
+    if grid != None:
+        configs = grid_configs(params, grid)
+    else:
+        configs = random_configs(params, ranges, count)
+
+    base_path = case.results[base]['gen-path'] if base != None else None
+
+    return run_sweep(configs, case['path'], case['tif'], out_file, base_path, processes, case['proj'], case.dict.get('canopy'))
 
 def save_test_case(case_name, test_dict):
-    print(case_name, "case name")
-    json.dump(test_dict, open(case_name, "w"))
+    log.debug("saving test case %s", case_name)
+    atomic_json_dump(test_dict, case_name)
 
 
 import os
 
+def flight_logdir(case_name, path_name):
+    return "tests/flights/{0}/{1}".format(basename(splitext(case_name)[0]), path_name)
+
+def generate_flights(case_name, path_names, instances=2, first_instance=0):
+    case = load_test_case(case_name)
+    results = case.results
+    jobs = []
+    for path_name in path_names:
+        if path_name not in results:
+            print("Could not find the named path", path_name)
+            continue
+        jobs.append((path_name, results[path_name]['gen-path'], case['tif'], flight_logdir(case_name, path_name)))
+
+    def record_flight(path_name, flown_path):
+        flight_loc = "tests/flights/{0}-{1}.json".format(basename(splitext(case_name)[0]), path_name)
+        atomic_json_dump(flown_path, flight_loc)
+        case.record_flight(path_name, flight_loc, flight_logdir(case_name, path_name))
+
+    farm = FlightFarm(min(instances, max(len(jobs), 1)), first_instance)
+    return farm.run(jobs, on_result=record_flight)
+
 def generate_flight(case_name, path_name, port):
-    path, alt, shapes, tif,proj, tif_proj, test_dict = load_test_case(case_name)
-    print(path_name)
-    if path_name not in test_dict['results']:
-        print("Could not find the named path")
-        return
+    flights = generate_flights(case_name, [path_name], 1, (port - BASE_PORT) // PORT_STRIDE)
+    return flights.get(path_name)
     
-    os.chdir(os.path.expanduser('~/CSE145/AerialLidarPP'))
-    subprocess.call(["make", "killsitl"])
-    subprocess.call(["make", "runsitl"])
-    bin_path = sitl.fly(port, test_dict['results'][path_name]['gen-path'], "tests/flights/{0}".format(case_name))
-    flown_path = sitl.parse_bins(bin_path)
-    flight_loc = "tests/flights/{0}.json".format(case_name)
-    json.dump(flown_path, open(flight_loc, "w")), 
-    test_dict['results'][path_name]['flight_path'] = flight_loc
-    save_test_case(case_name,test_dict)
-
-    return flown_path
     
-    
-
-#takes 
-from pathplan.viz import plot2d, plot3d
 
-import rasterio
+#Plotting and scipy are only imported by the commands that use them, so
+#batch planning starts without them
 def plot_3d_one(case_name, *path_names):
-    path, alt, shapes, tif,proj, test_dict = load_test_case(case_name)
+    from pathplan.viz import plot3d
+    case = load_test_case(case_name)
 
-    raster = rasterio.open('tests/'+test_dict['tif'])
     paths = []
   
     for path_name in path_names:
-        path, _ = read_init_path(test_dict['results'][path_name]['gen-path'])
-        paths.append((path_name, path))
+        paths.append((path_name, case.result_path(path_name)))
 
-    plot3d(tif,raster,proj, *paths)
+    plot3d(case.tif[0, :, :], case.raster, case.proj, *paths)
 
 def plot_2d_one(case_name, *plots):
+    from pathplan.viz import plot2d
     paths = []
-    path, alt, shapes, tif,proj, test_dict = load_test_case(case_name)
-    lines = json.load(open(test_dict['lines']))
-    print(lines)
+    case = load_test_case(case_name)
+    lines = case.lines
     for path_name in plots:
-        print(path_name)
-        path, _ = read_init_path(test_dict['results'][path_name]['gen-path'])
-        path = (path_name, path)
+        log.debug("plotting %s", path_name)
+        path = (path_name, case.result_path(path_name))
         paths.append(path)
-    plot2d(('surface',lines), False, *paths)
+    plot2d(('surface',lines), *paths)
 
 
 def create_test_case(case_name, tif_path, path_path, proj, param):
@@ -128,24 +136,51 @@ def create_test_case(case_name, tif_path, path_path, proj, param):
 
 
 def compare_to_flight(case_name, path_name):
-    path, alt, shapes, tif,proj, test_dict = load_test_case(case_name)
-    flight,_ = read_init_path(test_dict['results'][path_name]['flight_path'])
+    case = load_test_case(case_name)
+    flight = case.result_path(path_name, 'flight_path')
     
-    perform_comparisons(test_dict, (flight, "flight"), path_name)
+    perform_comparisons(case, (flight, "flight"), path_name)
+
+#Streams the flight logs instead of loading the parsed flight path
+def score_flight_logs(case_name, path_name, alt_offset=0):
+    from pathplan.sitl import iter_gps_chunks
+
+    case = load_test_case(case_name)
+    planned = case.result_path(path_name)
+
+    errors = score_flight(planned, iter_gps_chunks(case.results[path_name]['flight_logs']), case.proj, alt_offset)
+    summary = errors.summary()
+    for (name, val) in sorted(summary.items()):
+        print("  {0} = {1}".format(name, val))
+    case.record_metrics(path_name, {'flight_' + name: float(val) for (name, val) in summary.items()})
+    return errors
+
+def align_flight(case_name, path_name, speed=None):
+    from pathplan.alignment import align_trajectory
+    case = load_test_case(case_name)
+    planned = case.result_path(path_name)
+    flight = case.result_path(path_name, 'flight_path')
+
+    alignment = align_trajectory(planned, flight, read_path_timestamps(case.results[path_name]['flight_path']), speed)
+    print("  RMS cross track error = {0}".format(np.sqrt(np.mean(alignment.cross_track**2))))
+    print("  RMS vertical error = {0}".format(np.sqrt(np.mean(alignment.vertical**2))))
+    if alignment.along_track_error is not None:
+        print("  RMS along track error = {0}".format(np.sqrt(np.mean(alignment.along_track_error**2))))
+    return alignment
 
 def compare_to_base(case_name, base, *paths):
-    path, alt, shapes, tif,proj, test_dict = load_test_case(case_name)
+    case = load_test_case(case_name)
     base_name = base
-    base, _ = read_init_path(base)
+    base, _ = read_init_path(base, case.proj)
 
-    perform_comparisons(test_dict, (base, base_name), *paths)
+    perform_comparisons(case, (base, base_name), *paths)
     
 
 
-def perform_comparisons(test_case, base, *paths):
+def perform_comparisons(case, base, *paths):
     base, base_name = base
     for path_name in paths:
-        path, _ = read_init_path(test_case['results'][path_name]['gen-path'])
+        path = case.result_path(path_name)
         print_comparison_info(base, path, base_name, path_name)
     
     
@@ -169,6 +204,7 @@ def print_commands():
 
 if __name__ == '__main__':
      import sys
+     trace.configure_from_env()
      generate_flight(sys.argv[1], sys.argv[2], 5760)
      
 #    print("Welcome to the interactive testing/evaluation setup for the Aerial Lidar project")
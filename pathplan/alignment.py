@@ -0,0 +1,104 @@
+'''
+Aligns a flown trajectory to the planned path.
+
+Every flown sample is projected onto the planned polyline in one vectorized
+pass. Candidate segments come from a KD-tree over points sampled along each
+segment, so the cost is O((N + M) log M) instead of comparing every flown
+point with every planned point.
+'''
+
+from collections import namedtuple
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+Alignment = namedtuple('Alignment', ['timestamp', 'along_track', 'along_track_error', 'cross_track', 'vertical', 'segment'])
+
+
+def segment_index(planned, spacing=1.0):
+    """
+    Builds a spatial index over the segments of a path.
+
+    Returns:
+        cKDTree over points sampled every `spacing` along the path, and the
+        segment each of those points belongs to
+    """
+    points = np.asarray(planned, dtype=float)
+    starts = points[:-1, :2]
+    deltas = points[1:, :2] - starts
+    lengths = np.hypot(deltas[:, 0], deltas[:, 1])
+
+    counts = np.maximum(np.ceil(lengths / spacing).astype(int), 1) + 1
+    offsets = np.concatenate(([0], np.cumsum(counts)))[:-1]
+    seg = np.repeat(np.arange(len(counts)), counts)
+    t = (np.arange(counts.sum()) - offsets[seg]) / (counts[seg] - 1).astype(float)
+
+    samples = starts[seg] + deltas[seg] * t[:, np.newaxis]
+    return cKDTree(samples), seg
+
+
+def align_trajectory(planned, flown, timestamps=None, speed=None, spacing=1.0, candidates=4, index=None):
+    """
+    Projects every flown sample onto the planned path.
+
+    Args:
+        planned - list of planned (x, y, z) waypoints
+        flown - list/np-array of flown (x, y, z) points, in the same units
+        timestamps - optional flight time of every flown point
+        speed - planned horizontal speed; with timestamps, gives the along
+                track error against where the vehicle should have been
+        spacing - distance between the indexed points along each segment
+        candidates - number of nearest indexed points to take candidate
+                     segments from
+        index - segment_index of the planned path, to reuse it across calls
+
+    Returns:
+        Alignment of arrays holding, per flown sample, its timestamp, its
+        distance along the planned path, the along track error (None without
+        timestamps and speed), the signed cross track error (positive to the
+        left of the path), the vertical error and the segment it projects to
+    """
+    plan = np.asarray(planned, dtype=float)
+    flown = np.asarray(flown, dtype=float)
+
+    tree, sample_seg = index if index is not None else segment_index(plan, spacing)
+    k = min(candidates, tree.n)
+    _, nearest = tree.query(flown[:, :2], k=k)
+    cand = sample_seg[nearest.reshape(len(flown), k)]
+
+    a = plan[cand]
+    d = plan[cand + 1] - a
+    p = flown[:, np.newaxis, :]
+
+    len2 = d[..., 0]**2 + d[..., 1]**2
+    dot = (p[..., 0] - a[..., 0]) * d[..., 0] + (p[..., 1] - a[..., 1]) * d[..., 1]
+    t = np.clip(np.where(len2 > 0, dot / np.where(len2 > 0, len2, 1), 0), 0, 1)
+
+    px = a[..., 0] + d[..., 0] * t
+    py = a[..., 1] + d[..., 1] * t
+    dist2 = (p[..., 0] - px)**2 + (p[..., 1] - py)**2
+
+    best = np.argmin(dist2, axis=1)
+    rows = np.arange(len(flown))
+    seg = cand[rows, best]
+    t = t[rows, best]
+    a = a[rows, best]
+    d = d[rows, best]
+
+    lengths = np.hypot(np.diff(plan[:, 0]), np.diff(plan[:, 1]))
+    along_start = np.concatenate(([0], np.cumsum(lengths)))
+    along = along_start[seg] + lengths[seg] * t
+
+    cross = (d[:, 0] * (flown[:, 1] - a[:, 1]) - d[:, 1] * (flown[:, 0] - a[:, 0]))
+    seg_len = lengths[seg]
+    cross = np.where(seg_len > 0, cross / np.where(seg_len > 0, seg_len, 1), np.sqrt(dist2[rows, best]))
+
+    vertical = flown[:, 2] - (a[:, 2] + d[:, 2] * t)
+
+    along_error = None
+    if timestamps is not None:
+        timestamps = np.asarray(timestamps, dtype=float)
+        if speed is not None:
+            along_error = along - speed * (timestamps - timestamps[0])
+
+    return Alignment(timestamps, along, along_error, cross, vertical, seg)
@@ -0,0 +1,171 @@
+'''
+Raster based clearance checks for planned paths.
+
+Paths are sampled densely along their length and compared against a
+clearance envelope (surface + buffer) in one vectorized pass, so every
+generated path can be verified before it is uploaded.
+'''
+
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+import pyproj
+
+from pathplan import trace
+
+WINDOW_PIXELS = 512
+CACHE_WINDOWS = 64
+
+ClearanceReport = namedtuple('ClearanceReport', ['distance', 'clearance', 'min_clearance', 'violations'])
+
+
+def raster_clearance(surface, buf, affine=None, src_proj=None, dst_proj=None):
+    """
+    Builds a vectorized clearance function from a raster.
+
+    Args:
+        surface - 2d array of surface heights (axis 0 is y)
+        buf - height to stay above the surface
+        affine - transform from raster to world coordinates. If None, path
+                 coordinates are taken to be (col, row) pixel coordinates
+        src_proj, dst_proj - if given, path coordinates are transformed from
+                 src_proj to dst_proj (the raster CRS) before sampling
+
+    Returns:
+        function mapping arrays of xs, ys to the minimum safe altitude
+    """
+    rows, cols = surface.shape
+    inverse = ~affine if affine is not None else None
+
+    def clearance(xs, ys):
+        if src_proj is not None and dst_proj is not None:
+            xs, ys = pyproj.transform(src_proj, dst_proj, xs, ys)
+        if inverse is not None:
+            xs, ys = inverse * (np.asarray(xs), np.asarray(ys))
+        col = np.clip(np.asarray(xs).astype(int), 0, cols - 1)
+        row = np.clip(np.asarray(ys).astype(int), 0, rows - 1)
+        return surface[row, col] + buf
+
+    return clearance
+
+
+def windowed_clearance(read_window, shape, buf, affine=None, src_proj=None, dst_proj=None,
+                       window_pixels=WINDOW_PIXELS, cache_windows=CACHE_WINDOWS):
+    """
+    Builds a vectorized clearance function like raster_clearance, over a
+    surface read one square window at a time as samples reach it, so only
+    the windows along the path are ever held.
+
+    Args:
+        read_window - function returning the surface heights over a window
+                      ((row_start, row_stop), (col_start, col_stop))
+        shape - (rows, cols) of the whole surface
+        buf, affine, src_proj, dst_proj - as for raster_clearance
+        window_pixels - side of the windows
+        cache_windows - most windows kept at once, the least recently used
+                        are dropped
+
+    Returns:
+        function mapping arrays of xs, ys to the minimum safe altitude
+    """
+    rows, cols = shape
+    inverse = ~affine if affine is not None else None
+    windows = OrderedDict()
+
+    def window(key):
+        if key in windows:
+            windows.move_to_end(key)
+            return windows[key]
+        row, col = key[0] * window_pixels, key[1] * window_pixels
+        with trace.span('clearance_window', row=row, col=col):
+            windows[key] = read_window(((row, min(row + window_pixels, rows)), (col, min(col + window_pixels, cols))))
+        while len(windows) > cache_windows:
+            windows.popitem(last=False)
+        return windows[key]
+
+    def clearance(xs, ys):
+        if src_proj is not None and dst_proj is not None:
+            xs, ys = pyproj.transform(src_proj, dst_proj, xs, ys)
+        if inverse is not None:
+            xs, ys = inverse * (np.asarray(xs), np.asarray(ys))
+        col = np.clip(np.asarray(xs).astype(int), 0, cols - 1)
+        row = np.clip(np.asarray(ys).astype(int), 0, rows - 1)
+
+        heights = np.zeros(row.shape)
+        keys = (row // window_pixels) * ((cols - 1) // window_pixels + 1) + col // window_pixels
+        for key in np.unique(keys).tolist():
+            at = keys == key
+            block_row, block_col = divmod(key, (cols - 1) // window_pixels + 1)
+            heights[at] = window((block_row, block_col))[row[at] - block_row * window_pixels,
+                                                         col[at] - block_col * window_pixels]
+        return heights + buf
+
+    return clearance
+
+
+def sample_path(path, spacing=1.0):
+    """
+    Samples a path at least every `spacing` horizontal units. Every segment
+    is sampled including both of its ends, so vertical steps keep both
+    altitudes.
+
+    Returns:
+        arrays of the distance along the path, x, y and z of every sample
+    """
+    points = np.asarray(path, dtype=float)
+    starts = points[:-1]
+    deltas = points[1:] - points[:-1]
+
+    lengths = np.hypot(deltas[:, 0], deltas[:, 1])
+    along = np.concatenate(([0], np.cumsum(lengths)))[:-1]
+
+    counts = np.maximum(np.ceil(lengths / spacing).astype(int), 1) + 1
+    offsets = np.concatenate(([0], np.cumsum(counts)))[:-1]
+
+    seg = np.repeat(np.arange(len(counts)), counts)
+    t = (np.arange(counts.sum()) - offsets[seg]) / (counts[seg] - 1).astype(float)
+
+    xs = starts[seg, 0] + deltas[seg, 0] * t
+    ys = starts[seg, 1] + deltas[seg, 1] * t
+    zs = starts[seg, 2] + deltas[seg, 2] * t
+    dist = along[seg] + lengths[seg] * t
+
+    return dist, xs, ys, zs
+
+
+def violating_intervals(dist, below):
+    """
+    Returns:
+        (start, end) distance along the path of every run of samples where
+        `below` is true
+    """
+    edges = np.diff(np.concatenate(([0], below.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1) - 1
+    return list(zip(dist[starts].tolist(), dist[ends].tolist()))
+
+
+@trace.traced('clearance')
+def check_clearance(path, clearance, spacing=1.0):
+    """
+    Checks a path against a clearance envelope.
+
+    Args:
+        path - list of (x, y, z) waypoints
+        clearance - function mapping arrays of xs, ys to the minimum safe
+                    altitude, see raster_clearance
+        spacing - horizontal distance between samples
+
+    Returns:
+        ClearanceReport with the distance along the path and clearance of
+        every sample, the minimum clearance and the (start, end) distances
+        of the intervals where the path is below the envelope
+    """
+    if len(path) < 2:
+        empty = np.zeros(0)
+        return ClearanceReport(empty, empty, float('inf'), [])
+
+    dist, xs, ys, zs = sample_path(path, spacing)
+    margin = zs - clearance(xs, ys)
+
+    return ClearanceReport(dist, margin, float(margin.min()), violating_intervals(dist, margin < 0))
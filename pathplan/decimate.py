@@ -0,0 +1,97 @@
+'''
+Waypoint decimation for generated paths.
+
+Removes waypoints from a path as long as the straight 3D line that replaces
+them stays above the clearance envelope (terrain + buffer). This is a
+Douglas-Peucker style simplification where the tolerance test is a clearance
+check against the raster profile instead of a distance threshold. Waypoints
+where the horizontal route turns are always kept, so only the waypoints
+within each straight run between them are simplified.
+'''
+
+import logging
+
+import numpy as np
+
+from pathplan import trace
+from pathplan.smoothing import route_corners
+
+log = logging.getLogger(__name__)
+
+
+def chord_is_clear(p0, p1, clearance, spacing):
+    """
+    Checks that the straight line between p0 and p1 stays above the clearance
+    envelope, sampling it every `spacing` horizontal units.
+    """
+    length = ((p1[0] - p0[0])**2 + (p1[1] - p0[1])**2)**.5
+    count = max(int(np.ceil(length / spacing)), 1) + 1
+    t = np.linspace(0, 1, count)
+
+    xs = p0[0] + (p1[0] - p0[0]) * t
+    ys = p0[1] + (p1[1] - p0[1]) * t
+    zs = p0[2] + (p1[2] - p0[2]) * t
+
+    return bool(np.all(zs >= clearance(xs, ys)))
+
+
+@trace.traced('decimate')
+def decimate_path(path, clearance, spacing=1.0):
+    """
+    Removes waypoints whose removal keeps the path above the clearance
+    envelope, never the ones where the route turns.
+
+    Args:
+        path - list of (x, y, z) waypoints
+        clearance - function mapping arrays of xs, ys to the minimum safe
+                    altitude, see raster_clearance
+        spacing - horizontal distance between clearance samples
+
+    Returns:
+        decimated list of (x, y, z) waypoints, reduction ratio
+    """
+    if len(path) < 3:
+        return list(path), 0.0
+
+    points = np.asarray(path, dtype=float)
+    keep = np.zeros(len(points), dtype=bool)
+    corners = route_corners(points)
+    keep[corners] = True
+    keep[0] = keep[-1] = True
+
+    # Horizontal distance along the path, used to find the chord altitude
+    # at every intermediate waypoint
+    steps = np.hypot(np.diff(points[:, 0]), np.diff(points[:, 1]))
+    along = np.concatenate(([0], np.cumsum(steps)))
+
+    bounds = np.flatnonzero(keep)
+    stack = list(zip(bounds[:-1], bounds[1:]))
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+
+        if chord_is_clear(points[first], points[last], clearance, spacing):
+            continue
+
+        # Split at the waypoint furthest (vertically) from the chord, like
+        # Douglas-Peucker does with perpendicular distance
+        span = along[last] - along[first]
+        inner = np.arange(first + 1, last)
+        if span > 0:
+            t = (along[inner] - along[first]) / span
+        else:
+            t = np.zeros(len(inner))
+        chord_z = points[first, 2] + (points[last, 2] - points[first, 2]) * t
+        split = inner[np.argmax(np.abs(points[inner, 2] - chord_z))]
+
+        keep[split] = True
+        stack.append((first, split))
+        stack.append((split, last))
+
+    decimated = [tuple(p) for p in points[keep]]
+    reduction = 1 - len(decimated) / float(len(points))
+
+    log.info("decimated path from %d to %d waypoints (%.1f%% reduction)", len(points), len(decimated), reduction * 100)
+
+    return decimated, reduction
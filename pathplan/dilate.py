@@ -0,0 +1,397 @@
+'''
+Required altitude rasters: lateral obstacle buffers and the fused bare earth
+and canopy clearance surface.
+
+A path has to clear everything within obs_buffer of it horizontally, not just
+the surface directly below. Rather than searching around every sample at
+query time, the surface raster is max filtered once per buffer radius, after
+which sampling the single pixel under the path (or intersecting the shapes
+vectorized from it) already accounts for the surroundings.
+
+The filter is separable and uses the van Herk/Gil-Werman running maximum, so
+it costs a constant few operations per pixel whatever the radius. The window
+is a square, which covers the disk of the buffer radius and so errs on the
+safe side. Rasters are filtered WINDOW_PIXELS (or tile_pixels) square at a
+time, each window read with a halo of the radius around it, so memory
+follows the window size rather than the raster's.
+
+Bare earth and canopy are fused into a single raster,
+max(bare_earth, canopy + canopy_offset), both layers dilated by the lateral
+buffer first. The planners query that one layer instead of two. The altitude
+a path has to fly at is that surface plus be_buffer, with canopy_offset =
+canopy_buffer - be_buffer. be_buffer only moves the whole surface up, so it
+is added at query time (see path_planner.plan_path and
+clearance.raster_clearance) rather than baked in: the surface is built once
+per (raster pair, canopy_offset, lateral buffer), and over bare earth alone
+it is the same for every be_buffer. It is cached on disk along with the
+shapes, or the ragged polygon arrays (see pathplan.polygons), vectorized
+from it.
+'''
+
+import hashlib
+import logging
+import os
+from os.path import basename, splitext
+
+import numpy as np
+
+from pathplan import trace
+from pathplan.testcase import cached_load
+
+log = logging.getLogger(__name__)
+
+DILATED_DIR = 'gen/dilated'
+WINDOW_PIXELS = 2048
+METRES_PER_FOOT = 0.3048
+
+
+def max_filter_1d(a, radius, axis=0):
+    """
+    Maximum over a window of 2 * radius + 1 cells centered on every cell
+    along axis. Cells past the edges are ignored.
+    """
+    a = np.moveaxis(np.asarray(a), axis, -1)
+    if radius <= 0:
+        return np.moveaxis(a.copy(), -1, axis)
+
+    n = a.shape[-1]
+    w = 2 * radius + 1
+    blocks = -(-(n + 2 * radius) // w)
+    fill = np.finfo(a.dtype).min if a.dtype.kind == 'f' else np.iinfo(a.dtype).min
+
+    padded = np.full(a.shape[:-1] + (blocks * w,), fill, dtype=a.dtype)
+    padded[..., radius:radius + n] = a
+
+    # Running maximum from the start (g) and from the end (h) of each block,
+    # any window is then covered by the tail of one block and the head of
+    # the next
+    shaped = padded.reshape(a.shape[:-1] + (blocks, w))
+    g = np.maximum.accumulate(shaped, axis=-1).reshape(padded.shape)
+    h = np.maximum.accumulate(shaped[..., ::-1], axis=-1)[..., ::-1].reshape(padded.shape)
+
+    out = np.maximum(h[..., :n], g[..., w - 1:w - 1 + n])
+    return np.moveaxis(out, -1, axis)
+
+
+def dilate(image, radius):
+    """
+    Maximum of image over a (2 * radius + 1) square around every pixel
+    """
+    return max_filter_1d(max_filter_1d(image, radius, axis=0), radius, axis=1)
+
+
+def pixel_size_metres(affine, crs, shape):
+    """
+    Width and height in metres of the pixels of a raster. For geographic
+    rasters they are taken at the centre of the raster.
+
+    Args:
+        affine - the raster's transform, north up
+        crs - the raster's rasterio CRS
+        shape - (height, width) of the raster
+    """
+    width, height = abs(affine.a), abs(affine.e)
+    if crs.is_geographic:
+        lat = np.radians(affine.f + affine.e * shape[0] / 2.0)
+        metres_per_lat = 111132.92 - 559.82 * np.cos(2 * lat) + 1.175 * np.cos(4 * lat)
+        metres_per_lon = 111412.84 * np.cos(lat) - 93.5 * np.cos(3 * lat)
+        return width * metres_per_lon, height * metres_per_lat
+
+    _, factor = crs.linear_units_factor
+    return width * factor, height * factor
+
+
+def radius_pixels(affine, buf, crs=None, shape=(0, 0)):
+    """
+    Radius in pixels covering a horizontal buffer.
+
+    Args:
+        affine - the raster's transform
+        buf - the buffer in feet, like path altitudes, or in the raster's
+              units if crs is None
+        crs - the raster's rasterio CRS, see pixel_size_metres
+        shape - (height, width) of the raster
+    """
+    if not buf:
+        return 0
+    if crs is None:
+        return int(np.ceil(buf / min(abs(affine.a), abs(affine.e))))
+    return int(np.ceil(buf * METRES_PER_FOOT / min(pixel_size_metres(affine, crs, shape))))
+
+
+def _cache_file(tif_files, buffers, ext):
+    parts = []
+    for tif_file in tif_files:
+        stat = os.stat(tif_file)
+        parts.append("{0}:{1}:{2}".format(os.path.abspath(tif_file), stat.st_mtime, stat.st_size))
+    key = hashlib.sha1("{0}|{1}".format("|".join(parts), buffers).encode()).hexdigest()[:12]
+    stem = "+".join(splitext(basename(tif_file))[0] for tif_file in tif_files)
+    return os.path.join(DILATED_DIR, "{0}-{1}{2}".format(stem, key, ext))
+
+
+def _replace(tmp, filepath):
+    os.replace(tmp, filepath)
+    return filepath
+
+
+def _vector_stem(filepath, do_transform, proj):
+    """
+    Cache path, less the extension, of the surfaces vectorized from the
+    required altitude raster filepath, which differ with the projection
+    """
+    projection = (bool(do_transform), proj.srs if do_transform and proj is not None else None)
+    return _cache_file([filepath], projection, '')
+
+
+def _tif_files(be_tif, canopy_tif):
+    return [be_tif] if canopy_tif is None else [be_tif, canopy_tif]
+
+
+def halo_window(window, radius, shape):
+    """
+    A window grown by radius pixels on every side, clipped to a raster of
+    the given (height, width), and the slices of the window within it.
+    Dilating the grown window and cropping it gives the same pixels as
+    dilating the whole raster.
+
+    Args:
+        window - ((row_start, row_stop), (col_start, col_stop))
+    """
+    (row_start, row_stop), (col_start, col_stop) = window
+    height, width = shape
+    top, left = max(row_start - radius, 0), max(col_start - radius, 0)
+    bottom, right = min(row_stop + radius, height), min(col_stop + radius, width)
+    inner = (slice(row_start - top, row_stop - top), slice(col_start - left, col_stop - left))
+    return ((top, bottom), (left, right)), inner
+
+
+def _windows(shape, window_pixels):
+    height, width = shape
+    for row in range(0, height, window_pixels):
+        for col in range(0, width, window_pixels):
+            yield (row, min(row + window_pixels, height)), (col, min(col + window_pixels, width))
+
+
+def _open_rasters(be_tif, canopy_tif):
+    """
+    The bare earth and canopy (or None) datasets, checked to be on the same
+    grid
+    """
+    import rasterio
+
+    be_src = rasterio.open(be_tif)
+    if canopy_tif is None:
+        return be_src, None
+
+    canopy_src = rasterio.open(canopy_tif)
+    if canopy_src.shape != be_src.shape:
+        be_src.close()
+        canopy_src.close()
+        raise ValueError("canopy raster {0} is {1}, bare earth raster {2} is {3}".format(
+            canopy_tif, canopy_src.shape, be_tif, be_src.shape))
+    return be_src, canopy_src
+
+
+def _required_window(be_src, canopy_src, window, canopy_offset, radius):
+    """
+    required_altitude_tif over one window, filtered from the window and a
+    halo of radius pixels around it only
+    """
+    halo, inner = halo_window(window, radius, be_src.shape)
+    bare_earth = be_src.read(1, window=halo)
+    required = dilate(bare_earth, radius)[inner].astype(np.result_type(bare_earth.dtype, np.float32))
+    if canopy_src is not None:
+        np.maximum(required, dilate(canopy_src.read(1, window=halo), radius)[inner] + canopy_offset, out=required)
+    return required
+
+
+def required_altitude_tif(be_tif, canopy_tif=None, canopy_offset=0, lateral_buffer=0):
+    """
+    Path of a GeoTIFF holding the altitude a path has to fly at over every
+    pixel, less be_buffer, written on first use. The rasters are filtered
+    and written WINDOW_PIXELS square at a time.
+
+    Args:
+        be_tif - bare earth raster
+        canopy_tif - canopy raster on the same grid, or None for bare earth
+                     only
+        canopy_offset - height to keep above the canopy less the height to
+                        keep above the bare earth, ignored without a canopy
+        lateral_buffer - horizontal distance in feet to keep from both
+                         layers, see radius_pixels
+
+    Returns:
+        be_tif itself if there is nothing to add to it, otherwise the cached
+        raster of max(bare_earth, canopy + canopy_offset)
+    """
+    import rasterio
+
+    be_src, canopy_src = _open_rasters(be_tif, canopy_tif)
+    try:
+        radius = radius_pixels(be_src.affine, lateral_buffer, be_src.crs, be_src.shape)
+        if canopy_tif is None and radius == 0:
+            return be_tif
+
+        buffers = (canopy_offset if canopy_tif is not None else None, radius)
+        filepath = _cache_file(_tif_files(be_tif, canopy_tif), buffers, '.tif')
+        if os.path.exists(filepath):
+            return filepath
+
+        meta = be_src.meta.copy()
+        meta.update(count=1, dtype=np.result_type(be_src.dtypes[0], np.float32).name)
+        if not os.path.exists(DILATED_DIR):
+            os.makedirs(DILATED_DIR)
+
+        tmp = "{0}.{1}.tmp".format(filepath, os.getpid())
+        with trace.span('required_altitude', file=be_tif, canopy=canopy_tif, radius=radius):
+            with rasterio.open(tmp, 'w', **meta) as dst:
+                for window in _windows(be_src.shape, WINDOW_PIXELS):
+                    dst.write(_required_window(be_src, canopy_src, window, canopy_offset, radius), 1, window=window)
+    finally:
+        be_src.close()
+        if canopy_src is not None:
+            canopy_src.close()
+
+    log.info("built required altitude raster %s from %s", filepath, _tif_files(be_tif, canopy_tif))
+    return _replace(tmp, filepath)
+
+
+def required_altitude_clearance(be_tif, canopy_tif=None, canopy_offset=0, lateral_buffer=0, buf=0, proj=None):
+    """
+    Clearance function (see clearance.windowed_clearance) of the surface of
+    required_altitude_tif plus buf, filtered from the rasters a window at a
+    time as the path reaches it. Neither the rasters nor the surface are read
+    whole, and the rasters stay open for as long as the function is kept.
+
+    Args:
+        be_tif, canopy_tif, canopy_offset, lateral_buffer - as for
+            required_altitude_tif
+        buf - height added to the surface, the be_buffer
+        proj - projection of the path coordinates, or None if they are in
+               the rasters' CRS
+    """
+    import pyproj
+    from pathplan.clearance import windowed_clearance
+
+    be_src, canopy_src = _open_rasters(be_tif, canopy_tif)
+    radius = radius_pixels(be_src.affine, lateral_buffer, be_src.crs, be_src.shape)
+
+    def read_window(window):
+        return _required_window(be_src, canopy_src, window, canopy_offset, radius)
+
+    dst_proj = pyproj.Proj(be_src.crs, preserve_units=True) if proj is not None else None
+    return windowed_clearance(read_window, be_src.shape, buf, be_src.affine, proj, dst_proj)
+
+
+def _read_band(tif_file):
+    import rasterio
+    with rasterio.open(tif_file) as src:
+        return src.read(1)
+
+
+def required_altitude(be_tif, canopy_tif=None, canopy_offset=0, lateral_buffer=0):
+    """
+    The required_altitude_tif raster as an array, memoized per process
+    """
+    filepath = required_altitude_tif(be_tif, canopy_tif, canopy_offset, lateral_buffer)
+    return cached_load(filepath, _read_band)
+
+
+def required_altitude_shapes(be_tif, canopy_tif=None, canopy_offset=0, lateral_buffer=0, do_transform=True,
+                             proj=None):
+    """
+    The shapes file and altitude file vectorized from required_altitude_tif,
+    generated on first use. do_transform and proj as for
+    geo.shapelify_vector
+    """
+    from shapely.geometry import MultiPolygon
+    from shapely.wkb import dumps
+    from pathplan.geo import vectorize_raster, shapelify_vector
+    from pathplan.results import atomic_json_dump
+
+    filepath = required_altitude_tif(be_tif, canopy_tif, canopy_offset, lateral_buffer)
+    stem = _vector_stem(filepath, do_transform, proj)
+    shapes_file, alts_file = stem + '.shapes', stem + '.alt.json'
+    if os.path.exists(shapes_file) and os.path.exists(alts_file):
+        return shapes_file, alts_file
+
+    vecs = vectorize_raster(filepath)
+    shapes, alt = shapelify_vector(vecs, do_transform, proj=proj)
+
+    if not os.path.exists(DILATED_DIR):
+        os.makedirs(DILATED_DIR)
+    tmp = "{0}.{1}.tmp".format(shapes_file, os.getpid())
+    with open(tmp, "wb") as wkb_file:
+        wkb_file.write(dumps(MultiPolygon(shapes)))
+    _replace(tmp, shapes_file)
+    atomic_json_dump(alt, alts_file)
+
+    return shapes_file, alts_file
+
+
+def required_altitude_polygons(be_tif, canopy_tif=None, canopy_offset=0, lateral_buffer=0, do_transform=True,
+                               proj=None):
+    """
+    The polygons file (see pathplan.polygons) vectorized from
+    required_altitude_tif, generated on first use without going through
+    shapely. do_transform and proj as for geo.shapelify_vector
+    """
+    from pathplan.geo import vectorize_raster
+    from pathplan.polygons import POLYGONS_EXT, from_vectors, save_polygons
+
+    filepath = required_altitude_tif(be_tif, canopy_tif, canopy_offset, lateral_buffer)
+    polygons_file = _vector_stem(filepath, do_transform, proj) + POLYGONS_EXT
+    if os.path.exists(polygons_file):
+        return polygons_file
+
+    polygons = from_vectors(vectorize_raster(filepath), do_transform, proj=proj)
+    if not os.path.exists(DILATED_DIR):
+        os.makedirs(DILATED_DIR)
+    return save_polygons(polygons_file, polygons)
+
+
+def required_altitude_tiles(be_tif, canopy_tif=None, canopy_offset=0, lateral_buffer=0, do_transform=True,
+                            proj=None, tile_pixels=None):
+    """
+    The tiles.json of the tiled surface (see pathplan.tiles) of
+    required_altitude_tif, generated on first use. Each window of
+    tile_pixels square is filtered from the rasters with a halo of the
+    lateral buffer around it and vectorized straight into its tile, so the
+    rasters are never read whole and the required altitude raster is never
+    written. do_transform and proj as for geo.shapelify_vector
+    """
+    from pathplan.geo import vectorize_array, utm_proj
+    from pathplan.polygons import from_vectors
+    from pathplan.tiles import DIRECTORY, TILE_PIXELS, write_tiles
+
+    tile_pixels = tile_pixels or TILE_PIXELS
+    be_src, canopy_src = _open_rasters(be_tif, canopy_tif)
+    try:
+        affine = be_src.affine
+        radius = radius_pixels(affine, lateral_buffer, be_src.crs, be_src.shape)
+        # Unless given a projection, every tile is projected like the first,
+        # which is what vectorizing the whole raster at once would pick
+        if do_transform and proj is None:
+            proj = utm_proj(affine.f, affine.c)
+
+        buffers = (canopy_offset if canopy_tif is not None else None, radius, bool(do_transform),
+                   proj.srs if do_transform else None, tile_pixels)
+        dirpath = _cache_file(_tif_files(be_tif, canopy_tif), buffers, '.tiles')
+        if os.path.exists(os.path.join(dirpath, DIRECTORY)):
+            return os.path.join(dirpath, DIRECTORY)
+
+        def tiles():
+            for window in _windows(be_src.shape, tile_pixels):
+                (row, _), (col, _) = window
+                name = "{0}-{1}".format(row // tile_pixels, col // tile_pixels)
+                required = _required_window(be_src, canopy_src, window, canopy_offset, radius)
+                yield name, from_vectors(vectorize_array(required, affine, window), do_transform, proj=proj)
+
+        if not os.path.exists(DILATED_DIR):
+            os.makedirs(DILATED_DIR)
+        with trace.span('tile', file=be_tif, canopy=canopy_tif, radius=radius, tile_pixels=tile_pixels):
+            return write_tiles(dirpath, tiles())
+    finally:
+        be_src.close()
+        if canopy_src is not None:
+            canopy_src.close()
@@ -1,12 +1,12 @@
 '''
 Contains all methods for evaluating the performance of a path
 '''
-import sys, time, os, struct, json, fnmatch
-from pathplan.geo import load_shapefile, load_altfile
+import sys, time, os, struct, json, fnmatch, hashlib
+from pathplan.geo import load_shapefile, load_altfile, utm_proj, wgs84
+from pathplan.pathfile import read_path_columns
+from pathplan.alignment import align_trajectory, segment_index
+from pathplan import trace
 from shapely.geometry import LineString, Polygon
-from shapely.strtree import STRtree
-from scipy.interpolate import interp1d
-from scipy.integrate import quad
 import numpy as np
 import json
 """
@@ -23,9 +23,6 @@ NOTE: This code was written using Python 3 so Python 2 will probably cause
 some errors with generators in this file.
 """
 
-from mpl_toolkits.mplot3d import Axes3D
-
-import matplotlib.pyplot as plt
 import numpy as np
 import json
 import pyproj
@@ -37,21 +34,23 @@ import types
 
 '''
 Returns a list of LineStrings indicating the sections of the
-path that intersect with the digital surface map
+path that intersect with the digital surface map, given as a
+pathplan.intersect.SurfaceIndex
+
+Superseded by pathplan.clearance.check_clearance, which checks the path
+against the raster directly
 '''
-def calculate_intersections(path, rtree, alts, buf=0):
-    intersected = []
-    ls = LineString(path)
-    tile = rtree.query(ls)
-    for pot in tile:
-        inter = pot.intersection(ls)
-        if not inter.is_empty:
-            alt = alts[inter.wkt] + buf
-            for x,y,z in inter.coords:
-                if z <= alt:
-                    intersected.append(inter)
-                    break
-    return intersected
+def calculate_intersections(path, index, buf=0):
+    points = np.asarray(path, dtype=float)
+    if len(points) < 2:
+        return []
+    seg, _, t_start, t_end, alts = index.intersect(points[:-1], points[1:])
+    deltas = points[1:] - points[:-1]
+    firsts = points[seg] + deltas[seg] * t_start[:, None]
+    lasts = points[seg] + deltas[seg] * t_end[:, None]
+    # The altitude is linear along a stretch so its lowest point is an end
+    hit = np.minimum(firsts[:, 2], lasts[:, 2]) <= alts + buf
+    return [LineString([first, last]) for first, last in zip(firsts[hit].tolist(), lasts[hit].tolist())]
           
 
 def generator_to_list(array):
@@ -66,20 +65,19 @@ def to_np_array(array):
 
 def read_path_from_json(filepath):
     """
-    Parse a json file containing data points for a path. Expects the file
-    to have mappings to `longitude`, `latitude`, and `altitude`
+    Parse a path file containing data points for a path. Accepts either the
+    json format with mappings to `longitude`, `latitude`, and `altitude` or
+    the columnar binary format.
     Returns:
         A generator containing all parsed data points (x=lon, y=lat, z=alt)
     """
-    X = "longitude"
-    Y = "latitude"
-    Z = "altitude"
+    _, lat, lon, alt = read_path_columns(filepath)
+    if len(lat) == 0:
+        return iter([])
 
-    proj      = lambda pt: utm_proj(pt[X], pt[Y])
-    cartesian = lambda pt: pyproj.transform(wgs84, proj(pt), pt[X], pt[Y], pt[Z])
-    xyz       = lambda pt: np.array(*[cartesian(pt)])
-    points = json.load(open(filepath))
-    return map(xyz, points)
+    proj = utm_proj(lat[0], lon[0])
+    xs, ys, zs = pyproj.transform(wgs84, proj, np.asarray(lon), np.asarray(lat), np.asarray(alt))
+    return iter(np.column_stack((xs, ys, zs)))
 
 def default_noise(val=0):
     return val + np.random.normal(0, 1.5)
@@ -144,6 +142,7 @@ def get_nearest_point_from(pt, list_of_points, set):
 
     return minval
 
+#Superseded by pathplan.alignment.align_trajectory
 def gen_path_via_nearest_points(planned, flown):
     used_pts = set()
     for pt in planned:
@@ -152,8 +151,11 @@ def gen_path_via_nearest_points(planned, flown):
         yield found_pt
 
 
-from pathplan.viz import build_distance_lists
+from pathplan.utils import build_distance_lists
 def area_between_curves(first, second, max_dist=None):
+    from scipy.interpolate import interp1d
+    from scipy.integrate import quad
+
     fx, fy = build_distance_lists(first)
     sx, sy = build_distance_lists(second)
 
@@ -172,12 +174,122 @@ def area_between_curves(first, second, max_dist=None):
     
 
 def linear_interpolation(xs, ys):
-    y_interp = interp1d(xs, ys)
+    xs = np.asarray(xs, dtype=float)
 
     new_xs = np.arange(xs[0], xs[-1], abs(xs[0]-xs[-1]) / 1000)
-    fake_ys = [y_interp(x) for x in new_xs]
+    fake_ys = np.interp(new_xs, xs, ys)
 
     return new_xs, fake_ys
+
+ERROR_HIST_MAX = 100.0
+ERROR_HIST_BINS = 10000
+
+class StreamingError(object):
+    """
+    Accumulates altitude error metrics of a flown path against a planned
+    path, one chunk of flown points at a time.
+
+    Flown points are projected onto the planned polyline, as in
+    pathplan.alignment, and compared with the planned altitude there.
+    Memory use is constant: the metrics are kept as running sums and a
+    fixed histogram of absolute errors, which the percentiles are read from
+    (accurate to ERROR_HIST_MAX / ERROR_HIST_BINS).
+
+    Args:
+        planned - list/np-array of planned (x, y, z) waypoints
+    """
+
+    def __init__(self, planned, hist_max=ERROR_HIST_MAX, bins=ERROR_HIST_BINS):
+        plan = np.asarray(planned, dtype=float).reshape(-1, 3)
+        if len(plan) == 0:
+            raise ValueError('Cannot score a flight against an empty planned path')
+        if len(plan) == 1:
+            # A single waypoint is a zero length segment
+            plan = np.vstack((plan, plan))
+        self.plan = plan
+        self.index = segment_index(plan)
+        self.count = 0
+        self.sum_error = 0.0
+        self.sum_sq_error = 0.0
+        self.max_error = 0.0
+        self.hist_max = hist_max
+        self.hist = np.zeros(bins + 1, dtype=np.int64)
+
+    def update(self, flown):
+        """
+        Adds a chunk of flown (x, y, z) points
+        """
+        flown = np.asarray(flown, dtype=float)
+        if len(flown) == 0:
+            return self
+
+        errors = align_trajectory(self.plan, flown, index=self.index).vertical
+        abs_errors = np.abs(errors)
+
+        self.count += len(errors)
+        self.sum_error += errors.sum()
+        self.sum_sq_error += (errors**2).sum()
+        self.max_error = max(self.max_error, abs_errors.max())
+
+        bins = len(self.hist) - 1
+        idx = np.minimum((abs_errors / self.hist_max * bins).astype(int), bins)
+        self.hist += np.bincount(idx, minlength=len(self.hist))
+        return self
+
+    @property
+    def mean_error(self):
+        return self.sum_error / self.count if self.count else float('nan')
+
+    @property
+    def mse(self):
+        return self.sum_sq_error / self.count if self.count else float('nan')
+
+    @property
+    def rmse(self):
+        return self.mse**.5
+
+    def percentile(self, q):
+        """
+        Approximate q-th percentile (0-100) of the absolute error
+        """
+        if self.count == 0:
+            return float('nan')
+        bins = len(self.hist) - 1
+        idx = np.searchsorted(np.cumsum(self.hist), q / 100.0 * self.count)
+        if idx >= bins:
+            return self.max_error
+        return min((idx + 1) * self.hist_max / bins, self.max_error)
+
+    def summary(self, percentiles=(50, 90, 95, 99)):
+        stats = {'count': self.count, 'mean': self.mean_error, 'mse': self.mse,
+                 'rmse': self.rmse, 'max': self.max_error}
+        for q in percentiles:
+            stats['p{0}'.format(q)] = self.percentile(q)
+        return stats
+
+def score_flight(planned, chunks, proj, alt_offset=0):
+    """
+    Streams a flight log against a planned path.
+
+    Args:
+        planned - list of planned (x, y, z) waypoints in proj, z in feet
+        chunks - iterable of (lat, lon, alt[, timestamp]) arrays in degrees
+                 and metres, e.g. pathplan.sitl.iter_gps_chunks
+        proj - projection the planned path is in
+        alt_offset - metres to subtract from the flown altitudes
+
+    Returns:
+        the StreamingError holding the metrics
+    """
+    errors = StreamingError(planned)
+    with trace.span('metrics', metric='flight'):
+        for chunk in chunks:
+            chunk = np.asarray(chunk, dtype=float)
+            xs, ys = pyproj.transform(wgs84, proj, chunk[:, 1], chunk[:, 0])
+            zs = (chunk[:, 2] - alt_offset) * 3.28084
+            errors.update(np.column_stack((xs, ys, zs)))
+    return errors
+
 def mse(expected, actual):
     """
     Mean squared error of expected and actual waypoints.
@@ -187,28 +299,40 @@ def mse(expected, actual):
     Returns:
         The mean squared error
     """
-
-    fx, fy = build_distance_lists(expected)
-    sx, sy = build_distance_lists(actual)
-
-    exp_interp = np.array(linear_interpolation(fx,fy))
-    act_interp = np.array(linear_interpolation(sx,sy))
-
-    return ((exp_interp - act_interp)**2).sum(axis=1) # avg along columns
+    return StreamingError(list(expected)).update(list(actual)).mse
 
 def calc_errors_with_gen_noise(filepath, metric=mse):
     waypoints = list(read_path_from_json(filepath))
     noise_pts = list(gen_noise_points(waypoints))
     return metric(expected=waypoints, actual=noise_pts)
 
+COMPARISON_METRICS = [("Area", area_between_curves), ("MSE", mse)]
+
+def path_key(path):
+    """
+    Hash of a path's coordinates, so metrics can be cached by content
+    rather than by name
+    """
+    return hashlib.sha1(np.ascontiguousarray(path, dtype=float).tobytes()).hexdigest()
+
+def comparison_metric(metric_name, p1, p2):
+    """
+    Computes one of COMPARISON_METRICS by name
+    """
+    with trace.span('metrics', metric=metric_name):
+        return dict(COMPARISON_METRICS)[metric_name](p1, p2)
+
+def format_comparison(metric_name, name1, name2, val):
+    return '{0} between {1} and {2} = {3}'.format(metric_name, name1, name2, val)
+
 def get_individual_stats(name, path):
     return "len({0}) = {1}\n{0} total distance: {2}".format(name, len(path), total_dist(np.array(path)))
 
-def get_comparison_stats(p1, p2, name1, name2, metrics=[("Area", area_between_curves), ("SSE", mse)]):
+def get_comparison_stats(p1, p2, name1, name2, metrics=COMPARISON_METRICS):
     vals = []
     for name, metric in metrics:
         val = metric(p1, p2)
-        vals.append('{0} between {1} and {2} = {3}'.format(name, name1, name2,val))
+        vals.append(format_comparison(name, name1, name2, val))
 
     return '\n'.join(vals)
           
@@ -251,6 +375,7 @@ def display_surface_with_file(filepath):
     Args:
         filepath - JSON file containing the path itself
     """
+    from pathplan.viz import display_surface
     waypoints = list(read_path_from_json(filepath))
     noise_pts = list(gen_noise_points_static(waypoints))
 
@@ -258,6 +383,7 @@ def display_surface_with_file(filepath):
 
 
 def main():
+    import matplotlib.pyplot as plt
     planned = list(read_path_from_json("output/path.json"))
     flown = read_path_from_json("output/min_alt_2.flight.json")
     # NOTE: altitude in output/min_alt_2.flight.json adds 584
@@ -0,0 +1,159 @@
+'''
+Runs simulated flights on several ArduPilot SITL instances in parallel.
+
+Every instance gets its own port and working directory, so the logs,
+eeprom.bin and terrain data written by one flight never collide with another.
+Queued jobs are handed to whichever instance is free; each job restarts its
+instance with the home position set to the start of the mission, flies it,
+and parses the .BIN logs it produced.
+'''
+
+import logging
+import os
+import queue
+import shutil as sh
+import subprocess
+import threading
+
+from pathplan.pathfile import iter_waypoint_dicts
+
+log = logging.getLogger(__name__)
+
+SITL_BINARY = os.path.expanduser('~/.dronekit/sitl/copter-3.3/apm')
+SITL_MODEL = 'quad'
+BASE_PORT = 5760
+PORT_STRIDE = 10
+FARM_DIR = 'gen/farm'
+
+
+class SitlInstance(object):
+    """
+    A single SITL process bound to instance number `instance`, which makes
+    it listen on BASE_PORT + PORT_STRIDE * instance
+    """
+
+    def __init__(self, instance, workdir, binary=SITL_BINARY):
+        self.instance = instance
+        self.workdir = os.path.abspath(workdir)
+        self.binary = binary
+        self.process = None
+
+    @property
+    def port(self):
+        return BASE_PORT + PORT_STRIDE * self.instance
+
+    def start(self, lat, lon, alt=0, heading=0):
+        self.stop()
+
+        # Start every flight from a clean directory
+        if os.path.exists(self.workdir):
+            sh.rmtree(self.workdir)
+        os.makedirs(self.workdir)
+
+        home = "--home={0},{1},{2},{3}".format(lat, lon, alt, heading)
+        out = open(os.path.join(self.workdir, "sitl.out"), "w")
+        self.process = subprocess.Popen([self.binary, "--wipe", home, "--model={0}".format(SITL_MODEL), "-I", str(self.instance)],
+                                        cwd=self.workdir, stdout=out, stderr=subprocess.STDOUT)
+        out.close()
+
+    def stop(self):
+        if self.process is None:
+            return
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self.process = None
+
+
+def fly_mission(instance, missionfile, tif, logdir):
+    """
+    Flies one mission on the given SITL instance, leaving its .BIN logs in
+    logdir
+    """
+    import pathplan.sitl as sitl
+
+    home = next(iter_waypoint_dicts(missionfile))
+    instance.start(home['latitude'], home['longitude'])
+    try:
+        sitl.fly(instance.port, missionfile, logdir, tif, workdir=instance.workdir)
+    finally:
+        instance.stop()
+
+
+def fly_job(instance, missionfile, tif, logdir):
+    """
+    Flies one mission on the given SITL instance and parses its logs.
+
+    Returns:
+        the flown path as a list of {'latitude', 'longitude', 'altitude'} dicts
+    """
+    import pathplan.sitl as sitl
+
+    fly_mission(instance, missionfile, tif, logdir)
+    return sitl.parse_bins(logdir)
+
+
+class FlightFarm(object):
+    """
+    Schedules flight jobs over `instances` SITL instances.
+
+    Args:
+        instances - number of SITL instances to run at once
+        first_instance - instance number of the first SITL, later ones follow
+        workdir - directory the per instance working directories go in
+    """
+
+    def __init__(self, instances=2, first_instance=0, workdir=FARM_DIR):
+        self.instances = [SitlInstance(first_instance + i, os.path.join(workdir, "sitl-{0}".format(first_instance + i)))
+                          for i in range(instances)]
+
+    def run(self, jobs, on_result=None):
+        """
+        Flies every job, blocking until all of them are done.
+
+        Args:
+            jobs - iterable of (name, mission file, tif, log directory)
+            on_result - called with (name, flown path) as each job finishes,
+                        from the thread that ran it
+
+        Returns:
+            dict mapping job name to its flown path, or to the exception
+            that stopped it
+        """
+        pending = queue.Queue()
+        for job in jobs:
+            pending.put(job)
+
+        results = {}
+        lock = threading.Lock()
+
+        def worker(instance):
+            while True:
+                try:
+                    name, missionfile, tif, logdir = pending.get_nowait()
+                except queue.Empty:
+                    return
+
+                log.info("Flying %s on SITL instance %d (port %d)", name, instance.instance, instance.port)
+                try:
+                    flown = fly_job(instance, missionfile, tif, logdir)
+                except Exception as e:
+                    log.exception("%s failed on SITL instance %d", name, instance.instance)
+                    flown = e
+
+                with lock:
+                    results[name] = flown
+                    if on_result is not None and not isinstance(flown, Exception):
+                        on_result(name, flown)
+
+        threads = [threading.Thread(target=worker, args=(instance,)) for instance in self.instances]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return results
@@ -3,20 +3,21 @@ This file contains all methods for converting between different geoographical
 projections and dealing with tif, shape, and altitude json files
 '''
 
-from rasterio.features import shapes
-import rasterio
 from shapely.ops import transform
-from shapely.geometry import shape, LineString, Polygon, MultiPolygon
-from shapely.strtree import STRtree
-from shapely.wkb import dumps, loads
-from affine import Affine
+from shapely.geometry import shape
+from shapely.wkb import loads
 import pyproj
 import numpy as np
 import json
+import logging
 import time
 
 import math
 
+from pathplan import trace
+
+log = logging.getLogger(__name__)
+
 wgs84 = pyproj.Proj(init="epsg:4326")
 
 
@@ -62,6 +63,7 @@ def utm_zone(lat, lon):
     return zone, lat > 0
 
 
+@trace.traced('shapes_read')
 def load_shapefile(filename):
     with open(filename, "rb") as wkb_file:
         shapes = list(loads(wkb_file.read()))
@@ -81,12 +83,12 @@ def read_tif(filename):
     #i_w = image.shape[0]
     #i_h = image.shape[1]
     #image = image.flatten().reshape((i_w, i_h))
-    print(filename)
-    raster = rasterio.open(filename)
+    import rasterio
+    with trace.span('raster_read', file=filename):
+        raster = rasterio.open(filename)
+        log.debug("reading %s (%s)", filename, raster.crs)
 
-    print(raster.crs)
-
-    return raster.read(), pyproj.Proj(raster.crs, preserve_units=True)
+        return raster.read(), pyproj.Proj(raster.crs, preserve_units=True)
 
 
 def proj_utm(zone, north):
@@ -121,20 +123,34 @@ mapped to altitude
 '''
 
 
-def vectorize_raster(rasterfile):
-
-    results = None
+#window, if given, is ((row_start, row_stop), (col_start, col_stop)) of the
+#part of the raster to vectorize
+def vectorize_raster(rasterfile, window=None):
+    import rasterio
 
     with rasterio.drivers():
         with rasterio.open(rasterfile) as src:
-            image = src.read(1)  # first band
-            results = ({
-                'properties': {
-                    'raster_val': v
-                },
-                'geometry': s
-            } for i, (s, v) in enumerate(
-                shapes(image, mask=None, transform=src.affine)))
+            image = src.read(1, window=window)  # first band
+            return vectorize_array(image, src.affine, window)
+
+
+#Vectorizes an array read from a raster with the given affine, window as for
+#vectorize_raster if the array is only part of the raster
+@trace.traced('vectorize')
+def vectorize_array(image, affine, window=None):
+    from affine import Affine
+    from rasterio.features import shapes
+
+    if window is not None:
+        (row, _), (col, _) = window
+        affine = affine * Affine.translation(col, row)
+    results = ({
+        'properties': {
+            'raster_val': v
+        },
+        'geometry': s
+    } for i, (s, v) in enumerate(
+        shapes(image, mask=None, transform=affine)))
 
     return list(results)
 
@@ -146,8 +162,7 @@ def shapelify_vector(vectors, do_transform=True, crs=None, proj=None):
     #lol at the way that works
     lon, lat = vectors[0]['geometry']['coordinates'][0][0]
 
-    print(lon)
-    print(lat)
+    log.debug("first vector at %s, %s", lon, lat)
 
     if proj == None:
         proj = utm_proj(lat, lon)
@@ -159,14 +174,14 @@ def shapelify_vector(vectors, do_transform=True, crs=None, proj=None):
         return pyproj.transform(crs, proj, x, y, z)
 
     init_time = time.time()
-    for vec in vectors:
-        shap = shape(vec['geometry'])
-        if do_transform:
-            shap = transform(transform_to_proj, shap)
-        alt_dict[shap.wkt] = vec['properties']['raster_val']
-        shapes.append(shap)
-
-    print("transforming the vectors took {0} seconds".format(
-        time.time() - init_time))
+    with trace.span('transform', vectors=len(vectors)):
+        for vec in vectors:
+            shap = shape(vec['geometry'])
+            if do_transform:
+                shap = transform(transform_to_proj, shap)
+            alt_dict[shap.wkt] = vec['properties']['raster_val']
+            shapes.append(shap)
+
+    log.info("transforming the vectors took %s seconds", time.time() - init_time)
 
     return shapes, alt_dict
@@ -0,0 +1,59 @@
+'''
+Import time benchmark of the pathplan entry points.
+
+Every module is imported in a fresh interpreter a few times, reporting the
+best and median wall time and which of the heavy optional dependencies
+(plotting, scipy, rasterio, SITL) the import dragged in. Batch entry points
+should not load any of them.
+
+    python -m pathplan.importbench [-n RUNS] [MODULE ...]
+'''
+
+import json
+import subprocess
+import sys
+
+import numpy as np
+
+MODULES = ['pathplan.path_planner', 'pathplan.path_planner_numpy', 'pathplan.sweep', 'pathplan.server',
+           'pathplan.evaluation', 'pathplan.decimate', 'pathplan.dilate', 'main']
+HEAVY = ['matplotlib', 'mpl_toolkits.mplot3d', 'scipy', 'rasterio', 'dronekit', 'pymavlink', 'PyQt5']
+RUNS = 5
+
+_PROBE = '''
+import json, sys, time
+start = time.time()
+import {0}
+took = time.time() - start
+print(json.dumps([took, sorted(name for name in {1!r} if name in sys.modules)]))
+'''
+
+
+def import_time(module, runs=RUNS):
+    """
+    Seconds taken by `import module` in each of `runs` fresh interpreters,
+    and the heavy dependencies it loaded
+    """
+    times = []
+    loaded = []
+    for _ in range(runs):
+        out = subprocess.check_output([sys.executable, '-c', _PROBE.format(module, HEAVY)],
+                                      stderr=subprocess.DEVNULL)
+        took, loaded = json.loads(out.decode('utf-8').strip().splitlines()[-1])
+        times.append(took)
+    return times, loaded
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(description="Time importing the pathplan entry points")
+    parser.add_argument("modules", nargs='*', default=MODULES)
+    parser.add_argument("-n", "--runs", type=int, default=RUNS)
+    args = parser.parse_args()
+
+    print("{0:<30} {1:>9} {2:>9}  {3}".format("module", "best ms", "median ms", "heavy imports"))
+    for module in args.modules:
+        times, loaded = import_time(module, args.runs)
+        print("{0:<30} {1:>9.1f} {2:>9.1f}  {3}".format(module, min(times) * 1000, np.median(times) * 1000,
+                                                      ', '.join(loaded) or '-'))
@@ -0,0 +1,242 @@
+'''
+Bulk intersection of path segments with a vectorized surface.
+
+The bounding boxes of the polygons of a surface (see pathplan.polygons) are
+bucketed into a uniform grid of cells. All the segments of a path are then
+queried and clipped against the polygons at once with array operations,
+instead of one STRtree query per segment and one shapely intersection per
+candidate polygon:
+
+    index = SurfaceIndex.load(polygons_file)
+    segment, polygon, t_start, t_end, alt = index.intersect(starts, ends)
+
+Each row is a stretch of segment `segment` from parameter t_start to t_end
+(0 at its start, 1 at its end) over polygon `polygon`, whose altitude is
+`alt`. Points on an edge shared by two polygons are given to
+one of them only, using the half-open rule of the crossing number test.
+'''
+
+from collections import namedtuple
+
+import numpy as np
+
+from pathplan import trace
+from pathplan.polygons import clip_segments, from_shapes, load_polygons, ragged_range
+
+Crossings = namedtuple('Crossings', ['segment', 'polygon', 't_start', 't_end', 'alt'])
+
+# Number of (segment, edge) pairs worked on at a time, bounds the memory of
+# the kernels
+CHUNK = 1 << 21
+
+
+def _chunks(counts, limit=CHUNK):
+    """
+    Splits a sequence of ragged counts into slices of at most about `limit`
+    elements each, never splitting an owner
+    """
+    ends = np.cumsum(counts)
+    start = 0
+    while start < len(counts):
+        base = ends[start - 1] if start else 0
+        stop = max(int(np.searchsorted(ends, base + limit, side='right')), start + 1)
+        yield slice(start, stop)
+        start = stop
+
+
+def _straddles(starts, ends, boxes):
+    """
+    Whether the infinite line through each segment passes through the
+    matching (minx, miny, maxx, maxy) box, i.e. the box corners are not all
+    strictly on one side of it
+    """
+    d = ends - starts
+    sides = [d[:, 0] * (y - starts[:, 1]) - d[:, 1] * (x - starts[:, 0])
+             for x, y in ((boxes[:, 0], boxes[:, 1]), (boxes[:, 0], boxes[:, 3]),
+                          (boxes[:, 2], boxes[:, 1]), (boxes[:, 2], boxes[:, 3]))]
+    sides = np.stack(sides)
+    return ~(np.all(sides > 0, axis=0) | np.all(sides < 0, axis=0))
+
+
+def _overlaps(starts, ends, boxes):
+    """
+    Whether each segment's bounding box overlaps the matching box
+    """
+    lo, hi = np.minimum(starts, ends), np.maximum(starts, ends)
+    return ((lo[:, 0] <= boxes[:, 2]) & (hi[:, 0] >= boxes[:, 0]) &
+            (lo[:, 1] <= boxes[:, 3]) & (hi[:, 1] >= boxes[:, 1]))
+
+
+class BoxGrid(object):
+    """
+    Uniform grid of the (minx, miny, maxx, maxy) boxes overlapping each
+    cell, answering which boxes a batch of segments may cross.
+
+    Args:
+        bounds - (n, 4) array of the boxes
+        cell_size - side of the grid cells, by default about four boxes per
+                    cell
+    """
+
+    def __init__(self, bounds, cell_size=None):
+        self.bounds = bounds
+        if len(bounds) == 0:
+            self.origin, self.cell_size, self.shape = np.zeros(2), 1.0, (0, 0)
+            self.cell_offsets, self.cell_boxes = np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int64)
+            return
+
+        lo, hi = bounds[:, :2].min(axis=0), bounds[:, 2:].max(axis=0)
+        if cell_size is None:
+            cell_size = np.sqrt(4 * np.prod(np.maximum(hi - lo, 1e-9)) / len(bounds))
+        self.origin, self.cell_size = lo, float(cell_size)
+        nx, ny = (np.floor((hi - lo) / self.cell_size).astype(int) + 1).tolist()
+        self.shape = (ny, nx)
+
+        first, last = self._cells(bounds[:, :2]), self._cells(bounds[:, 2:])
+        spans = last - first + 1
+        owner, local = ragged_range(spans[:, 0] * spans[:, 1])
+        cx = first[owner, 0] + local % spans[owner, 0]
+        cy = first[owner, 1] + local // spans[owner, 0]
+        cells = cy * nx + cx
+
+        order = np.argsort(cells, kind='mergesort')
+        self.cell_boxes = owner[order]
+        self.cell_offsets = np.concatenate(([0], np.cumsum(np.bincount(cells, minlength=nx * ny)))).astype(np.int64)
+
+    def __len__(self):
+        return len(self.bounds)
+
+    def _cells(self, points):
+        """
+        (column, row) of the grid cells the points fall in, clipped to the grid
+        """
+        ny, nx = self.shape
+        cells = np.floor((points - self.origin) / self.cell_size).astype(np.int64)
+        return np.clip(cells, 0, [nx - 1, ny - 1])
+
+    def query(self, starts, ends):
+        """
+        Candidate (segment, box) pairs of all segments at once: the boxes
+        the segment's line passes through that overlap the segment's
+        bounding box.
+
+        Args:
+            starts, ends - (n, 2) arrays of the segments' end points
+
+        Returns:
+            arrays of segment and box ids, sorted by segment then box
+        """
+        none = np.zeros(0, dtype=np.int64)
+        if len(self) == 0 or len(starts) == 0:
+            return none, none
+
+        ny, nx = self.shape
+        lo, hi = np.minimum(starts, ends), np.maximum(starts, ends)
+        first, last = self._cells(lo), self._cells(hi)
+        spans = last - first + 1
+        # Segments entirely off the grid have no cells
+        outside = np.any(hi < self.origin, axis=1) | np.any(lo > self.origin + self.cell_size * np.array([nx, ny]), axis=1)
+        spans[outside] = 0
+
+        # Grid cells in each segment's bounding box that its line crosses
+        seg, local = ragged_range(spans[:, 0] * spans[:, 1])
+        cx = first[seg, 0] + local % np.maximum(spans[seg, 0], 1)
+        cy = first[seg, 1] + local // np.maximum(spans[seg, 0], 1)
+        corner = self.origin + self.cell_size * np.column_stack((cx, cy))
+        keep = _straddles(starts[seg], ends[seg], np.hstack((corner, corner + self.cell_size)))
+        seg, cells = seg[keep], (cy * nx + cx)[keep]
+
+        # Boxes of those cells, each pair once
+        owner, local = ragged_range(self.cell_offsets[cells + 1] - self.cell_offsets[cells])
+        seg, box = seg[owner], self.cell_boxes[self.cell_offsets[cells][owner] + local]
+        pairs = np.unique(seg * len(self) + box)
+        seg, box = pairs // len(self), pairs % len(self)
+
+        boxes = self.bounds[box]
+        keep = _overlaps(starts[seg], ends[seg], boxes) & _straddles(starts[seg], ends[seg], boxes)
+        return seg[keep], box[keep]
+
+
+def no_crossings():
+    return Crossings(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0), np.zeros(0))
+
+
+class SurfaceIndex(object):
+    """
+    Polygons of a surface with a BoxGrid of their bounding boxes.
+
+    Args:
+        polygons - pathplan.polygons.Polygons of the surface
+        cell_size - side of the grid cells, see BoxGrid
+    """
+
+    def __init__(self, polygons, cell_size=None):
+        self.polygons = polygons
+        self.alts = polygons.alts
+        self.grid = BoxGrid(polygons.bounds, cell_size)
+
+    @classmethod
+    def from_shapes(cls, shapes, alt_dict, cell_size=None):
+        """
+        Index of a list of shapely Polygons and the dict mapping their wkt
+        to their altitude
+        """
+        return cls(from_shapes(shapes, alt_dict), cell_size)
+
+    @classmethod
+    def load(cls, filepath, cell_size=None, mmap=True):
+        """
+        Index of a polygons file, see pathplan.polygons.save_polygons
+        """
+        return cls(load_polygons(filepath, mmap), cell_size)
+
+    def __len__(self):
+        return len(self.alts)
+
+    def query(self, starts, ends):
+        """
+        Candidate (segment, polygon) pairs of all segments at once, see
+        BoxGrid.query
+
+        Args:
+            starts, ends - (n, 2) arrays of the segments' end points
+
+        Returns:
+            arrays of segment and polygon ids, sorted by segment then polygon
+        """
+        starts, ends = np.asarray(starts, dtype=float)[:, :2], np.asarray(ends, dtype=float)[:, :2]
+        seg, poly = self.grid.query(starts, ends)
+        trace.count('index_candidates', len(seg))
+        return seg, poly
+
+    @trace.traced('intersect')
+    def intersect(self, starts, ends):
+        """
+        Clips all the segments against the polygons of the surface.
+
+        Args:
+            starts, ends - (n, 2) arrays of the segments' end points, extra
+                           columns (e.g. altitude) are ignored
+
+        Returns:
+            Crossings of flat arrays of segment id, polygon id, the
+            t_start < t_end parameters along the segment and the polygon's
+            altitude of every stretch of a segment over a polygon, sorted by
+            segment then t_start
+        """
+        starts, ends = np.asarray(starts, dtype=float)[:, :2], np.asarray(ends, dtype=float)[:, :2]
+        with trace.span('index_query'):
+            seg, poly = self.query(starts, ends)
+
+        polygons = self.polygons
+        vertices = (polygons.ring_offsets[polygons.polygon_offsets[poly + 1]] -
+                    polygons.ring_offsets[polygons.polygon_offsets[poly]])
+        pieces = [clip_segments(polygons, starts, ends, seg[part], poly[part]) for part in _chunks(vertices)]
+        if not pieces:
+            return no_crossings()
+
+        seg, poly, t_start, t_end = (np.concatenate(column) for column in zip(*pieces))
+        order = np.lexsort((t_start, seg))
+        trace.count('index_hits', len(order))
+        seg, poly = seg[order], poly[order]
+        return Crossings(seg, poly, t_start[order], t_end[order], np.asarray(self.alts[poly]))
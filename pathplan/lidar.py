@@ -0,0 +1,182 @@
+'''
+LiDAR coverage of planned paths.
+
+The sensor scans across track with a fixed field of view. At every sample
+along the path the ground swath is the cross-track line it sees, limited by
+the sensor range. Swaths are rasterized onto the surface raster to count how
+many scan lines cover each cell, which is what point density and coverage
+of a survey follow from.
+
+Path x, y are in metres and altitudes, like the surface, in feet. Heights
+above ground are converted to metres before they are turned into swath
+widths.
+'''
+
+from collections import namedtuple
+
+import numpy as np
+import pyproj
+
+from pathplan.clearance import raster_clearance, sample_path
+from pathplan.dilate import METRES_PER_FOOT, pixel_size_metres
+
+#Full across-track field of view, degrees
+DEFAULT_FOV = 30.0
+#Slant range past which returns are too weak to use, metres
+DEFAULT_RANGE = 400.0
+#Most swath points rasterized at once
+CHUNK_POINTS = 1 << 22
+
+Swath = namedtuple('Swath', ['xs', 'ys', 'agl', 'half_width', 'left', 'right'])
+
+
+def swath_half_widths(agl, fov=DEFAULT_FOV, max_range=DEFAULT_RANGE):
+    """
+    Half width in metres of the ground swath at each height above ground in
+    feet. The swath narrows once its edges are out of range (max_range, in
+    metres) and is empty out of range or below ground.
+    """
+    agl = np.asarray(agl, dtype=float) * METRES_PER_FOOT
+    in_range = (agl > 0) & (agl < max_range)
+    safe_agl = np.where(in_range, agl, 0)
+
+    half_width = np.minimum(safe_agl * np.tan(np.radians(fov) / 2),
+                            np.sqrt(max_range**2 - safe_agl**2))
+    return np.where(in_range, half_width, 0)
+
+
+def swath_footprint(path, ground, fov=DEFAULT_FOV, max_range=DEFAULT_RANGE, spacing=1.0):
+    """
+    Ground swath of a path.
+
+    Args:
+        path - list of (x, y, z) waypoints
+        ground - function mapping arrays of xs, ys to the ground height, see
+                 raster_clearance
+        fov - full across-track field of view in degrees
+        max_range - sensor range in metres
+        spacing - distance between scan lines along the path
+
+    Returns:
+        Swath with the x, y, height above ground (feet) and swath half width
+        (metres) of every scan line, and the (n, 2) left and right swath
+        edges
+    """
+    _, xs, ys, zs = sample_path(path, spacing)
+    agl = zs - ground(xs, ys)
+    half_width = swath_half_widths(agl, fov, max_range)
+
+    # Unit vector across track, from the heading at each sample
+    dx, dy = np.gradient(xs), np.gradient(ys)
+    norm = np.hypot(dx, dy)
+    norm[norm == 0] = 1
+    across = np.column_stack((-dy / norm, dx / norm))
+
+    center = np.column_stack((xs, ys))
+    left = center + across * half_width[:, None]
+    right = center - across * half_width[:, None]
+
+    return Swath(xs, ys, agl, half_width, left, right)
+
+
+def to_pixels(xs, ys, affine=None, src_proj=None, dst_proj=None):
+    """
+    Raster (col, row) coordinates of points, transformed like raster_clearance
+    does
+    """
+    if src_proj is not None and dst_proj is not None:
+        xs, ys = pyproj.transform(src_proj, dst_proj, xs, ys)
+    xs, ys = np.asarray(xs, dtype=float), np.asarray(ys, dtype=float)
+    if affine is None:
+        return xs, ys
+    inv = ~affine
+    return inv.a * xs + inv.b * ys + inv.c, inv.d * xs + inv.e * ys + inv.f
+
+
+def coverage_counts(path, surface, affine=None, src_proj=None, dst_proj=None,
+                    fov=DEFAULT_FOV, max_range=DEFAULT_RANGE, spacing=1.0):
+    """
+    Number of scan lines of a path covering each cell of a raster.
+
+    Args:
+        path - list of (x, y, z) waypoints
+        surface - 2d array of surface heights (axis 0 is y)
+        affine, src_proj, dst_proj - how path coordinates map onto the
+                 raster, see raster_clearance
+        fov, max_range - the sensor, see swath_footprint
+        spacing - distance between scan lines and between the points
+                  rasterized along each of them. Should be at most a cell
+
+    Returns:
+        integer array shaped like surface
+    """
+    rows, cols = surface.shape
+    counts = np.zeros(rows * cols, dtype=np.int64)
+    if len(path) < 2:
+        return counts.reshape(rows, cols)
+
+    ground = raster_clearance(surface, 0, affine, src_proj, dst_proj)
+    swath = swath_footprint(path, ground, fov, max_range, spacing)
+
+    seen = swath.half_width > 0
+    if not seen.any():
+        return counts.reshape(rows, cols)
+
+    reach = int(np.ceil(swath.half_width.max() / spacing))
+    offsets = np.arange(-reach, reach + 1) * spacing
+    lines = np.flatnonzero(seen)
+
+    for start in range(0, len(lines), CHUNK_POINTS // len(offsets) + 1):
+        line = lines[start:start + CHUNK_POINTS // len(offsets) + 1]
+
+        # Points every `spacing` across each scan line, as a (lines, steps) grid
+        covered = np.abs(offsets)[None, :] <= swath.half_width[line, None]
+        across = (swath.left[line] - swath.right[line]) / (2 * swath.half_width[line, None])
+        xs = swath.xs[line, None] + across[:, 0, None] * offsets[None, :]
+        ys = swath.ys[line, None] + across[:, 1, None] * offsets[None, :]
+        line_ids = np.broadcast_to(line[:, None], xs.shape)[covered]
+
+        col, row = to_pixels(xs[covered], ys[covered], affine, src_proj, dst_proj)
+        col, row = np.floor(col).astype(int), np.floor(row).astype(int)
+        inside = (col >= 0) & (col < cols) & (row >= 0) & (row < rows)
+
+        # A cell counts once per scan line however many of its points land in it
+        cells = row[inside] * cols + col[inside]
+        hits = np.unique(line_ids[inside] * (rows * cols) + cells) % (rows * cols)
+        counts += np.bincount(hits, minlength=rows * cols)
+
+    return counts.reshape(rows, cols)
+
+
+def cell_area(affine, crs, shape):
+    """
+    Ground area in square metres of a cell of a raster, see
+    dilate.pixel_size_metres
+    """
+    width, height = pixel_size_metres(affine, crs, shape)
+    return float(width * height)
+
+
+def coverage_stats(counts, cell_area=1.0, mask=None):
+    """
+    Coverage statistics of a coverage_counts raster.
+
+    Args:
+        counts - scan lines covering each cell
+        cell_area - ground area of a cell, see lidar.cell_area
+        mask - boolean array of the cells that should be covered, defaults
+               to every cell
+
+    Returns:
+        dict with the covered area and fraction of the masked cells, and the
+        mean and minimum scan lines per covered cell
+    """
+    counts = np.asarray(counts)
+    if mask is not None:
+        counts = counts[mask]
+    covered = counts[counts > 0]
+
+    return {'covered_area': covered.size * cell_area,
+            'covered_fraction': covered.size / float(counts.size) if counts.size else float('nan'),
+            'mean_lines': float(covered.mean()) if covered.size else 0.0,
+            'min_lines': int(covered.min()) if covered.size else 0}
@@ -0,0 +1,274 @@
+'''
+Mission upload and progress monitoring over the MAVLink mission protocol.
+
+Both classes only use `add_message_listener`, `remove_message_listener`,
+`send_mavlink` and `message_factory` of the vehicle they are given, so they
+work against a dronekit Vehicle connected to a SITL as well as against a
+mocked MAVLink endpoint providing the same four attributes (see
+tests/test_mission.py).
+'''
+
+import json
+import logging
+import os
+import threading
+import time
+from itertools import islice
+
+log = logging.getLogger(__name__)
+
+CHUNK_SIZE = 32
+UPLOAD_TIMEOUT = 5.0
+UPLOAD_RETRIES = 3
+
+MAV_MISSION_ACCEPTED = 0
+
+
+class MissionUploader(object):
+    """
+    Uploads a mission item by item as the vehicle requests them.
+
+    Commands are pulled from `commands` (any iterable, e.g. a generator) a
+    chunk at a time, and items the vehicle has acknowledged are dropped, so
+    memory stays bounded by the chunk size instead of the mission length.
+
+    The vehicle requesting item N acknowledges items 0..N-1. Progress is
+    written to `state_file` (if given) so an interrupted upload can be
+    resumed from the last acknowledged item with a partial list write. A
+    later upload only resumes if the state was saved for the same
+    `mission_id` and the vehicle still holds a mission of `total` items, so
+    a regenerated mission or a wiped vehicle is uploaded from the start.
+
+    Args:
+        vehicle - dronekit Vehicle or mock with the same message API
+        commands - iterable of dronekit Commands, in mission order
+        total - number of commands in the mission
+        chunk_size - number of commands to pull from `commands` at once
+        state_file - JSON file to record upload progress in
+        on_progress - called with (acknowledged, total) as items are acked
+        mission_id - identifies the mission's content, e.g. a hash of the
+                     files it is built from. Without it uploads never resume
+                     from the state file
+    """
+
+    def __init__(self, vehicle, commands, total, chunk_size=CHUNK_SIZE,
+                 state_file=None, on_progress=None, target_system=1, target_component=0, mission_id=None):
+        self.vehicle = vehicle
+        self.total = total
+        self.mission_id = mission_id
+        self.chunk_size = chunk_size
+        self.state_file = state_file
+        self.on_progress = on_progress
+        self.target_system = target_system
+        self.target_component = target_component
+
+        self.acknowledged = 0
+        self.error = None
+
+        self._commands = iter(commands)
+        self._window = {}
+        self._next_seq = 0
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._last_activity = time.time()
+
+    def resume_point(self):
+        """
+        Returns the number of items acknowledged by a previous upload of this
+        mission, as recorded in the state file
+        """
+        if self.mission_id is None or self.state_file is None or not os.path.exists(self.state_file):
+            return 0
+
+        with open(self.state_file) as state:
+            saved = json.load(state)
+
+        if saved.get('mission') != self.mission_id or saved.get('total') != self.total:
+            return 0
+        return saved.get('acknowledged', 0)
+
+    def vehicle_count(self, timeout=UPLOAD_TIMEOUT):
+        """
+        Asks the vehicle how many mission items it holds
+
+        Returns:
+            the count, or None if the vehicle did not answer within timeout
+        """
+        counted = threading.Event()
+        counts = []
+
+        def on_count(vehicle, name, msg):
+            counts.append(msg.count)
+            counted.set()
+
+        self.vehicle.add_message_listener('MISSION_COUNT', on_count)
+        try:
+            self.vehicle.message_factory.mission_request_list_send(self.target_system, self.target_component)
+            counted.wait(timeout)
+        finally:
+            self.vehicle.remove_message_listener('MISSION_COUNT', on_count)
+        return counts[0] if counts else None
+
+    def _save_state(self):
+        if self.state_file is None:
+            return
+        with open(self.state_file, 'w') as state:
+            json.dump({'mission': self.mission_id, 'total': self.total, 'acknowledged': self.acknowledged}, state)
+
+    def _item(self, seq):
+        while self._next_seq <= seq:
+            chunk = list(islice(self._commands, self.chunk_size))
+            if not chunk:
+                break
+            for cmd in chunk:
+                self._window[self._next_seq] = cmd
+                self._next_seq += 1
+
+        for old in [s for s in self._window if s < self.acknowledged]:
+            del self._window[old]
+
+        return self._window.get(seq)
+
+    def _acknowledge(self, count):
+        if count <= self.acknowledged:
+            return
+        self.acknowledged = count
+        self._save_state()
+        if self.on_progress is not None:
+            self.on_progress(self.acknowledged, self.total)
+
+    def _on_request(self, vehicle, name, msg):
+        with self._lock:
+            self._last_activity = time.time()
+            self._acknowledge(msg.seq)
+
+            cmd = self._item(msg.seq)
+            if cmd is None:
+                self.error = "vehicle requested item {0} which is no longer available".format(msg.seq)
+                self._done.set()
+                return
+
+            cmd.seq = msg.seq
+            cmd.target_system = self.target_system
+            cmd.target_component = self.target_component
+            self.vehicle.send_mavlink(cmd)
+
+    def _on_ack(self, vehicle, name, msg):
+        with self._lock:
+            self._last_activity = time.time()
+            if msg.type == MAV_MISSION_ACCEPTED:
+                self._acknowledge(self.total)
+            else:
+                self.error = "vehicle rejected the mission (MAV_MISSION_RESULT {0})".format(msg.type)
+            self._done.set()
+
+    def _start(self, start):
+        factory = self.vehicle.message_factory
+        if start == 0:
+            factory.mission_count_send(self.target_system, self.target_component, self.total)
+        else:
+            factory.mission_write_partial_list_send(self.target_system, self.target_component, start, self.total - 1)
+
+    def upload(self, resume=True, timeout=UPLOAD_TIMEOUT, retries=UPLOAD_RETRIES):
+        """
+        Uploads the mission, blocking until the vehicle accepts it.
+
+        If the vehicle stops requesting items for `timeout` seconds the upload
+        is restarted from the last acknowledged item, up to `retries` times.
+
+        Returns:
+            True if the vehicle accepted the mission
+        """
+        start = self.resume_point() if resume else 0
+        # A partial list write is only accepted over a mission as long as
+        # ours, which a restarted or wiped vehicle no longer has
+        if start > 0:
+            count = self.vehicle_count(timeout)
+            if count != self.total:
+                log.info("Vehicle holds %s mission items, not %d, uploading from the start", count, self.total)
+                start = 0
+        # Skip the items a previous upload already got through
+        for _ in islice(self._commands, start):
+            pass
+        self._next_seq = start
+        self.acknowledged = start
+
+        self.vehicle.add_message_listener('MISSION_REQUEST', self._on_request)
+        self.vehicle.add_message_listener('MISSION_ACK', self._on_ack)
+        try:
+            attempts = 0
+            self._last_activity = time.time()
+            self._start(start)
+            while not self._done.wait(timeout):
+                if time.time() - self._last_activity < timeout:
+                    continue
+                attempts += 1
+                if attempts > retries:
+                    self.error = "upload stalled at item {0} of {1}".format(self.acknowledged, self.total)
+                    break
+                log.warning("Mission upload stalled, resuming from item %d", self.acknowledged)
+                self._last_activity = time.time()
+                self._start(self.acknowledged)
+        finally:
+            self.vehicle.remove_message_listener('MISSION_REQUEST', self._on_request)
+            self.vehicle.remove_message_listener('MISSION_ACK', self._on_ack)
+
+        if self.error is not None:
+            log.error("Mission upload failed: %s", self.error)
+            return False
+
+        if self.state_file is not None and os.path.exists(self.state_file):
+            os.remove(self.state_file)
+        return True
+
+
+class MissionMonitor(object):
+    """
+    Tracks mission progress from MISSION_CURRENT and MISSION_ITEM_REACHED
+    messages instead of polling the vehicle.
+
+    Args:
+        vehicle - dronekit Vehicle or mock with the same message API
+        last_seq - sequence number of the final mission item
+        on_waypoint - called with the new sequence number whenever the
+                      vehicle heads for a new waypoint
+    """
+
+    def __init__(self, vehicle, last_seq, on_waypoint=None):
+        self.vehicle = vehicle
+        self.last_seq = last_seq
+        self.on_waypoint = on_waypoint
+        self.current = 0
+        self._finished = threading.Event()
+
+    def _on_current(self, vehicle, name, msg):
+        if msg.seq == self.current:
+            return
+        self.current = msg.seq
+        if self.on_waypoint is not None:
+            self.on_waypoint(msg.seq)
+        if msg.seq >= self.last_seq:
+            self._finished.set()
+
+    def _on_reached(self, vehicle, name, msg):
+        if msg.seq >= self.last_seq:
+            self._finished.set()
+
+    def __enter__(self):
+        self.vehicle.add_message_listener('MISSION_CURRENT', self._on_current)
+        self.vehicle.add_message_listener('MISSION_ITEM_REACHED', self._on_reached)
+        return self
+
+    def __exit__(self, *exc):
+        self.vehicle.remove_message_listener('MISSION_CURRENT', self._on_current)
+        self.vehicle.remove_message_listener('MISSION_ITEM_REACHED', self._on_reached)
+        return False
+
+    def wait(self, timeout=None):
+        """
+        Blocks until the vehicle heads for the final waypoint
+
+        Returns:
+            True if it did before the timeout
+        """
+        return self._finished.wait(timeout)
@@ -1,111 +1,45 @@
-import rasterio
-import pyproj
-import matplotlib.pyplot as plt
-import mpl_toolkits.mplot3d as Axes3D
-
-from shapely.ops import transform
-from shapely.geometry import shape, LineString, Polygon, MultiPolygon
-from shapely.strtree import STRtree
-from shapely.wkb import dumps
-
-from pathplan.utils import read_init_path, distance
-from pathplan.path_planner_numpy import smooth_line
+import numpy as np
+from shapely.geometry import LineString
+
+from pathplan.utils import read_init_path, save_path, distance
+from pathplan.geo import load_shapefile, load_altfile
+from pathplan.intersect import SurfaceIndex
+from pathplan.clearance import check_clearance
+from pathplan.decimate import decimate_path
 from pathplan.smoothing import concavity_smooth
+from pathplan import trace
 
 
-import json
-import math
+import logging
 
 import time
 
 import sys
 
-#returns true if concave up
-def determine_concavity(p1, p2, last_slope):
-    dist = ((p1[0] - p2[0])**2 + (p1[1] - p2[1])**2)**.5
-    alt_change = p2[2] - p1[2]
-    slope = alt_change / dist
+log = logging.getLogger(__name__)
 
-    return slope - last_slope > 0, slope
-
-def bleh(path):
-    concave_up = []
-    concave_down = []
-
-    concave_up_run = None
-
-    p1 = path[0]
-    p2 = path[1]
-
-    dist = ((p1[0] - p2[0])**2 + (p1[1] - p2[1])**2)**.5
-    alt_change = p2[2] - p1[2]
-
-    last_slope = alt_change / dist 
-
-    last_point = p2
-
-    start = p1
-
-    max_height = max(p1[2], p2[2])
-
-    max_point = p1 if max_height == p1[2] else p2
-  
-    new_points = []
-    for point in path[2:]:
-        new_concavity, last_slope = determine_concavity(last_point, point, last_slope)
+#Stretches of every segment of the path over the polygons of the surface
+#index, all segments queried and clipped in one bulk call (see
+#pathplan.intersect). Returns flat arrays of the segment of each stretch,
+#its first and last points and the altitude of its polygon plus buf, sorted
+#along the path.
+#timers, if given, is a dict accumulating the 'intersection' seconds
+def get_intersection_map(index, path, buf, timers=None):
+    points = np.asarray(path, dtype=float)
+    inter_start = time.time()
+    seg_ids, _, t_start, t_end, alts = index.intersect(points[:-1], points[1:])
+    inter_time = time.time() - inter_start
+    log.debug("bulk intersection returns %d stretches over %d segments", len(seg_ids), len(points) - 1)
 
-        if new_concavity != concave_up_run and concavity != None:
-            #if concave_up_run:
-            #    pass
-            #else:
-            start_x, start_y, start_z = start
-            max_x, max_y, max_z = max_point
-            max_x, max_y, max_z = max_point
-            new_points.append(start)
-            new_points.append((start_x, start_y, max_z))
-            new_points.append((max_x, maxy, max_z))
-            new_points.append((last_point[0], last_point[1], max_z))
-            new_points.append(last_point)
+    deltas = points[1:] - points[:-1]
+    firsts = points[seg_ids] + deltas[seg_ids] * t_start[:, None]
+    lasts = points[seg_ids] + deltas[seg_ids] * t_end[:, None]
 
-            max_height = point[2]
-            start = point
-        else:
-            max_height = max(point[2], max_height)
-        
-        concavity = new_concavity
-        last_point = point
+    if timers is not None:
+        timers['intersection'] += inter_time
 
-    return new_points
-        
-        
-        
-        
+    return seg_ids, firsts, lasts, alts + buf
 
-def get_intersection_map(strtree, alt_dict, segment, buf):
-    print(segment)
-    ls = LineString(segment)
-    query_start = time.time()
-    intersecting = list(strtree.query(ls))
-    #query_time += time.time() - query_start
- 
-    print("R Tree query returns {0} intersections".format(len(intersecting)))
-    inter_start = time.time()
-    int_dict = {}
-    lines = []
-    for inter in intersecting:
- 
-        pure_inter_start = time.time()
-        intersection = inter.intersection(ls)
-        #pure_inter_time += time.time() - pure_inter_start
- 
-        if not intersection.is_empty:
-           alt = alt_dict[inter.wkt]
-           int_dict[intersection.wkt] = alt + buf
-           lines.append(intersection)
- 
-    return lines, int_dict
-
-from functools import reduce
 
 def project_along_line(dist, p1, p2):
     dx = p1[0] - p2[0]
@@ -177,7 +111,7 @@ def adjust_speed(lines, smooth_dict, min_speed, target_speed, climb_rate, descen
 
     while len(lines) > 0:
 
-        print(len(lines))
+        log.debug("%d lines left to adjust", len(lines))
 
         vert_dist = abs(alt2 - alt1)
         #descent
@@ -224,58 +158,26 @@ def adjust_speed(lines, smooth_dict, min_speed, target_speed, climb_rate, descen
             
 
 
-def smooth_segments(start, segments, seg_dict, min_length):
-    print("smoothing a segment", min_length)
-    sorted_segs = list(sorted(segments, key=lambda x: distance(start, x.coords[0])))
-    smooth_dict = dict(seg_dict)
+#Merges consecutive stretches along a segment, sorted by distance from its
+#start, into groups at least min_length of stretch long (the last group may
+#be shorter). Each group runs from the first point of its first stretch to
+#the last point of its last one at the highest altitude of its stretches.
+def smooth_segments(firsts, lasts, alts, min_length):
+    log.debug("smoothing a segment, min length %s", min_length)
+    if len(alts) == 0:
+        return firsts, lasts, alts
 
-    #This is dumb
-    def reducer(acc, nxt):
-
-        master_list, accum_list, dist = acc
-        
-        accum_list.append(nxt)
-        total_dist = nxt.length + dist
-        if total_dist >= min_length:
-            start_coord = accum_list[0].coords[0]
-
-            if total_dist >= min_length:
-                #dx = line.coords[1][0] - line.coords[0][0]
-                #dy = line.coords[1][1] - line.coords[0][1]
-                #norm = (dx**2 + dy**2)**.5
-                #dx = (dx / norm) * (min_length - dist)
-                #dy = (dy / norm) * (min_length - dist)
-                #end_coord = (line.coords[0][0] + dx, line.coords[0][1] + dy, 0)
-                end_coord = nxt.coords[-1]
-                ls = LineString([start_coord, end_coord])
-                smooth_dict[ls.wkt] = max([smooth_dict[x.wkt] for x in accum_list])
-
-                master_list.append(ls)
-                accum_list = []
-                dist = 0
-                #remainder = LineString([end_coord, line.coords[1]])
-                #smooth_dict[remainder.wkt] = smooth_dict[line.wkt]
-
-                #accum_list.clear()
-                #if remainder.length >= min_length:
-                #    master_list.append(remainder)
-                #    dist = 0
-                #    assert len(accum_list) == 0
-                #elif remainder.length > 0:
-                #    accum_list.append(remainder)
-                #    assert len(accum_list) == 1
-                #    dist = remainder.length
-        else:
-            accum_list.append(nxt)
-            dist += nxt.length
+    total = np.cumsum(np.hypot(lasts[:, 0] - firsts[:, 0], lasts[:, 1] - firsts[:, 1]))
+    heads, tails = [], []
+    start, done = 0, 0.0
+    while start < len(total):
+        end = max(int(np.searchsorted(total, done + min_length)), start)
+        end = min(end, len(total) - 1)
+        heads.append(start)
+        tails.append(end)
+        start, done = end + 1, total[end]
 
-        return master_list, accum_list, dist    
-
-    (smooth_lines, accum, _) = tuple(reduce(reducer, sorted_segs, ([], [], 0)))
-    if len(accum) > 0:
-        smooth_lines.append(LineString([accum[0].coords[0], accum[-1].coords[1]]))
-        smooth_dict[smooth_lines[-1].wkt] = max([smooth_dict[x.wkt] for x in accum]) 
-    return smooth_lines, smooth_dict
+    return firsts[heads], lasts[tails], np.maximum.reduceat(alts, heads)
 
 def lines_to_coords(lines, smooth_dict):
     coords = []
@@ -286,24 +188,6 @@ def lines_to_coords(lines, smooth_dict):
 
     return coords
 
-def resolve_two_dicts(canopies, lines, canopy_dict, int_dict):
-    canopy = STRtree(list(canopies))
-    new_dict = {}
-    new_segs = []
-    for line in lines:
-       queried = canopy.query(line)
-       
-       for inter in queried:
-           intersection = inter.intersection(ls)
-
-           if not intersection.is_empty:
-              alt1 = canopy_dict[inter.wkt]
-              alt2 = int_dict[line.wkt]
-              int_dict[intersection.wkt] = max(alt1, alt2)
-              new_segs.append(intersection)
-
-    return new_segs, new_dict
-
 def account_for_speed(path, horiz_speed, descent_rate, climb_rate):
     new_path = []
     last = path[0]
@@ -330,69 +214,76 @@ def account_for_speed(path, horiz_speed, descent_rate, climb_rate):
 
 # Args:
 #   path: (latitude, longitude) tuples
-#   strtree: STRtree containing the topology of the area to explore
-#   alt_dict: dict mapping shapely wkt to altitude
-#   buffer: number representing how close we need to be to intersect
-def plan_path(path, strtree, alt_dict, be_buffer, obs_buffer, min_alt_change, climb_rate, descent_rate, speed, canopy_strtree=None, canopy_alt_dict=None):
+#   index: SurfaceIndex (or tiles.TiledIndex) of the required altitude surface (see pathplan.dilate
+#          and TestCase.required_surface), which fuses the bare earth and
+#          canopy and whose altitudes are be_buffer short of the altitude to
+#          fly at
+#   be_buffer: height to keep above the bare earth, added to the surface's
+#              altitudes here and taken off again for the obstacles returned
+#              for graphing
+#   obs_buffer: distance kept from the canopy and obstacles, horizontally and
+#               vertically. It is applied by the surface, so queries stay as
+#               cheap
+#   min_speed: unused until adjust_speed is
+def plan_path(path, index, be_buffer, obs_buffer, min_alt_change, climb_rate, descent_rate, speed, min_speed=None):
     segments = []
-    min_height = be_buffer
-    print(path)
+    log.debug("planning over %s", path)
     for i in range(1, len(path)):
         segments.append((path[i-1], path[i]))
 
-    #print("Built Segments")
-    #print("segments", segments)
-
     new_path  = []
 
-    sorting_time = 0
-    query_time = 0
-    total_time = 0
-    intersection_time = 0
-    pure_inter_time = 0
+    timers = {'intersection': 0}
+    total_start = time.time()
 
-    last_seg = None
+    if len(segments) == 0:
+        return new_path, []
 
-    obs_for_graph = []
+    seg_ids, firsts, lasts, alts = get_intersection_map(index, path, be_buffer, timers)
+    bounds = np.searchsorted(seg_ids, np.arange(len(segments) + 1))
 
-    super_int_dict = {}
-
-    for seg in segments:
-        #print("Started Segment")
-        init_time = time.time()
-        lines, int_dict = get_intersection_map(strtree, alt_dict, seg, be_buffer)
-
-        for (key, val) in int_dict.items():
-            super_int_dict[key] = val - be_buffer
-
-        if canopy_strtree != None and canopy_alt_dict != None:
-            canopy_dict, can_lineds = get_intersection_map(canopy_strtree, canopy_alt_dict, seg, canopy_buffer)
-            int_dict, lines = resolve_two_dicts(can_lines, lines, canopy_dict, int_dict) 
-
-        obs_for_graph.extend(list(sorted(lines, key=lambda x:distance(seg[0], x.coords[0]))))
-        lines, smooth_dict = smooth_segments(seg[0], lines, int_dict, min_alt_change)
-
-        print(lines)
+    for seg in range(len(segments)):
+        stretch = slice(bounds[seg], bounds[seg + 1])
+        with trace.span('smooth'):
+            starts, ends, zs = smooth_segments(firsts[stretch], lasts[stretch], alts[stretch], min_alt_change)
 
         #lines, smooth_dict = adjust_speed(lines, smooth_dict, min_speed, max_speed, climb_rate, descent_rate)
 
-        points = []
-        for line in lines:
-            z = smooth_dict[line.wkt]
-            x2,y2,_ = line.coords[-1]
-            x1,y1,_ = line.coords[0]
-            points.append((x1, y1, z))
-            points.append((x2, y2, z))
-
-        new_path.extend(points)
+        for (x1, y1), (x2, y2), z in zip(starts[:, :2].tolist(), ends[:, :2].tolist(), zs.tolist()):
+            new_path.append((x1, y1, z))
+            new_path.append((x2, y2, z))
 
     new_obs = []
-    for line in obs_for_graph:
-        new_obs.append((line.coords[0][0], line.coords[0][1], super_int_dict[line.wkt]))
-        new_obs.append((line.coords[1][0], line.coords[1][1], super_int_dict[line.wkt]))
-    #print(new_path)
+    for (x1, y1), (x2, y2), z in zip(firsts[:, :2].tolist(), lasts[:, :2].tolist(), (alts - be_buffer).tolist()):
+        new_obs.append((x1, y1, z))
+        new_obs.append((x2, y2, z))
+    total_time = time.time() - total_start
+    log.debug("plan_path: %d segments in %.3fs (intersection %.3fs)", len(segments), total_time, timers['intersection'])
+    trace.count('intersection_seconds', timers['intersection'])
+
     return new_path, new_obs
 
+# Plans a path and finishes it the same way for every caller: the profile is
+# optionally replaced by the upper hull of the clearance, the fewest altitude
+# changes that stay above it, then decimated and checked against the
+# clearance.
+#   path, index: as for plan_path
+#   clearance: function mapping arrays of xs, ys to the altitude to fly at,
+#              see clearance.raster_clearance
+#   params: dict of be_buffer, obs_buffer (default 0), min_length,
+#           climb_rate, descent_rate, max_speed, min_speed and the optional
+#           hull (default off) and decimate (default on) flags
+# Returns the path, the obstacles plan_path returns and the ClearanceReport
+# of the path
+def plan_checked_path(path, index, clearance, params):
+    gen_path, obstacles = plan_path(path, index, params['be_buffer'], params.get('obs_buffer', 0), params['min_length'],
+                                    params['climb_rate'], params['descent_rate'], params['max_speed'], params['min_speed'])
+    if params.get('hull'):
+        gen_path = concavity_smooth(gen_path, clearance, params['min_length'])
+    if params.get('decimate', True):
+        gen_path, _ = decimate_path(gen_path, clearance)
+    return gen_path, obstacles, check_clearance(gen_path, clearance)
+
 def vec_sub(first, second):
     dx = first[0] - second[0]
     dy = first[1] - second[1]
@@ -456,65 +347,38 @@ if __name__ == '__main__':
 
     parser = ArgumentParser(description="Generate a path for an Aerial Lidar drone")
     parser.add_argument("path_file", metavar="INPUT", type=str, help="The original path to modify")
-    parser.add_argument("shapes", metavar="BARE-EARTH-SHAPES", type=str, help="Shape file for the bare earth")
-    parser.add_argument("alt", metavar="BARE-EARTH-ALT", type=str, help="Altitude file for the bare earth")
-    parser.add_argument("--canopy-shapes", type=str, help="Shape file for the canopy", required=False)
-    parser.add_argument("--canopy-alt", type=str, help="Altitude file for the canopy")
+    parser.add_argument("shapes", metavar="BARE-EARTH-SHAPES", type=str, help="Shape file for the bare earth, ignored with --bare-earth-geotiff")
+    parser.add_argument("alt", metavar="BARE-EARTH-ALT", type=str, help="Altitude file for the bare earth, ignored with --bare-earth-geotiff")
     parser.add_argument("output", metavar="OUT", type=str, help="Filepath to output the generated path to")
     parser.add_argument("buffer", metavar="buffer", type=float, help="amount of space to leave between surface and path in meters")
+    parser.add_argument("--obs-buffer", type=float, default=0, help="amount of space to leave between the canopy and the path, also kept horizontally")
     parser.add_argument("--bare-earth-geotiff",  type=str, help="Contains the geotiff to generate the files from",  required=False)
-    parser.add_argument("--canopy-geotiff",  type=str, help="Contains the geotiff to generate the files from",  required=False)
+    parser.add_argument("--canopy-geotiff",  type=str, help="Canopy geotiff on the same grid as the bare earth one",  required=False)
+    parser.add_argument("--tile-pixels", type=int, help="vectorize the surface into tiles this many pixels square, loaded as the path reaches them", required=False)
 
     args = parser.parse_args()
+    trace.configure_from_env()
 
     miss_waypoints, proj = read_init_path(args.path_file)
 
     if args.bare_earth_geotiff:
-
-        vectors = get_vector_from_raster(args.geotif)
-        be_shapes, be_alt_dict = get_shapes_from_vector(vectors)
-
-        binary = dumps(MultiPolygon(shapes))
-
-        with open("gen/"+args.bare_earth_geotiff+".shapes", "wb") as wkb_file:
-            wkb_file.write(binary)
-        
-        with open("gen/"+args.bare_earth_geotiff+".alt.json", "w") as alt_dict_file:
-            json.dump(alt_dict, alt_dict_file)
-
-    else:
-        be_shapes = load_shapefile(args.shapes)
-        be_alt_dict = load_altfile(args.alt)
-
-    canopy_tree = None
-    canopy_shapes = None
-    canopy_alt_dict = None
-
-    if args.canopy_shapes and args.canopy_alt and args.canopy_geotiff:
-        vectors = get_vector_from_raster(args.canopy_geotiff)
-        can_shapes, can_alt_dict = get_shapes_from_vector(vectors)
-
-        binary = dumps(MultiPolygon(can_shapes))
-
-        with open("gen/"+args.canopy_geotiff+".shapes", "wb") as wkb_file:
-            wkb_file.write(binary)
-        
-        with open("gen/"+args.canopy_geotiff+".alt.json", "w") as alt_dict_file:
-            json.dump(alt_dict, alt_dict_file)
-    elif args.canopy_shapes and args.canopy_alt:
-        can_shapes = load_shapefile(args.shapes)
-        can_alt_dict = load_altfile(args.alt)
-    elif args.canopy_shapes or args.canopy_alt:
-        print("Error: you need to pass both a canopy altitude dict and a canopy shapefile in")
+        from pathplan.dilate import required_altitude_polygons, required_altitude_tiles
+        from pathplan.tiles import TiledIndex
+
+        # Bare earth and canopy are fused into one layer of the altitude to
+        # fly at less args.buffer, which plan_path adds
+        surface_args = (args.bare_earth_geotiff, args.canopy_geotiff, args.obs_buffer - args.buffer, args.obs_buffer)
+        if args.tile_pixels:
+            index = TiledIndex.load(required_altitude_tiles(*surface_args, proj=proj, tile_pixels=args.tile_pixels))
+        else:
+            index = SurfaceIndex.load(required_altitude_polygons(*surface_args, proj=proj))
+    elif args.canopy_geotiff or args.obs_buffer or args.tile_pixels:
+        print("Error: the canopy, obstacle buffer and tiling need --bare-earth-geotiff to build the surface from")
         sys.exit(-1)
+    else:
+        shapes = load_shapefile(args.shapes)
+        index = SurfaceIndex.from_shapes(shapes, load_altfile(args.alt))
 
-    if canopy_shapes != None:
-        canopy_tree = STRtree(canopy_shapes)        
-
-    be_tree = STRtree(be_shapes)
-
-    
-
-    new_path = plan_path(miss_waypoints, be_tree, be_alt_dict, args.buffer, 0, 2, 10,10, 10, 10, canopy_tree, canopy_alt_dict)
+    new_path, _ = plan_path(miss_waypoints, index, args.buffer, args.obs_buffer, 2, 10, 10, 10, 10)
 
     save_path(args.output, new_path, proj)
@@ -6,16 +6,22 @@
                  it is important to note that this program treats axis 0 as y.
 ---*-----------------------------------------------------------------------*'''
 
-import matplotlib.pyplot as plt
-from mpl_toolkits.mplot3d import Axes3D
-from matplotlib import cm
-from pathplan.geo import read_tif, wgs84
+from pathplan.geo import wgs84
 from pathplan.utils import save_path
+from pathplan.pathfile import read_waypoint_dicts
+from pathplan.decimate import decimate_path
+from pathplan.clearance import raster_clearance
+from pathplan.dilate import required_altitude
 
 import json
+import logging
 import numpy as np
 from math import hypot
 
+from pathplan import trace
+
+log = logging.getLogger(__name__)
+
 '''[Config vars]------------------------------------------------------------'''
 #RASTER_FILE = "../tests/images/sine-0.1f-20a.tif"
 RASTER_FILE = "../tests/images/black-mountain.tif"
@@ -25,11 +31,12 @@ PATH_SPACING = 0.5
 
 '''[gen_path]------------------------------------------------------------------ Adjusts waypoints as necessary to place them over surface model in raster, and then interpolates values between raster.
   
-  surface_raster - raster image containing surface map
+  required_raster - raster image of the altitude to fly at, see
+                    pathplan.dilate.required_altitude
   waypoints - list of waypoints to hit with path
   return - list of points in x,y,z coordinates representing revised waypoints
 ----------------------------------------------------------------------------'''
-def gen_path(surface_raster, canopy_raster, waypoints):
+def gen_path(required_raster, waypoints):
 
   #path_points = []
   x_points = []
@@ -40,7 +47,7 @@ def gen_path(surface_raster, canopy_raster, waypoints):
     return x_points, y_points, z_points
 
   for i in range(len(waypoints) - 1):
-    x, y, z = gen_segment(surface_raster, canopy_raster, waypoints[i], waypoints[i + 1])
+    x, y, z = gen_segment(required_raster, waypoints[i], waypoints[i + 1])
     x_points.extend(x)
     y_points.extend(y)
     z_points.extend(z)
@@ -51,12 +58,12 @@ def gen_path(surface_raster, canopy_raster, waypoints):
 '''[gen_segment]---------------------------------------------------------------
   Creates a segment from the x and y coordinates in the raster.
   
-  surface_raster - raster image containing surface map
+  required_raster - raster image of the altitude to fly at
   wp0 - source waypoint
   wp1 - dest waypoint
   return - list of x, y, z points interpolated between two waypoints
 ----------------------------------------------------------------------------'''
-def gen_segment(surface_raster, canopy_raster, wp0, wp1):
+def gen_segment(required_raster, wp0, wp1):
   src_x = wp0[0]
   src_y = wp0[1]
 
@@ -82,27 +89,20 @@ def gen_segment(surface_raster, canopy_raster, wp0, wp1):
   #points = []
 
   while curr_dist < seg_dist:
-    # calculate avoid height (can also utilize bare earth model in future)
-    avoid_height = HEIGHT_TO_BARE
-    canopy_avoid = HEIGHT_TO_CANOPY
-
-    # stay the designated height above the surface model
+    # the raster already holds the designated height above the bare earth
+    # and the canopy, whichever is higher
     x_points.append(x)
     y_points.append(y)
-    z_points.append(max(surface_raster[int(y)][int(x)] + avoid_height, canopy_raster[int(y)][int(x)] + canopy_avoid))
+    z_points.append(required_raster[int(y)][int(x)])
     #points.append([x, y, surface_raster[int(y)][int(x)] + avoid_height])
 
     x += delta_x * PATH_SPACING / seg_dist
     y += delta_y * PATH_SPACING / seg_dist
     curr_dist += PATH_SPACING
 
-  # calculate avoid height
-  avoid_height = HEIGHT_TO_BARE
-  
-  print(surface_raster.shape)
   x_points.append(dest_x)
   y_points.append(dest_y)
-  z_points.append(surface_raster[int(dest_y)][int(dest_x)] + avoid_height)
+  z_points.append(required_raster[int(dest_y)][int(dest_x)])
   #points.append([dest_x, dest_y, surface_raster[int(dest_y)][int(dest_x)] + avoid_height])
 
   return x_points, y_points, z_points
@@ -207,15 +207,15 @@ def smooth_line(points, max_height_diff):
   peaks.append(points[len(points) - 1])
   peak_inds.append(len(points) - 1)
   
-  print("Peaks:", peaks)
-  print("Peak Inds:", peak_inds)
+  log.debug("Peaks: %s", peaks)
+  log.debug("Peak Inds: %s", peak_inds)
   
   #peaks seems pretty useless actually...
   for i in range(1, len(peaks)):
     slope = (peaks[i] - peaks[i - 1]) / (peak_inds[i] - peak_inds[i - 1])
     slopes.append(slope)
   
-  print("Slopes:", slopes)
+  log.debug("Slopes: %s", slopes)
   
   #TODO fix case: flat area followed by neg slope. Flat area not decreasing in altitude, even though slope assumes start is at start of flat area
   # smooth negative slopes
@@ -261,20 +261,18 @@ def smooth_line(points, max_height_diff):
   return new_points
 
   
-import rasterio
-import pyproj
-def plan_path(init_waypoints, bare_earth, canopy,  proj=wgs84,smoothing_params=[10, 0.5]):
+#obs_buffer is the horizontal distance (in feet) to keep from
+#anything. The bare earth and canopy are fused, dilated by it, into a single
+#raster of the altitude to fly at, built once and cached on disk
+def plan_path(init_waypoints, bare_earth, canopy,  proj=wgs84,smoothing_params=[10, 0.5], decimate=True, obs_buffer=0):
   #[TODO] read waypoints from file
   #waypoints = [(0,0), (199, 199), (0, 199), (199, 0)]
+  import rasterio
+  import pyproj
 
   raster = rasterio.open(bare_earth)
-  print(raster.affine) 
-
   raster_proj = pyproj.Proj(raster.crs, preserve_units=True)
-
-  print(raster.bounds)
-  print("top lef", pyproj.transform(raster_proj, proj, raster.bounds.left, raster.bounds.top))
-  print("bottom right", pyproj.transform(raster_proj, wgs84, raster.bounds.right, raster.bounds.bottom))
+  log.debug("raster %s, bounds %s", raster.affine, raster.bounds)
 
   raster_width = abs(raster.bounds.right - raster.bounds.left)
   raster_height = abs(raster.bounds.top - raster.bounds.bottom)
@@ -282,36 +280,31 @@ def plan_path(init_waypoints, bare_earth, canopy,  proj=wgs84,smoothing_params=[
 
   waypoints = []
 
-  for waypoint in init_waypoints:
-    print(waypoint)
-    x,y = pyproj.transform(proj, raster_proj, waypoint[0], waypoint[1])
-    print("transformed",(x,y))
-    x,y = raster.index(x, y)
-    waypoints.append((x, y))
+  with trace.span('transform', waypoints=len(init_waypoints)):
+    for waypoint in init_waypoints:
+      x,y = pyproj.transform(proj, raster_proj, waypoint[0], waypoint[1])
+      x,y = raster.index(x, y)
+      waypoints.append((x, y))
 
-
-  print(waypoints)
+  log.debug("waypoints in raster coordinates %s", waypoints)
   #[DEBUG]
   #plt.imshow(image)
   #plt.show()
   
-  image, crs = read_tif(bare_earth)
-  image = image[0,:,:]
-  print(image)
-  print(image.shape)
-
-  canopy, cs = read_tif(canopy)
-  canopy = canopy[0,:,:]
-  print(canopy)
-  print(canopy.shape)
+  required = required_altitude(bare_earth, canopy, HEIGHT_TO_CANOPY - HEIGHT_TO_BARE, obs_buffer) + HEIGHT_TO_BARE
+  log.debug("required altitude raster %s", required.shape)
   
-  packed_waypoints = gen_path(image, canopy, waypoints)
-  print(packed_waypoints)
+  with trace.span('plan', waypoints=len(waypoints)):
+    packed_waypoints = gen_path(required, waypoints)
   x, y, z = packed_waypoints
 
   #for smooth_param in smoothing_params:
   #  z = smooth_line(z, smooth_param) 
 
+  if decimate:
+    decimated, _ = decimate_path(list(zip(x, y, z)), raster_clearance(required, 0), PATH_SPACING)
+    x, y, z = zip(*decimated)
+
   points = []
 
   for x1, y1, z1 in zip(x,y,z):
@@ -330,9 +323,9 @@ if __name__ == '__main__':
   canopy = sys.argv[2]
   path_file = sys.argv[3]
   
-  print(path_file)
-  path = [(x['latitude'], x['longitude']) for x in json.load(open(path_file))]
+  trace.configure_from_env()
+  path = [(x['latitude'], x['longitude']) for x in read_waypoint_dicts(path_file)]
   
   new_path = plan_path(path, bare_earth, canopy)
 
-  save_path('numpy_path.json', new_path,  None)
+  save_path('numpy_path.path', new_path,  None, {'planner': 'numpy', 'bare_earth': bare_earth, 'canopy': canopy, 'path': path_file})
@@ -0,0 +1,192 @@
+'''
+Reading and writing of waypoint files.
+
+Paths are stored either as the legacy JSON list of
+{'latitude', 'longitude', 'altitude'} dicts or in a compact columnar binary
+format. The binary layout is:
+
+    MAGIC (8 bytes) | header length (uint32, little endian) | JSON header |
+    padding to an 8 byte boundary | float64 latitude, longitude, altitude
+    (and optionally timestamp) columns, each `count` values long
+
+The header records the CRS, units and provenance of the path, so the columns
+can be memory mapped straight from disk without parsing every waypoint.
+'''
+
+import json
+import struct
+import time
+
+import numpy as np
+
+MAGIC = b'ALPPATH1'
+BINARY_PATH_EXT = '.path'
+COLUMNS = ('latitude', 'longitude', 'altitude')
+UNITS = {'latitude': 'degree', 'longitude': 'degree', 'altitude': 'metre'}
+
+_LEN_FMT = '<I'
+_DTYPE = '<f8'
+
+
+def is_binary_path(filepath):
+    """
+    Returns true if the file at filepath is in the columnar binary format
+    """
+    with open(filepath, 'rb') as path_file:
+        return path_file.read(len(MAGIC)) == MAGIC
+
+
+def encode_path_columns(lat, lon, alt, crs='epsg:4326', provenance=None, timestamps=None):
+    """
+    Encodes a path in the columnar binary format, arguments as for
+    write_path_columns
+    """
+    columns = list(COLUMNS)
+    data = [lat, lon, alt]
+    if timestamps is not None:
+        columns.append('timestamp')
+        data.append(timestamps)
+    cols = np.array(data, dtype=_DTYPE).reshape(len(columns), -1)
+
+    header = {
+        'crs': crs,
+        'columns': columns,
+        'units': UNITS,
+        'count': cols.shape[1],
+        'dtype': _DTYPE,
+        'created': time.time(),
+        'provenance': provenance or {},
+    }
+    raw_header = json.dumps(header).encode('utf-8')
+
+    prefix_len = len(MAGIC) + struct.calcsize(_LEN_FMT)
+    padding = -(prefix_len + len(raw_header)) % 8
+    raw_header += b' ' * padding
+
+    return b''.join([MAGIC, struct.pack(_LEN_FMT, len(raw_header)), raw_header,
+                     np.ascontiguousarray(cols).tobytes()])
+
+
+def write_path_columns(filepath, lat, lon, alt, crs='epsg:4326', provenance=None, timestamps=None):
+    """
+    Writes a path in the columnar binary format.
+
+    Args:
+        filepath - file to write to
+        lat, lon, alt - equal length sequences, degrees and metres
+        crs - the CRS the coordinates are in
+        provenance - optional dict describing what produced the path
+        timestamps - optional sequence of seconds, stored as a fourth column
+    """
+    with open(filepath, 'wb') as path_file:
+        path_file.write(encode_path_columns(lat, lon, alt, crs, provenance, timestamps))
+
+
+def decode_path_columns(data):
+    """
+    Decodes a path in the columnar binary format from bytes, e.g. received
+    over a socket.
+
+    Returns:
+        header dict, lat, lon, alt arrays
+    """
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError("not a binary path")
+    header_len, = struct.unpack_from(_LEN_FMT, data, len(MAGIC))
+    offset = len(MAGIC) + struct.calcsize(_LEN_FMT)
+    header = json.loads(data[offset:offset + header_len].decode('utf-8'))
+
+    shape = (len(header['columns']), header['count'])
+    cols = np.frombuffer(data, dtype=header['dtype'], count=shape[0] * shape[1],
+                         offset=offset + header_len).reshape(shape)
+    return header, cols[0], cols[1], cols[2]
+
+
+def read_path_header(filepath):
+    """
+    Reads the header of a binary path file.
+
+    Returns:
+        header dict, byte offset of the column data
+    """
+    with open(filepath, 'rb') as path_file:
+        magic = path_file.read(len(MAGIC))
+        if magic != MAGIC:
+            raise ValueError("{0} is not a binary path file".format(filepath))
+        header_len, = struct.unpack(_LEN_FMT, path_file.read(struct.calcsize(_LEN_FMT)))
+        header = json.loads(path_file.read(header_len).decode('utf-8'))
+
+    return header, len(MAGIC) + struct.calcsize(_LEN_FMT) + header_len
+
+
+def _map_columns(filepath, header, offset):
+    shape = (len(header['columns']), header['count'])
+    if header['count'] == 0:
+        return np.zeros(shape, dtype=header['dtype'])
+    return np.memmap(filepath, dtype=header['dtype'], mode='r', offset=offset, shape=shape)
+
+
+def read_path_columns(filepath):
+    """
+    Reads a path file in either format.
+
+    Binary files are memory mapped, JSON files are parsed into arrays.
+    Waypoints without an altitude get an altitude of 0.
+
+    Returns:
+        header dict, lat, lon, alt arrays
+    """
+    if is_binary_path(filepath):
+        header, offset = read_path_header(filepath)
+        cols = _map_columns(filepath, header, offset)
+        return header, cols[0], cols[1], cols[2]
+
+    with open(filepath) as path_file:
+        waypoints = json.load(path_file)
+
+    lat = np.array([wp['latitude'] for wp in waypoints], dtype=_DTYPE)
+    lon = np.array([wp['longitude'] for wp in waypoints], dtype=_DTYPE)
+    alt = np.array([wp.get('altitude', 0) for wp in waypoints], dtype=_DTYPE)
+    header = {'crs': 'epsg:4326', 'columns': list(COLUMNS), 'units': UNITS,
+              'count': len(waypoints), 'dtype': _DTYPE, 'provenance': {'source': filepath}}
+
+    return header, lat, lon, alt
+
+
+def read_path_timestamps(filepath):
+    """
+    Reads the timestamps of a path file in either format.
+
+    Returns:
+        array of timestamps, or None if the path has none
+    """
+    if is_binary_path(filepath):
+        header, offset = read_path_header(filepath)
+        if 'timestamp' not in header['columns']:
+            return None
+        return _map_columns(filepath, header, offset)[header['columns'].index('timestamp')]
+
+    with open(filepath) as path_file:
+        waypoints = json.load(path_file)
+
+    if len(waypoints) == 0 or 'timestamp' not in waypoints[0]:
+        return None
+    return np.array([wp['timestamp'] for wp in waypoints], dtype=_DTYPE)
+
+
+def iter_waypoint_dicts(filepath):
+    """
+    Lazily reads a path file in either format as the legacy
+    {'latitude', 'longitude', 'altitude'} dicts
+    """
+    _, lat, lon, alt = read_path_columns(filepath)
+    for la, lo, al in zip(lat, lon, alt):
+        yield {'latitude': float(la), 'longitude': float(lo), 'altitude': float(al)}
+
+
+def read_waypoint_dicts(filepath):
+    """
+    Reads a path file in either format as the legacy list of
+    {'latitude', 'longitude', 'altitude'} dicts
+    """
+    return list(iter_waypoint_dicts(filepath))
@@ -0,0 +1,439 @@
+'''
+Cached pipeline from a tif and an initial path to a flight report.
+
+The stages, vectorize -> plan -> fly -> parse -> report, are declared over
+the existing planning, SITL and evaluation functions. Every task's output
+directory is named by a hash of its stage, the parameters the stage uses and
+its inputs: the content of input files, or the key of the task that produced
+them. Keys are known before anything runs, so a task whose output directory
+already exists is skipped, including when another machine sharing the
+artifact directory produced it. Outputs are written to a temporary
+directory and renamed into place, so a partial run never looks complete.
+
+Independent tasks run in parallel: compute stages on a process pool, flights
+on as many SITL instances as are available.
+
+    python -m pathplan.pipeline TIF PATH PARAMS [PARAMS ...] [--until STAGE]
+
+The artifact directory defaults to $PATHPLAN_ARTIFACTS or gen/artifacts.
+'''
+
+import hashlib
+import json
+import logging
+import os
+import queue
+import shutil
+import socket
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from pathplan import trace
+
+log = logging.getLogger(__name__)
+
+ARTIFACT_DIR = os.environ.get('PATHPLAN_ARTIFACTS', 'gen/artifacts')
+MANIFEST = 'manifest.json'
+
+POLYGONS_FILE = 'surface.polys.npy'
+REQUIRED_FILE = 'required.tif'
+PATH_FILE = 'path.path'
+LINES_FILE = 'lines.json'
+CLEARANCE_FILE = 'clearance.json'
+LOG_DIR = 'logs'
+FLIGHT_FILE = 'flight.json'
+REPORT_FILE = 'report.json'
+
+#name, function run as fn(inputs, params, outdir[, instance]), the parameters
+#it depends on, 'process' or 'sitl', the output file or directory, and a
+#version to bump when the function's results change
+Stage = namedtuple('Stage', ['name', 'fn', 'params', 'kind', 'output', 'version'])
+
+
+def vectorize(inputs, params, outdir):
+    """
+    Vectorizes the required altitude surface of the tif (and canopy) into
+    the projection of the path
+    """
+    from pathplan.dilate import required_altitude_tif
+    from pathplan.geo import vectorize_raster
+    from pathplan.polygons import from_vectors, save_polygons
+    from pathplan.utils import read_init_path
+
+    _, proj = read_init_path(inputs['path'])
+    tif_file = required_altitude_tif(inputs['tif'], inputs.get('canopy'), params['canopy_offset'],
+                                     params.get('obs_buffer', 0))
+    polygons = from_vectors(vectorize_raster(tif_file), params.get('transform', True), proj=proj)
+    save_polygons(os.path.join(outdir, POLYGONS_FILE), polygons)
+    # The planner checks clearance against the raster, so keep it with the
+    # polygons for machines that never built it
+    shutil.copyfile(tif_file, os.path.join(outdir, REQUIRED_FILE))
+
+
+def plan(inputs, params, outdir):
+    """
+    Plans, decimates and checks a path over a vectorized surface
+    """
+    from pathplan.intersect import SurfaceIndex
+    import rasterio
+    from pathplan.path_planner import plan_checked_path
+    from pathplan.clearance import raster_clearance
+    from pathplan.geo import read_tif
+    from pathplan.utils import read_init_path, save_path
+
+    path, proj = read_init_path(inputs['path'])
+    surface = inputs['surface']
+    with trace.span('index_build'):
+        index = SurfaceIndex.load(os.path.join(surface, POLYGONS_FILE))
+
+    required_file = os.path.join(surface, REQUIRED_FILE)
+    image, tif_proj = read_tif(required_file)
+    with rasterio.open(required_file) as raster:
+        clearance = raster_clearance(image[0, :, :], params['be_buffer'], raster.affine, proj, tif_proj)
+    gen_path, lines, report = plan_checked_path(path, index, clearance, params)
+
+    save_path(os.path.join(outdir, PATH_FILE), gen_path, proj, {'planner': 'shapely', 'params': params})
+    with open(os.path.join(outdir, LINES_FILE), 'w') as lines_file:
+        json.dump(lines, lines_file)
+    with open(os.path.join(outdir, CLEARANCE_FILE), 'w') as clearance_file:
+        json.dump({'min_clearance': report.min_clearance, 'violations': report.violations}, clearance_file)
+
+
+def fly(inputs, params, outdir, instance):
+    """
+    Flies the planned path on a SITL instance
+    """
+    from pathplan.farm import fly_mission
+    fly_mission(instance, os.path.join(inputs['plan'], PATH_FILE), inputs['tif'], os.path.join(outdir, LOG_DIR))
+
+
+def parse(inputs, params, outdir):
+    """
+    Parses the flight logs into the flown path
+    """
+    from pathplan.sitl import parse_bins
+    with open(os.path.join(outdir, FLIGHT_FILE), 'w') as flight_file:
+        json.dump(parse_bins(os.path.join(inputs['flight'], LOG_DIR)), flight_file)
+
+
+def report(inputs, params, outdir):
+    """
+    Compares the planned path with the flown and the initial paths
+    """
+    from pathplan.evaluation import COMPARISON_METRICS, comparison_metric
+    from pathplan.utils import read_init_path
+
+    planned, proj = read_init_path(os.path.join(inputs['plan'], PATH_FILE))
+    flown, _ = read_init_path(os.path.join(inputs['flight'], FLIGHT_FILE), proj)
+    init, _ = read_init_path(inputs['path'], proj)
+
+    with open(os.path.join(inputs['plan'], CLEARANCE_FILE)) as clearance_file:
+        result = json.load(clearance_file)
+    for name, _ in COMPARISON_METRICS:
+        result['flight_' + name] = float(comparison_metric(name, planned, flown))
+        result['init_' + name] = float(comparison_metric(name, init, planned))
+
+    with open(os.path.join(outdir, REPORT_FILE), 'w') as report_file:
+        json.dump(result, report_file)
+
+
+VECTORIZE = Stage('vectorize', vectorize, ['canopy_offset', 'obs_buffer', 'transform'], 'process', POLYGONS_FILE, 4)
+PLAN = Stage('plan', plan, ['be_buffer', 'obs_buffer', 'min_length', 'climb_rate', 'descent_rate',
+                            'max_speed', 'min_speed', 'decimate', 'hull'], 'process', PATH_FILE, 2)
+FLY = Stage('fly', fly, [], 'sitl', LOG_DIR, 1)
+PARSE = Stage('parse', parse, [], 'process', FLIGHT_FILE, 1)
+REPORT = Stage('report', report, [], 'process', REPORT_FILE, 1)
+STAGES = {stage.name: stage for stage in [VECTORIZE, PLAN, FLY, PARSE, REPORT]}
+
+_hashes = {}
+_hash_lock = threading.Lock()
+
+
+def file_hash(filepath):
+    """
+    sha1 of a file's content, memoized per process while its size and
+    modification time stay the same
+    """
+    stat = os.stat(filepath)
+    key = (os.path.abspath(filepath), stat.st_mtime, stat.st_size)
+    with _hash_lock:
+        if key in _hashes:
+            return _hashes[key]
+
+    digest = hashlib.sha1()
+    with open(filepath, 'rb') as data:
+        for block in iter(lambda: data.read(1 << 20), b''):
+            digest.update(block)
+
+    with _hash_lock:
+        _hashes[key] = digest.hexdigest()
+    return _hashes[key]
+
+
+class Task(object):
+    """
+    One run of a stage.
+
+    Args:
+        stage - the Stage to run
+        inputs - dict mapping input name to a file or to the Task producing it
+        params - dict of parameters, only those the stage uses are kept
+    """
+
+    def __init__(self, stage, inputs, params=None):
+        self.stage = stage
+        self.inputs = inputs
+        self.params = {name: value for name, value in (params or {}).items() if name in stage.params}
+        self._key = None
+
+    @property
+    def deps(self):
+        return [task for task in self.inputs.values() if isinstance(task, Task)]
+
+    @property
+    def key(self):
+        if self._key is None:
+            inputs = {name: value.key if isinstance(value, Task) else file_hash(value)
+                      for name, value in self.inputs.items()}
+            spec = json.dumps([self.stage.name, self.stage.version, self.params, inputs], sort_keys=True)
+            self._key = hashlib.sha1(spec.encode('utf-8')).hexdigest()
+        return self._key
+
+    def outdir(self, root=ARTIFACT_DIR):
+        return os.path.join(root, self.stage.name, self.key)
+
+    def output(self, root=ARTIFACT_DIR):
+        return os.path.join(self.outdir(root), self.stage.output)
+
+    def done(self, root=ARTIFACT_DIR):
+        return os.path.exists(os.path.join(self.outdir(root), MANIFEST))
+
+    def __repr__(self):
+        return "{0}:{1}".format(self.stage.name, self.key[:12])
+
+
+def run_task(stage_name, inputs, params, outdir, instance=None):
+    """
+    Runs a stage into a temporary directory and renames it to outdir. Runs
+    in the worker processes, so it only takes picklable arguments
+    """
+    stage = STAGES[stage_name]
+    tmp = "{0}.tmp-{1}-{2}-{3}".format(outdir, socket.gethostname(), os.getpid(), threading.current_thread().ident)
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+
+    start = time.time()
+    try:
+        with trace.span(stage_name):
+            if instance is None:
+                stage.fn(inputs, params, tmp)
+            else:
+                stage.fn(inputs, params, tmp, instance)
+    except Exception:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+    manifest = {'stage': stage_name, 'version': stage.version, 'params': params, 'inputs': inputs,
+                'host': socket.gethostname(), 'created': time.time(), 'duration': time.time() - start}
+    with open(os.path.join(tmp, MANIFEST), 'w') as manifest_file:
+        json.dump(manifest, manifest_file)
+
+    try:
+        os.rename(tmp, outdir)
+    except OSError:
+        # Someone else finished the same task first, theirs is as good
+        if not os.path.exists(os.path.join(outdir, MANIFEST)):
+            raise
+        shutil.rmtree(tmp)
+    return manifest['duration']
+
+
+def collect(targets):
+    """
+    Every task the targets depend on, dependencies first, one per key
+    """
+    ordered = {}
+
+    def visit(task):
+        if task.key in ordered:
+            return
+        for dep in task.deps:
+            visit(dep)
+        ordered[task.key] = task
+
+    for target in targets:
+        visit(target)
+    return list(ordered.values())
+
+
+class DependencyFailed(Exception):
+    pass
+
+
+class Runner(object):
+    """
+    Runs tasks and their dependencies, skipping the ones already in the
+    artifact directory.
+
+    Args:
+        root - the artifact directory, may be shared between machines
+        workers - processes for the compute stages, defaults to the cpu count
+        sitl_instances - SITL instances flights are spread over
+        first_instance - instance number of the first SITL
+    """
+
+    def __init__(self, root=ARTIFACT_DIR, workers=None, sitl_instances=1, first_instance=0):
+        self.root = root
+        self.workers = workers
+        self.sitl_instances = sitl_instances
+        self.first_instance = first_instance
+
+    def status(self, targets):
+        """
+        (task, whether it is cached) of every task the targets need
+        """
+        return [(task, task.done(self.root)) for task in collect(targets)]
+
+    def run(self, targets):
+        """
+        Brings every target up to date.
+
+        Returns:
+            dict mapping each task to its output directory, or to the
+            exception that stopped it
+        """
+        from pathplan.farm import FARM_DIR, SitlInstance
+
+        tasks = collect(targets)
+        results = {}
+        for task in tasks:
+            if task.done(self.root):
+                log.info("%s is up to date", task)
+                results[task.key] = task.outdir(self.root)
+        pending = [task for task in tasks if task.key not in results]
+
+        instances = queue.Queue()
+        for i in range(self.sitl_instances):
+            number = self.first_instance + i
+            instances.put(SitlInstance(number, os.path.join(FARM_DIR, "sitl-{0}".format(number))))
+
+        def fly_task(task, inputs):
+            instance = instances.get()
+            try:
+                return run_task(task.stage.name, inputs, task.params, task.outdir(self.root), instance)
+            finally:
+                instances.put(instance)
+
+        futures = {}
+        with ProcessPoolExecutor(self.workers) as processes, ThreadPoolExecutor(self.sitl_instances) as flights:
+            while pending or futures:
+                for task in list(pending):
+                    failed = [dep for dep in task.deps if isinstance(results.get(dep.key), Exception)]
+                    if failed:
+                        results[task.key] = DependencyFailed("{0} failed".format(failed[0]))
+                        pending.remove(task)
+                    elif all(dep.key in results for dep in task.deps):
+                        inputs = {name: results[value.key] if isinstance(value, Task) else value
+                                  for name, value in task.inputs.items()}
+                        os.makedirs(os.path.join(self.root, task.stage.name), exist_ok=True)
+                        if task.stage.kind == 'sitl':
+                            future = flights.submit(fly_task, task, inputs)
+                        else:
+                            future = processes.submit(run_task, task.stage.name, inputs, task.params, task.outdir(self.root))
+                        futures[future] = task
+                        pending.remove(task)
+
+                if not futures:
+                    continue
+
+                finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    task = futures.pop(future)
+                    try:
+                        log.info("%s took %.1fs", task, future.result())
+                        results[task.key] = task.outdir(self.root)
+                    except Exception as error:
+                        log.error("%s failed: %r", task, error)
+                        results[task.key] = error
+
+        return {task: results[task.key] for task in tasks + list(targets)}
+
+
+def mission_targets(tif, path, params, canopy=None, until='report'):
+    """
+    The task of stage `until` for flying path over tif with params, along
+    with the tasks it depends on
+    """
+    vectorize_inputs = {'tif': tif, 'path': path}
+    if canopy is not None:
+        vectorize_inputs['canopy'] = canopy
+
+    # The surface is built be_buffer short of the altitude to fly at, so
+    # over bare earth alone every be_buffer shares it
+    surface_params = dict(params)
+    surface_params['canopy_offset'] = params.get('obs_buffer', 0) - params['be_buffer'] if canopy is not None else 0
+
+    tasks = {}
+    tasks['vectorize'] = Task(VECTORIZE, vectorize_inputs, surface_params)
+    tasks['plan'] = Task(PLAN, {'path': path, 'surface': tasks['vectorize']}, params)
+    tasks['fly'] = Task(FLY, {'plan': tasks['plan'], 'tif': tif})
+    tasks['parse'] = Task(PARSE, {'flight': tasks['fly']})
+    tasks['report'] = Task(REPORT, {'plan': tasks['plan'], 'flight': tasks['parse'], 'path': path})
+    return tasks[until]
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    import sys
+
+    parser = ArgumentParser(description="Run the planning pipeline, skipping work already in the artifact directory")
+    parser.add_argument("tif", help="surface raster")
+    parser.add_argument("path", help="initial path")
+    parser.add_argument("params", nargs='+', help="params files, one target per file")
+    parser.add_argument("--canopy", help="canopy raster on the same grid as the surface")
+    parser.add_argument("--until", default='report', choices=list(STAGES), help="last stage to run")
+    parser.add_argument("--artifacts", default=ARTIFACT_DIR, help="artifact directory, may be shared")
+    parser.add_argument("--workers", type=int, default=None, help="processes for the compute stages")
+    parser.add_argument("--sitl-instances", type=int, default=1, help="SITL instances to fly on")
+    parser.add_argument("--no-transform", action='store_true', help="the tif is already in the path's projection")
+    parser.add_argument("--dry-run", action='store_true', help="only list the tasks and whether they are cached")
+    parser.add_argument("--out", help="copy the output of the (single) target here")
+    args = parser.parse_args()
+
+    trace.configure_from_env()
+    if not logging.getLogger('pathplan').level:
+        logging.basicConfig(format="%(asctime)s %(name)s %(levelname)s %(message)s")
+        logging.getLogger('pathplan').setLevel(logging.INFO)
+
+    targets = []
+    for params_file in args.params:
+        with open(params_file) as params_json:
+            params = json.load(params_json)
+        params.setdefault('transform', not args.no_transform)
+        targets.append(mission_targets(args.tif, args.path, params, args.canopy, args.until))
+
+    runner = Runner(args.artifacts, args.workers, args.sitl_instances)
+    if args.dry_run:
+        for task, cached in runner.status(targets):
+            print("{0:<24} {1}".format(repr(task), "cached" if cached else "to run"))
+        sys.exit(0)
+
+    results = runner.run(targets)
+    failed = [task for task in targets if isinstance(results[task], Exception)]
+    for params_file, target in zip(args.params, targets):
+        print("{0}: {1}".format(params_file, results[target] if target not in failed else "failed"))
+
+    if args.out and not failed:
+        if len(targets) != 1:
+            print("--out needs a single params file")
+            sys.exit(-1)
+        output = targets[0].output(args.artifacts)
+        if os.path.isdir(output):
+            shutil.copytree(output, args.out)
+        else:
+            shutil.copyfile(output, args.out)
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,237 @@
+'''
+Ragged array storage of vectorized surfaces, and the segment/polygon kernels
+that work on it.
+
+A surface of n polygons is held in five flat arrays instead of a list of
+shapely Polygons:
+
+    coords           (p, 2) float64 x, y of every ring vertex, each ring
+                     closed by repeating its first vertex
+    ring_offsets     (r + 1,) int64, ring i is coords[ring_offsets[i]:ring_offsets[i + 1]]
+    polygon_offsets  (n + 1,) int64, polygon j is made of rings
+                     polygon_offsets[j] to polygon_offsets[j + 1], its
+                     exterior first
+    bounds           (n, 4) float64 minx, miny, maxx, maxy of every polygon
+    alts             (n,) float64 altitude of every polygon
+
+They are saved back to back in a single .npy file, so loading a surface is
+one np.load, memory mapped: only the pages the planner touches are ever read.
+The kernels expand just the polygons they are given into their edges, so no
+Python geometry objects are created along the way.
+'''
+
+import os
+from collections import namedtuple
+
+import numpy as np
+
+from pathplan import trace
+
+Polygons = namedtuple('Polygons', ['coords', 'ring_offsets', 'polygon_offsets', 'bounds', 'alts'])
+
+POLYGONS_EXT = '.polys.npy'
+
+_MAGIC = 0x706f6c7973  # 'polys'
+_VERSION = 1
+_HEADER = 8
+
+
+def ragged_range(counts):
+    """
+    Expands ragged counts, returning for every element its owner and its
+    index within the owner: ragged_range([2, 0, 3]) is
+    ([0, 0, 2, 2, 2], [0, 1, 0, 1, 2])
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    owner = np.repeat(np.arange(len(counts)), counts)
+    firsts = np.cumsum(counts) - counts
+    return owner, np.arange(len(owner)) - firsts[owner]
+
+
+def _bounds(coords, ring_offsets, polygon_offsets):
+    if len(polygon_offsets) < 2:
+        return np.zeros((0, 4))
+    starts = ring_offsets[polygon_offsets[:-1]]
+    return np.column_stack((np.minimum.reduceat(coords, starts, axis=0),
+                            np.maximum.reduceat(coords, starts, axis=0)))
+
+
+def _pack(rings, polygon_rings, alts):
+    """
+    Polygons from a list of (k, 2) ring arrays, the number of rings of each
+    polygon and their altitudes
+    """
+    ring_offsets = np.concatenate(([0], np.cumsum([len(ring) for ring in rings]))).astype(np.int64)
+    polygon_offsets = np.concatenate(([0], np.cumsum(polygon_rings))).astype(np.int64)
+    coords = np.vstack(rings).astype(float) if rings else np.zeros((0, 2))
+    return Polygons(coords, ring_offsets, polygon_offsets, _bounds(coords, ring_offsets, polygon_offsets),
+                    np.asarray(alts, dtype=float))
+
+
+def from_shapes(shapes, alt_dict):
+    """
+    Polygons of a list of shapely Polygons, with their altitudes looked up
+    by wkt in alt_dict
+    """
+    rings = []
+    polygon_rings = []
+    for shape in shapes:
+        polygon_rings.append(1 + len(shape.interiors))
+        for ring in [shape.exterior] + list(shape.interiors):
+            rings.append(np.asarray(ring.coords, dtype=float)[:, :2])
+    return _pack(rings, polygon_rings, [alt_dict[shape.wkt] for shape in shapes])
+
+
+@trace.traced('transform')
+def from_vectors(vectors, do_transform=True, crs=None, proj=None):
+    """
+    Polygons of the GeoJSON-like vectors of geo.vectorize_raster, without
+    going through shapely. Coordinates are transformed as in
+    geo.shapelify_vector, all of them in one call.
+    """
+    import pyproj
+    from pathplan.geo import utm_proj, wgs84
+
+    rings = []
+    polygon_rings = []
+    alts = []
+    for vec in vectors:
+        coordinates = vec['geometry']['coordinates']
+        polygon_rings.append(len(coordinates))
+        rings.extend(np.asarray(ring, dtype=float)[:, :2] for ring in coordinates)
+        alts.append(vec['properties']['raster_val'])
+
+    polygons = _pack(rings, polygon_rings, alts)
+    if do_transform and len(polygons.coords):
+        lon, lat = polygons.coords[0]
+        proj = proj if proj is not None else utm_proj(lat, lon)
+        xs, ys = pyproj.transform(crs if crs is not None else wgs84, proj,
+                                  polygons.coords[:, 0], polygons.coords[:, 1])
+        coords = np.column_stack((xs, ys))
+        polygons = polygons._replace(coords=coords, bounds=_bounds(coords, polygons.ring_offsets,
+                                                                   polygons.polygon_offsets))
+    return polygons
+
+
+def save_polygons(filepath, polygons):
+    """
+    Writes polygons as a single float64 .npy file: a header of the array
+    sizes followed by each array, integer ones stored bit for bit
+    """
+    coords, ring_offsets, polygon_offsets, bounds, alts = polygons
+    header = np.zeros(_HEADER, dtype=np.int64)
+    header[:5] = [_MAGIC, _VERSION, len(coords), len(ring_offsets) - 1, len(polygon_offsets) - 1]
+    data = np.concatenate((header.view(np.float64),
+                           np.asarray(coords, dtype=np.float64).ravel(),
+                           np.asarray(ring_offsets, dtype=np.int64).view(np.float64),
+                           np.asarray(polygon_offsets, dtype=np.int64).view(np.float64),
+                           np.asarray(bounds, dtype=np.float64).ravel(),
+                           np.asarray(alts, dtype=np.float64)))
+
+    tmp = "{0}.{1}.tmp".format(filepath, os.getpid())
+    with open(tmp, 'wb') as polygons_file:
+        np.save(polygons_file, data)
+    os.replace(tmp, filepath)
+    return filepath
+
+
+@trace.traced('polygons_read')
+def load_polygons(filepath, mmap=True):
+    """
+    Reads polygons written by save_polygons, memory mapped unless mmap is
+    False
+    """
+    data = np.load(filepath, mmap_mode='r' if mmap else None)
+    magic, version, n_coords, n_rings, n_polygons = data[:_HEADER].view(np.int64)[:5].tolist()
+    if magic != _MAGIC or version != _VERSION:
+        raise ValueError("{0} is not a version {1} polygons file".format(filepath, _VERSION))
+
+    sizes = [2 * n_coords, n_rings + 1, n_polygons + 1, 4 * n_polygons, n_polygons]
+    ends = np.cumsum([_HEADER] + sizes).tolist()
+    coords, ring_offsets, polygon_offsets, bounds, alts = (data[start:end] for start, end in zip(ends[:-1], ends[1:]))
+    return Polygons(coords.reshape(-1, 2), ring_offsets.view(np.int64), polygon_offsets.view(np.int64),
+                    bounds.reshape(-1, 4), alts)
+
+
+def polygon_edges(polygons, poly):
+    """
+    Edges of the given polygons, all rings included.
+
+    Returns:
+        the index into poly each edge belongs to, and a (k, 4) array of the
+        edges' x0, y0, x1, y1
+    """
+    coords, ring_offsets, polygon_offsets = polygons.coords, polygons.ring_offsets, polygons.polygon_offsets
+    poly = np.asarray(poly, dtype=np.int64)
+    first_ring = polygon_offsets[poly]
+    ring_owner, local = ragged_range(polygon_offsets[poly + 1] - first_ring)
+    ring = first_ring[ring_owner] + local
+
+    first_coord = ring_offsets[ring]
+    edge_ring, local = ragged_range(ring_offsets[ring + 1] - first_coord - 1)
+    start = first_coord[edge_ring] + local
+    return ring_owner[edge_ring], np.hstack((coords[start], coords[start + 1]))
+
+
+def contains(polygons, points, poly):
+    """
+    Whether each point is inside the matching polygon, by the crossing
+    number test. Points on an edge shared by two polygons are inside exactly
+    one of them.
+    """
+    points = np.asarray(points, dtype=float)
+    owner, edge = polygon_edges(polygons, poly)
+    px, py = points[owner, 0], points[owner, 1]
+    spans = (edge[:, 1] > py) != (edge[:, 3] > py)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_at = edge[:, 0] + (py - edge[:, 1]) * (edge[:, 2] - edge[:, 0]) / (edge[:, 3] - edge[:, 1])
+    crossings = np.bincount(owner, weights=spans & (px < x_at), minlength=len(points))
+    return crossings % 2 == 1
+
+
+def clip_segments(polygons, starts, ends, seg, poly):
+    """
+    Stretches of segments over polygons, for (segment, polygon) pairs. Each
+    segment is cut wherever it crosses an edge of the polygon, and the
+    pieces whose midpoint is inside are kept, merging neighbouring ones.
+
+    Args:
+        starts, ends - (n, 2) arrays of the segments' end points
+        seg, poly - arrays of the segment and polygon of each pair
+
+    Returns:
+        arrays of segment id, polygon id and the t_start < t_end parameters
+        along the segment (0 at its start, 1 at its end) of every stretch,
+        sorted by pair then t_start
+    """
+    a, d = starts[seg], ends[seg] - starts[seg]
+
+    # Parameters along the segment of its crossings with every edge
+    pair, edge = polygon_edges(polygons, poly)
+    e = edge[:, 2:] - edge[:, :2]
+    w = edge[:, :2] - a[pair]
+    denom = d[pair, 0] * e[:, 1] - d[pair, 1] * e[:, 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (w[:, 0] * e[:, 1] - w[:, 1] * e[:, 0]) / denom
+        u = (w[:, 0] * d[pair, 1] - w[:, 1] * d[pair, 0]) / denom
+    hit = (denom != 0) & (t > 0) & (t < 1) & (u >= 0) & (u <= 1)
+
+    # Pieces between consecutive cuts, including both ends of the segment
+    cut_pair = np.concatenate((pair[hit], np.arange(len(seg)), np.arange(len(seg))))
+    cut_t = np.concatenate((t[hit], np.zeros(len(seg)), np.ones(len(seg))))
+    order = np.lexsort((cut_t, cut_pair))
+    cut_pair, cut_t = cut_pair[order], cut_t[order]
+    piece = np.flatnonzero((cut_pair[1:] == cut_pair[:-1]) & (cut_t[1:] > cut_t[:-1]))
+    piece_pair, t0, t1 = cut_pair[piece], cut_t[piece], cut_t[piece + 1]
+
+    mid = a[piece_pair] + d[piece_pair] * ((t0 + t1) / 2)[:, None]
+    inside = contains(polygons, mid, poly[piece_pair])
+
+    # Neighbouring pieces inside the same polygon make one stretch
+    piece_pair, t0, t1 = piece_pair[inside], t0[inside], t1[inside]
+    if len(piece_pair) == 0:
+        return seg[:0], poly[:0], t0, t1
+    first = np.concatenate(([True], (piece_pair[1:] != piece_pair[:-1]) | (t0[1:] != t1[:-1])))
+    heads = np.flatnonzero(first)
+    tails = np.concatenate((heads[1:], [len(first)])) - 1
+    return seg[piece_pair[heads]], poly[piece_pair[heads]], t0[heads], t1[tails]
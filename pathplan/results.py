@@ -0,0 +1,201 @@
+'''
+SQLite store for the paths, flights and metrics generated for test cases.
+
+Every generated path, flight and metric set is its own row, written in its
+own transaction, so concurrent writers (a process pool, the flight farm)
+never lose each other's results and a crash can't leave a half written file.
+'''
+
+import json
+import os
+import sqlite3
+import time
+
+RESULTS_DB = 'gen/results.sqlite'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS paths (
+    id INTEGER PRIMARY KEY,
+    case_file TEXT NOT NULL,
+    name TEXT NOT NULL,
+    gen_path TEXT NOT NULL,
+    params_file TEXT,
+    params TEXT,
+    info TEXT,
+    created REAL
+);
+CREATE INDEX IF NOT EXISTS paths_case ON paths (case_file, name);
+CREATE INDEX IF NOT EXISTS paths_params ON paths (case_file, params);
+
+CREATE TABLE IF NOT EXISTS flights (
+    id INTEGER PRIMARY KEY,
+    case_file TEXT NOT NULL,
+    name TEXT NOT NULL,
+    flight_path TEXT NOT NULL,
+    flight_logs TEXT,
+    created REAL
+);
+CREATE INDEX IF NOT EXISTS flights_case ON flights (case_file, name);
+
+CREATE TABLE IF NOT EXISTS metrics (
+    id INTEGER PRIMARY KEY,
+    case_file TEXT NOT NULL,
+    name TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    value REAL,
+    created REAL
+);
+CREATE INDEX IF NOT EXISTS metrics_case ON metrics (case_file, name, metric);
+'''
+
+
+def _case_key(case_file):
+    return os.path.normpath(case_file)
+
+
+def _params_key(params):
+    return json.dumps(params, sort_keys=True)
+
+
+class ResultsStore(object):
+    """
+    Results of every test case, stored in the SQLite database at db_path.
+
+    Connections are opened per call, so a store can be shared between
+    threads and handed to worker processes.
+    """
+
+    def __init__(self, db_path=RESULTS_DB, timeout=30.0):
+        self.db_path = db_path
+        self.timeout = timeout
+        self._initialized = False
+
+    def _connect(self):
+        if not self._initialized:
+            dirname = os.path.dirname(self.db_path)
+            if dirname and not os.path.exists(dirname):
+                os.makedirs(dirname)
+
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout)
+        conn.row_factory = sqlite3.Row
+
+        if not self._initialized:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+            self._initialized = True
+        return conn
+
+    def _insert(self, sql, args):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(sql, args)
+        finally:
+            conn.close()
+
+    def _query(self, sql, args):
+        conn = self._connect()
+        try:
+            return [dict(row) for row in conn.execute(sql, args)]
+        finally:
+            conn.close()
+
+    def add_path(self, case_file, name, gen_path, params_file=None, params=None, info=None):
+        """
+        Records a generated path. info holds any extra fields (e.g. its
+        minimum clearance) to report alongside it
+        """
+        self._insert('INSERT INTO paths (case_file, name, gen_path, params_file, params, info, created) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                     (_case_key(case_file), name, gen_path, params_file,
+                      _params_key(params) if params is not None else None, json.dumps(info or {}), time.time()))
+
+    def add_flight(self, case_file, name, flight_path, flight_logs=None):
+        self._insert('INSERT INTO flights (case_file, name, flight_path, flight_logs, created) VALUES (?, ?, ?, ?, ?)',
+                     (_case_key(case_file), name, flight_path, flight_logs, time.time()))
+
+    def add_metrics(self, case_file, name, metrics):
+        """
+        Records a dict of metric name to value for a path
+        """
+        now = time.time()
+        rows = [(_case_key(case_file), name, metric, value, now) for metric, value in metrics.items()]
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany('INSERT INTO metrics (case_file, name, metric, value, created) VALUES (?, ?, ?, ?, ?)', rows)
+        finally:
+            conn.close()
+
+    def paths(self, case_file, params=None, name=None):
+        """
+        All paths generated for a test case, oldest first, optionally only
+        those with exactly the given params dict or the given name
+        """
+        sql = 'SELECT * FROM paths WHERE case_file = ?'
+        args = [_case_key(case_file)]
+        if params is not None:
+            sql += ' AND params = ?'
+            args.append(_params_key(params))
+        if name is not None:
+            sql += ' AND name = ?'
+            args.append(name)
+        rows = self._query(sql + ' ORDER BY id', args)
+
+        for row in rows:
+            row['params'] = json.loads(row['params']) if row['params'] else None
+            row['info'] = json.loads(row['info']) if row['info'] else {}
+        return rows
+
+    def flights(self, case_file, name=None):
+        sql = 'SELECT * FROM flights WHERE case_file = ?'
+        args = [_case_key(case_file)]
+        if name is not None:
+            sql += ' AND name = ?'
+            args.append(name)
+        return self._query(sql + ' ORDER BY id', args)
+
+    def metrics(self, case_file, name):
+        """
+        The latest value of every metric recorded for a path
+        """
+        rows = self._query('SELECT metric, value FROM metrics WHERE case_file = ? AND name = ? ORDER BY id',
+                           (_case_key(case_file), name))
+        return {row['metric']: row['value'] for row in rows}
+
+    def results(self, case_file):
+        """
+        The latest path and flight of every result name of a test case, in
+        the same layout as the 'results' dict of a test case file
+        """
+        results = {}
+        for row in self.paths(case_file):
+            result = dict(row['info'])
+            result['gen-path'] = row['gen_path']
+            result['params'] = row['params_file']
+            results[row['name']] = result
+
+        for row in self.flights(case_file):
+            result = results.setdefault(row['name'], {})
+            result['flight_path'] = row['flight_path']
+            if row['flight_logs'] is not None:
+                result['flight_logs'] = row['flight_logs']
+
+        return results
+
+
+def atomic_json_dump(obj, filepath):
+    """
+    Writes obj as JSON to a temporary file and moves it over filepath, so a
+    crash mid write never leaves a truncated file behind
+    """
+    tmp = "{0}.{1}.tmp".format(filepath, os.getpid())
+    try:
+        with open(tmp, "w") as tmp_file:
+            json.dump(obj, tmp_file)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        os.replace(tmp, filepath)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
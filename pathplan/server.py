@@ -0,0 +1,347 @@
+'''
+Planning service that keeps datasets warm between requests.
+
+Planning from the command line or the GUI loads the shapes, altitude dict
+and rasters of a test case and builds its SurfaceIndex every time. The service
+keeps them resident instead: every worker process holds the surface indexes,
+clearance functions and projections it has used, keyed by test case and
+buffers, so only the first request for an area pays for loading it.
+
+Requests are served over HTTP on localhost:
+
+    POST /plan      {"case": CASE_FILE, "params": PARAMS_FILE or {...},
+                     "path": [waypoint dicts]}  (path defaults to the case's)
+    POST /evaluate  {"case": CASE_FILE, "paths": [A, B], "metrics": [...]}
+                    where A and B are result names or waypoint dict lists
+    GET  /stats     latency per endpoint
+
+Paths can also be posted and returned in the columnar path format (see
+pathplan.pathfile) with the content type PATH_CONTENT_TYPE, the case and
+params going in the query string. Every response reports its latency.
+
+    python -m pathplan.server --port 8765 --workers 4 --warm case.test:params.json
+'''
+
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from urllib.request import Request, urlopen
+
+import numpy as np
+
+from pathplan import trace
+from pathplan.pathfile import decode_path_columns, encode_path_columns
+
+log = logging.getLogger(__name__)
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+PATH_CONTENT_TYPE = 'application/x-pathplan-path'
+#Requests per endpoint the latency statistics are computed over
+LATENCY_WINDOW = 1000
+
+_worker = {}
+
+
+def _read_json(filepath):
+    with open(filepath) as json_file:
+        return json.load(json_file)
+
+
+def _init_worker(warm):
+    trace.configure_from_env()
+    _worker['surfaces'] = {}
+    for case_file, params_file in warm:
+        params = _params(params_file)
+        _surface(case_file, params['be_buffer'], params.get('obs_buffer', 0))
+
+
+def _params(params):
+    from pathplan.testcase import cached_load
+    if isinstance(params, str):
+        return cached_load(params, _read_json)
+    return params
+
+
+def _surface(case_file, be_buffer, obs_buffer):
+    """
+    SurfaceIndex and clearance function of a test case's required
+    altitude surface, and whether they were already loaded. Rebuilt when the
+    case's rasters change on disk
+    """
+    from pathplan.testcase import TestCase
+
+    case = TestCase.load(case_file)
+    rasters = [case['tif']] + ([case['canopy']] if 'canopy' in case else [])
+    key = (os.path.abspath(case_file), be_buffer, obs_buffer, tuple(os.path.getmtime(tif) for tif in rasters))
+
+    if key in _worker['surfaces']:
+        return _worker['surfaces'][key], True
+
+    with trace.span('index_build'):
+        index = case.required_index(be_buffer, obs_buffer)
+    clearance = case.required_clearance(be_buffer, obs_buffer)
+
+    _worker['surfaces'][key] = (index, clearance)
+    log.info("loaded %s with buffers %s, %s", case_file, be_buffer, obs_buffer)
+    return _worker['surfaces'][key], False
+
+
+def _waypoint_dicts(lat, lon, alt):
+    return [{'latitude': la, 'longitude': lo, 'altitude': al}
+            for la, lo, al in zip(np.asarray(lat).tolist(), np.asarray(lon).tolist(), np.asarray(alt).tolist())]
+
+
+def _columns(waypoints):
+    """
+    Latitude, longitude and altitude arrays of a list of waypoint dicts
+    """
+    return (np.array([wp['latitude'] for wp in waypoints], dtype=float),
+            np.array([wp['longitude'] for wp in waypoints], dtype=float),
+            np.array([wp.get('altitude', 0) for wp in waypoints], dtype=float))
+
+
+def plan_request(request):
+    """
+    Plans a path over a test case in a worker process.
+
+    Args:
+        request - dict with the 'case' file, the 'params' (a dict or params
+                  file) and optionally the 'path' to plan over as latitude,
+                  longitude and altitude columns
+
+    Returns:
+        dict with the planned 'path' columns, 'min_clearance', 'violations'
+        and the 'timing' of the request
+    """
+    from pathplan.path_planner import plan_checked_path
+    from pathplan.testcase import TestCase
+    from pathplan.utils import project_columns, unproject_path
+
+    start = time.time()
+    case = TestCase.load(request['case'])
+    params = _params(request['params'])
+    be_buffer, obs_buffer = params['be_buffer'], params.get('obs_buffer', 0)
+    (index, clearance), warm = _surface(request['case'], be_buffer, obs_buffer)
+
+    if request.get('path') is not None:
+        path, _ = project_columns(*request['path'], proj=case.proj)
+    else:
+        path = case.path
+    load_time = time.time() - start
+
+    with trace.span('plan', case=request['case']):
+        gen_path, _, report = plan_checked_path(path, index, clearance, params)
+
+    return {'path': unproject_path(gen_path, case.proj),
+            'min_clearance': report.min_clearance,
+            'violations': report.violations,
+            'timing': {'warm': warm, 'load': load_time, 'plan': time.time() - start - load_time}}
+
+
+def evaluate_request(request):
+    """
+    Compares two paths of a test case in a worker process.
+
+    Args:
+        request - dict with the 'case' file, two 'paths', each a result name
+                  of the case or latitude, longitude and altitude columns,
+                  and optionally the names of the 'metrics' to compute
+                  (defaults to every one of evaluation.COMPARISON_METRICS)
+
+    Returns:
+        dict mapping 'metrics' to their values, and the 'timing'
+    """
+    from pathplan.evaluation import COMPARISON_METRICS, comparison_metric
+    from pathplan.testcase import TestCase
+    from pathplan.utils import project_columns
+
+    start = time.time()
+    case = TestCase.load(request['case'])
+    paths = [case.result_path(path) if isinstance(path, str) else project_columns(*path, proj=case.proj)[0]
+             for path in request['paths']]
+    if len(paths) != 2:
+        raise ValueError("expected 2 paths, got {0}".format(len(paths)))
+    load_time = time.time() - start
+
+    names = request.get('metrics') or [name for name, _ in COMPARISON_METRICS]
+    metrics = {name: float(comparison_metric(name, paths[0], paths[1])) for name in names}
+
+    return {'metrics': metrics, 'timing': {'load': load_time, 'evaluate': time.time() - start - load_time}}
+
+
+class LatencyStats(object):
+    """
+    Latency of the last LATENCY_WINDOW requests to every endpoint
+    """
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self._latencies = defaultdict(lambda: deque(maxlen=window))
+        self._counts = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, seconds):
+        with self._lock:
+            self._latencies[endpoint].append(seconds)
+            self._counts[endpoint] += 1
+
+    def summary(self):
+        """
+        dict mapping endpoint to its request count and mean, median, 95th
+        percentile and maximum latency in milliseconds
+        """
+        with self._lock:
+            latencies = {endpoint: np.array(window) * 1000 for endpoint, window in self._latencies.items()}
+            counts = dict(self._counts)
+
+        return {endpoint: {'count': counts[endpoint],
+                           'mean_ms': float(ms.mean()),
+                           'p50_ms': float(np.percentile(ms, 50)),
+                           'p95_ms': float(np.percentile(ms, 95)),
+                           'max_ms': float(ms.max())}
+                for endpoint, ms in latencies.items()}
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    endpoints = {'/plan': plan_request, '/evaluate': evaluate_request}
+
+    def do_GET(self):
+        if urlparse(self.path).path == '/stats':
+            self._send_json(200, self.server.latency.summary())
+        else:
+            self._send_json(404, {'error': "unknown endpoint {0}".format(self.path)})
+
+    def do_POST(self):
+        start = time.time()
+        url = urlparse(self.path)
+        handler = self.endpoints.get(url.path)
+        if handler is None:
+            self._send_json(404, {'error': "unknown endpoint {0}".format(url.path)})
+            return
+
+        try:
+            request = self._read_request(url)
+        except (ValueError, KeyError) as error:
+            self._send_json(400, {'error': "bad request: {0}".format(error)})
+            return
+
+        try:
+            with trace.span('request', endpoint=url.path):
+                result = self.server.pool.apply(handler, (request,))
+        except (ValueError, KeyError) as error:
+            self._send_json(400, {'error': repr(error)})
+            return
+        except Exception as error:
+            log.exception("%s failed", url.path)
+            self._send_json(500, {'error': repr(error)})
+            return
+
+        latency = time.time() - start
+        self.server.latency.record(url.path, latency)
+        result['timing']['latency'] = latency
+        log.info("%s took %.1f ms %s", url.path, latency * 1000, result['timing'])
+
+        if 'path' not in result:
+            self._send_json(200, result)
+        elif PATH_CONTENT_TYPE in self.headers.get('Accept', ''):
+            lat, lon, alt = result.pop('path')
+            self._send(200, PATH_CONTENT_TYPE, encode_path_columns(lat, lon, alt, provenance=result))
+        else:
+            result['path'] = _waypoint_dicts(*result['path'])
+            self._send_json(200, result)
+
+    def _read_request(self, url):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        if self.headers.get('Content-Type', '').startswith(PATH_CONTENT_TYPE):
+            request = {key: values[0] for key, values in parse_qs(url.query).items()}
+            _, lat, lon, alt = decode_path_columns(body)
+            request['path'] = (lat, lon, alt)
+            return request
+
+        request = json.loads(body.decode('utf-8'))
+        if isinstance(request.get('path'), list):
+            request['path'] = _columns(request['path'])
+        if 'paths' in request:
+            request['paths'] = [path if isinstance(path, str) else _columns(path) for path in request['paths']]
+        return request
+
+    def _send_json(self, status, body):
+        self._send(status, 'application/json', json.dumps(body).encode('utf-8'))
+
+    def _send(self, status, content_type, data):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        log.debug(format, *args)
+
+
+class PlanningServer(ThreadingHTTPServer):
+    """
+    HTTP server handing requests to a pool of worker processes that keep
+    their datasets loaded.
+
+    Args:
+        address - (host, port) to listen on
+        workers - number of worker processes, defaults to the cpu count
+        warm - (case file, params file) pairs every worker loads up front
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address=(DEFAULT_HOST, DEFAULT_PORT), workers=None, warm=()):
+        self.pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(list(warm),))
+        self.latency = LatencyStats()
+        super(PlanningServer, self).__init__(address, _Handler)
+
+    def server_close(self):
+        super(PlanningServer, self).server_close()
+        self.pool.terminate()
+        self.pool.join()
+
+
+def post(endpoint, body, url="http://{0}:{1}".format(DEFAULT_HOST, DEFAULT_PORT)):
+    """
+    Sends a JSON request to a running server and returns the decoded reply
+    """
+    request = Request(url + endpoint, json.dumps(body).encode('utf-8'), {'Content-Type': 'application/json'})
+    with urlopen(request) as reply:
+        return json.loads(reply.read().decode('utf-8'))
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(description="Serve path planning requests with the datasets kept loaded")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, defaults to the cpu count")
+    parser.add_argument("--warm", action='append', default=[], metavar="CASE:PARAMS",
+                        help="test case and params file to load before serving, may be repeated")
+    args = parser.parse_args()
+
+    trace.configure_from_env()
+    if not logging.getLogger('pathplan').level:
+        logging.basicConfig(format="%(asctime)s %(name)s %(levelname)s %(message)s")
+        logging.getLogger('pathplan').setLevel(logging.INFO)
+
+    warm = [tuple(spec.rsplit(':', 1)) for spec in args.warm]
+    server = PlanningServer((args.host, args.port), args.workers, warm)
+    log.info("serving on %s:%d", args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -1,7 +1,9 @@
 from dronekit import connect, VehicleMode, LocationGlobalRelative, LocationGlobal, Command, mavutil
 
 import sys
+import hashlib
 import json
+import logging
 import time
 import math
 import os
@@ -10,12 +12,22 @@ import shutil as sh
 try:
     from pymavlink.mavextra import *
 except:
-    print("WARNING: Numpy missing, mathematical notation will not be supported..")
+    logging.getLogger(__name__).warning("Numpy missing, mathematical notation will not be supported..")
 
 import inspect
 
 from pymavlink import mavutil
 
+import rasterio
+import pyproj
+
+from pathplan.geo import wgs84
+from pathplan.pathfile import read_waypoint_dicts, iter_waypoint_dicts, read_path_columns
+from pathplan.mission import MissionUploader, MissionMonitor
+from pathplan import trace
+
+log = logging.getLogger(__name__)
+
 # Input should be a .BIN file in the qgroundcontrol format
 # Outputs an array of dictionaries each containing the packet data
 def parse_dataflash_log(filename, planner=False, notimestamps=False,
@@ -51,15 +63,41 @@ def parse_dataflash_log(filename, planner=False, notimestamps=False,
 
 def load_path_from_bin(filename):
     parsed_log = parse_dataflash_log(filename)
-    gps_points = [{'latitude':x['Lat'],'longitude':x['Lng'], 'altitude':x['Alt']}  for x in parsed_log if x['mavpackettype'] == 'GPS']
+    gps_points = [{'latitude':x['Lat'],'longitude':x['Lng'], 'altitude':x['Alt'], 'timestamp':x['timestamp']}  for x in parsed_log if x['mavpackettype'] == 'GPS']
     return gps_points
 
 import glob
-def parse_bins(logs):
+import itertools
+def bin_files(logs):
     def key_fun(filename):
         return int(os.path.splitext(os.path.basename(filename))[0])
 
-    files = list(sorted(glob.glob(logs+"/*.BIN"), key=key_fun))
+    return list(sorted(glob.glob(logs+"/*.BIN"), key=key_fun))
+
+GPS_CHUNK = 4096
+
+# Yields the GPS points of every log in the directory as (lat, lon, alt, timestamp)
+# arrays of at most chunk_size rows, without holding the whole flight in memory
+def iter_gps_chunks(logs, chunk_size=GPS_CHUNK):
+    import numpy as np
+
+    chunk = []
+    for binfile in bin_files(logs):
+        mlog = mavutil.mavlink_connection(binfile)
+        while True:
+            m = mlog.recv_match(type='GPS')
+            if not m:
+                break
+            chunk.append((m.Lat, m.Lng, m.Alt, m._timestamp))
+            if len(chunk) == chunk_size:
+                yield np.array(chunk)
+                chunk = []
+
+    if chunk:
+        yield np.array(chunk)
+
+def parse_bins(logs):
+    files = bin_files(logs)
     
     path = []
     for binfile in files:
@@ -68,34 +106,33 @@ def parse_bins(logs):
 
     return path
 
-def get_command_list(mission, tif):
+def iter_command_list(mission, tif):
+    """
+    Generates the mission commands one at a time, so long missions don't
+    have to be held in memory while they are uploaded
+    """
+    mission = iter(mission)
+    first = next(mission)
 
-    home_pos_alt = mission[0]
     raster = rasterio.open(tif)
 
     raster_proj = pyproj.Proj(raster.crs, preserve_units=True)
 
-    lat = mission[0]['latitude']
-    lon = mission[0]['longitude']
-
-    proj = utm_proj(32.989613, -117.128693)
-    lon,lat = pyproj.transform(wgs84, raster_proj, lon, lat)
+    lat = first['latitude']
+    lon = first['longitude']
 
-    print(lon,lat)
-    row, col = raster.index(lon, lat)
+    x, y = pyproj.transform(wgs84, raster_proj, lon, lat)
 
-    print(row, col)
+    row, col = raster.index(x, y)
+    log.debug("home at %s, %s (row %s, col %s)", x, y, row, col)
 
     data = raster.read()[0,:,:]
     home_pos_alt = data[row][col] * .3048
 
     nav_type = mavutil.mavlink.MAV_CMD_NAV_WAYPOINT
-    cmd = Command(0, 0, 0, mavutil.mavlink.MAV_FRAME_GLOBAL_RELATIVE_ALT, nav_type, 0, 0, 0, 0, 0, 0, lat, lon, 20)
+    yield Command(0, 0, 0, mavutil.mavlink.MAV_FRAME_GLOBAL_RELATIVE_ALT, nav_type, 0, 0, 0, 0, 0, 0, lat, lon, 20)
 
-    cmds = [cmd]
-
-    
-    for cmd in mission:
+    for cmd in itertools.chain([first], mission):
         lat = cmd['latitude']
         lon = cmd['longitude']
         #lat,lon,alt = cmd
@@ -109,68 +146,97 @@ def get_command_list(mission, tif):
 
         nav_type = mavutil.mavlink.MAV_CMD_NAV_WAYPOINT
     
-        cmd = Command(0, 0, 0, mavutil.mavlink.MAV_FRAME_GLOBAL_RELATIVE_ALT, nav_type, 0, 0, 0, 0, 0, 0, lat, lon, home_pos_alt + 20)
-        cmds.append(cmd)
+        yield Command(0, 0, 0, mavutil.mavlink.MAV_FRAME_GLOBAL_RELATIVE_ALT, nav_type, 0, 0, 0, 0, 0, 0, lat, lon, home_pos_alt + 20)
 
-    return cmds
+def get_command_list(mission, tif):
+    return list(iter_command_list(mission, tif))
+
+def count_waypoints(missionfile):
+    header, _, _, _ = read_path_columns(missionfile)
+    return header['count']
+
+#Identifies the mission built from missionfile over tif, so an interrupted
+#upload is only resumed for the same mission
+def mission_hash(missionfile, tif):
+    digest = hashlib.sha1()
+    with open(missionfile, 'rb') as mission:
+        for block in iter(lambda: mission.read(1 << 20), b''):
+            digest.update(block)
+    stat = os.stat(tif)
+    digest.update("{0}:{1}:{2}".format(os.path.abspath(tif), stat.st_mtime, stat.st_size).encode())
+    return digest.hexdigest()
+
+#workdir is the directory the SITL was started in, where it writes its logs,
+#eeprom.bin and terrain data
+def fly(port, missionfile, logdir, tif, workdir=None):
+    if workdir == None:
+        workdir = os.getcwd()
 
-def fly(port, missionfile, logdir):
     time.sleep(10)
     
     
-    print("Connecting on port {0}".format(port))
     connection_string = "tcp:127.0.0.1:{0}".format(port)
-    print(connection_string)
-    
-    print("connecting")
+    log.info("connecting to %s", connection_string)
     vehicle = connect(connection_string, wait_ready=True)
-    print("finished connecting")
+    log.debug("finished connecting")
     
     vehicle.parameters['ARMING_CHECK'] = 0
     
+    total = count_waypoints(missionfile) + 1
+
+    def upload_progress(acked, total):
+        log.debug("Uploaded %d/%d mission items", acked, total)
+
+    uploader = MissionUploader(vehicle, iter_command_list(iter_waypoint_dicts(missionfile), tif), total,
+                               state_file=missionfile + ".upload", on_progress=upload_progress,
+                               mission_id=mission_hash(missionfile, tif))
+    with trace.span('upload', mission=missionfile):
+        uploaded = uploader.upload()
+    if not uploaded:
+        vehicle.close()
+        raise RuntimeError("Could not upload mission {0}".format(missionfile))
+
+    # Pull the mission back down so vehicle.commands matches what was uploaded
     cmds = vehicle.commands
-    
-    cmds.clear()
-    
-    mission = json.load(open(missionfile))
-    
-    
-    cmds.upload()
+    cmds.download()
+    cmds.wait_ready()
+
+    first = next(iter_waypoint_dicts(missionfile))
     
     def arm_and_takeoff(aTargetAltitude):
         """
         Arms vehicle and fly to aTargetAltitude.
         """
     
-        print("Basic pre-arm checks")
+        log.info("Basic pre-arm checks")
         # Don't let the user try to arm until autopilot is ready
         while not vehicle.is_armable:
-            print(" Waiting for vehicle to initialise...")
+            log.debug("Waiting for vehicle to initialise...")
             time.sleep(1)
     
     
-        print("Arming motors")
+        log.info("Arming motors")
         # Copter should arm in GUIDED mode
         vehicle.mode = VehicleMode("GUIDED")
         vehicle.armed = True
     
         while not vehicle.armed:      
-            print(" Waiting for arming...")
+            log.debug("Waiting for arming...")
             time.sleep(1)
     
-        print("Taking off!")
+        log.info("Taking off!")
         vehicle.simple_takeoff(aTargetAltitude) # Take off to target altitude
     
         # Wait until the vehicle reaches a safe height before processing the goto (otherwise the command 
         #  after Vehicle.simple_takeoff will execute immediately).
         while True:
-            print(" Altitude: ", vehicle.location.global_relative_frame.alt)
+            log.debug("Altitude: %s", vehicle.location.global_relative_frame.alt)
             if vehicle.location.global_relative_frame.alt>=aTargetAltitude*0.95: #Trigger just below target alt.
-                print("Reached target altitude")
+                log.info("Reached target altitude")
                 break
             time.sleep(1)
     
-    target_alt = mission[0]['altitude']
+    target_alt = first['altitude']
     arm_and_takeoff(target_alt)
     
     #vehicle.commands.next=0
@@ -231,16 +297,21 @@ def fly(port, missionfile, logdir):
         distancetopoint = get_distance_metres(vehicle.location.global_frame, targetWaypointLocation)
         return distancetopoint
     
-    while True:
-        nextwaypoint=vehicle.commands.next
-        print('Distance to waypoint (%s): %s' % (nextwaypoint, distance_to_current_waypoint()))
-        if nextwaypoint == len(mission)-1: 
-            print("Exit 'standard' mission when start heading to final waypoint ({0})".format(len(mission)))
-            break
+    def waypoint_changed(nextwaypoint):
+        log.debug('Distance to waypoint (%s): %s', nextwaypoint, distance_to_current_waypoint())
+
+    with trace.span('flight', mission=missionfile):
+        with MissionMonitor(vehicle, total - 1, on_waypoint=waypoint_changed) as monitor:
+            monitor.wait()
+    log.info("Exit 'standard' mission when start heading to final waypoint (%d)", total - 1)
+
+    vehicle.close()
 
-    sh.move("{0}/{1}".format(os.getcwd(), "logs"), logdir)
-    os.remove("eeprom.bin")
-    sh.rmtree("terrain")
+    if os.path.exists(logdir):
+        sh.rmtree(logdir)
+    sh.move(os.path.join(workdir, "logs"), logdir)
+    os.remove(os.path.join(workdir, "eeprom.bin"))
+    sh.rmtree(os.path.join(workdir, "terrain"), ignore_errors=True)
     
     return logdir
 
@@ -258,16 +329,13 @@ def save_mission(aFileName, cmds):
 import sys
 from os.path import splitext, basename
 if __name__ == '__main__':
-    import rasterio
-    import pyproj
-    from geo import wgs84, utm_proj
     if len(sys.argv) != 3:
         print("need a tiffile and a path file")
         sys.exit()
 
     tiffile = sys.argv[1]
     missionfile = sys.argv[2]
-    mission = json.load(open(missionfile))
+    mission = read_waypoint_dicts(missionfile)
 
     filename = "{0}.txt".format(basename(splitext(missionfile)[0]))
 
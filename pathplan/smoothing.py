@@ -1,54 +1,154 @@
-from scipy.interpolate import splrep, splev
-from pathplan.viz import build_distance_lists
-from scipy.optimize import minimize_scalar 
-from scipy.signal import argrelextrema
+'''
+Altitude profile simplification from the upper envelope of the clearance.
+
+Along the horizontal route the clearance (required altitude) is a profile of
+altitude against distance. The upper concave hull of that profile is the
+chain of straight climbs and descents with the fewest breakpoints that never
+dips below it, and is found in linear time with the monotone chain algorithm
+since the samples are already sorted by distance. Altitude changes closer
+together than min_length are then merged, raising the chain where needed so
+it stays above the clearance.
+'''
+
+import heapq
 
 import numpy as np
 
+from pathplan import trace
+from pathplan.clearance import sample_path
+
+
+def upper_hull(xs, ys):
+    """
+    Indices of the upper concave hull of points sorted by strictly
+    increasing x
+    """
+    xs, ys = np.asarray(xs, dtype=float).tolist(), np.asarray(ys, dtype=float).tolist()
+    hull = []
+    for i in range(len(xs)):
+        # Drop the last hull point while it is on or below the line from the
+        # one before it to the new point
+        while len(hull) >= 2:
+            o, a = hull[-2], hull[-1]
+            if (xs[a] - xs[o]) * (ys[i] - ys[o]) - (ys[a] - ys[o]) * (xs[i] - xs[o]) >= 0:
+                hull.pop()
+            else:
+                break
+        hull.append(i)
+    return np.array(hull, dtype=int)
+
+
+def enforce_min_length(xs, zs, min_length):
+    """
+    Merges the segments of a chain shorter than min_length, shortest first.
+    A merge drops one end of the segment, whichever needs the least lift,
+    and raises its neighbours until the chord between them clears it, so
+    the chain only ever moves up. The first and last points are never
+    dropped.
+
+    Returns:
+        xs, zs arrays of the remaining points
+    """
+    xs = np.asarray(xs, dtype=float).tolist()
+    zs = np.asarray(zs, dtype=float).tolist()
+    n = len(xs)
+    if n < 3 or not min_length:
+        return np.array(xs), np.array(zs)
+
+    prev = list(range(-1, n - 1))
+    nxt = list(range(1, n + 1))
+    nxt[-1] = -1
+    alive = [True] * n
+
+    def lift(v):
+        l, r = prev[v], nxt[v]
+        chord = zs[l] + (zs[r] - zs[l]) * (xs[v] - xs[l]) / (xs[r] - xs[l])
+        return max(zs[v] - chord, 0.0)
+
+    heap = [(xs[i + 1] - xs[i], i, i + 1) for i in range(n - 1) if xs[i + 1] - xs[i] < min_length]
+    heapq.heapify(heap)
+    while heap:
+        _, a, b = heapq.heappop(heap)
+        if not (alive[a] and alive[b] and nxt[a] == b):
+            continue
+
+        interior = [v for v in (a, b) if prev[v] != -1 and nxt[v] != -1]
+        if not interior:
+            continue
+        v = min(interior, key=lift)
+        up = lift(v)
+        l, r = prev[v], nxt[v]
+        zs[l] += up
+        zs[r] += up
+
+        alive[v] = False
+        nxt[l], prev[r] = r, l
+        if xs[r] - xs[l] < min_length:
+            heapq.heappush(heap, (xs[r] - xs[l], l, r))
+
+    keep = [i for i in range(n) if alive[i]]
+    return np.array(xs)[keep], np.array(zs)[keep]
+
 
+def route_corners(route):
+    """
+    Indices of the points of a horizontal route where it turns, along with
+    its ends. Repeated points are skipped.
+    """
+    points = np.asarray(route, dtype=float)[:, :2]
+    distinct = np.concatenate(([True], np.any(np.diff(points, axis=0) != 0, axis=1)))
+    idx = np.flatnonzero(distinct)
+    if len(idx) < 3:
+        return idx
 
-def concavity_smooth(path):
-    xs, ys = build_distance_lists(path)
+    steps = np.diff(points[idx], axis=0)
+    cross = steps[:-1, 0] * steps[1:, 1] - steps[:-1, 1] * steps[1:, 0]
+    dot = np.sum(steps[:-1] * steps[1:], axis=1)
+    norms = np.hypot(steps[:-1, 0], steps[:-1, 1]) * np.hypot(steps[1:, 0], steps[1:, 1])
+    turns = (np.abs(cross) > 1e-9 * norms) | (dot < 0)
 
-    spline = splrep(xs, ys)
+    return np.concatenate(([idx[0]], idx[1:-1][turns], [idx[-1]]))
 
-    dists = np.linspace(xs[0], xs[-1])
 
-    deriv = splev(spline, dists, der=1)
-    second_deriv = splev(spline, dists, der=2)
+@trace.traced('concavity_smooth')
+def concavity_smooth(path, clearance, min_length=0.0, spacing=1.0):
+    """
+    The path over the same route with the fewest altitude breakpoints that
+    never dips below the clearance, see upper_hull and enforce_min_length.
 
-    minima = list(sorted([dists[i] for x,i in enumerate(deriv) if x == 0]))
-    inflect = list(sorted([dists[i] for x,i in enumerate(second_deriv) if x == 0 and x not in minima]))
-    
-    inflect_idx = 0
-    minima_idx = 0
-  
-    points = []
-    while inflect_idx < len(inflect) and minima_idx < len(minima):
-        if minima[minima_idx] < inflect[inflect_idx]:
-            pass
-        else:
-            pass
-    
-    dx = (path[0][0] - path[-1][0])
-    dy = (path[0][1] - path[-1][1])
+    Args:
+        path - list of (x, y[, z]) waypoints, only the route is used
+        clearance - function mapping arrays of xs, ys to the minimum safe
+                    altitude, see raster_clearance
+        min_length - shortest horizontal distance between altitude changes
+        spacing - horizontal distance between clearance samples
 
-    norm = (dx**2 + dy**2)**.5
+    Returns:
+        list of (x, y, z) waypoints: the turns of the route and the
+        altitude breakpoints
+    """
+    if len(path) < 2:
+        return [tuple(point) for point in path]
 
-    unit_dx = dx / norm
-    unit_dy = dy / norm
+    corners = np.asarray(path, dtype=float)[route_corners(path), :2]
+    if len(corners) < 2:
+        x, y = corners[0]
+        return [(x, y, float(np.max(clearance(np.array([x]), np.array([y])))))]
+    route = np.column_stack((corners, np.zeros(len(corners))))
 
-    new_points = []
-    for point in points:
-        x = start[0] + unit_dx * point[0]
-        y = start[1] + unit_dx * point[0]
-        z = point[1]
-        new_points.append(x,y,z)
-         
-    return new_points
+    dist, xs, ys, _ = sample_path(route, spacing)
+    floor = clearance(xs, ys)
 
-        
+    # Segments share their end samples, keep the highest clearance of each
+    # distance so the hull sees strictly increasing x
+    starts = np.flatnonzero(np.concatenate(([True], np.diff(dist) > 0)))
+    dist, floor = dist[starts], np.maximum.reduceat(floor, starts)
 
-    
+    hull = upper_hull(dist, floor)
+    hull_x, hull_z = enforce_min_length(dist[hull], floor[hull], min_length)
 
-    
+    along = np.concatenate(([0], np.cumsum(np.hypot(*np.diff(corners, axis=0).T))))
+    breaks = np.union1d(hull_x, along)
+    breaks = breaks[np.concatenate(([True], np.diff(breaks) > 1e-9 * max(along[-1], 1)))]
+    zs = np.interp(breaks, hull_x, hull_z)
+    return list(zip(np.interp(breaks, along, corners[:, 0]), np.interp(breaks, along, corners[:, 1]), zs))
@@ -0,0 +1,219 @@
+'''
+Parameter sweeps over the shapely path planner.
+
+The required altitude surface is built once per (be_buffer, obs_buffer) pair
+swept, and each worker process builds the SurfaceIndex of a surface the first
+time it needs it, then
+plans and evaluates every configuration it is handed. The results are
+written as a columnar table with one row per configuration.
+'''
+
+import csv
+import itertools
+import json
+import logging
+import multiprocessing
+import random
+import time
+
+import numpy as np
+
+SWEEP_PARAMS = ['be_buffer', 'obs_buffer', 'min_length', 'climb_rate', 'descent_rate', 'max_speed']
+METRICS = ['total_distance', 'waypoints', 'violation_length', 'min_clearance', 'area_vs_base', 'plan_time']
+
+log = logging.getLogger(__name__)
+
+_worker = {}
+
+
+def grid_configs(base_params, grid):
+    """
+    Every combination of the values in grid.
+
+    Args:
+        base_params - dict of parameters that are not swept
+        grid - dict mapping parameter name to a list of values
+    """
+    names = [name for name in SWEEP_PARAMS if name in grid]
+    for values in itertools.product(*[grid[name] for name in names]):
+        params = dict(base_params)
+        params.update(zip(names, values))
+        yield params
+
+
+def random_configs(base_params, ranges, count, seed=None):
+    """
+    `count` configurations drawn uniformly from ranges.
+
+    Args:
+        base_params - dict of parameters that are not swept
+        ranges - dict mapping parameter name to a (low, high) tuple
+        count - number of configurations to draw
+        seed - seed for the random generator
+    """
+    rand = random.Random(seed)
+    names = [name for name in SWEEP_PARAMS if name in ranges]
+    for _ in range(count):
+        params = dict(base_params)
+        for name in names:
+            low, high = ranges[name]
+            params[name] = rand.uniform(low, high)
+        yield params
+
+
+def _init_worker(init_path, surfaces, tif_file, canopy_file, base_path):
+    from pathplan.utils import read_init_path
+    from pathplan import trace
+
+    trace.configure_from_env()
+
+    path, proj = read_init_path(init_path)
+
+    _worker['path'] = path
+    _worker['proj'] = proj
+    _worker['surfaces'] = surfaces
+    _worker['indexes'] = {}
+    _worker['samplers'] = {}
+    _worker['base'] = read_init_path(base_path, proj)[0] if base_path else path
+    _worker['tif_file'] = tif_file
+    _worker['canopy_file'] = canopy_file
+
+
+def _surface_key(canopy_file, be_buffer, obs_buffer):
+    """
+    The (canopy_offset, lateral_buffer) the required altitude surface of a
+    pair of buffers is built with, see pathplan.dilate. Over bare earth alone
+    be_buffer does not change the surface
+    """
+    return (obs_buffer - be_buffer if canopy_file is not None else 0, obs_buffer)
+
+
+def _surface(key):
+    """
+    SurfaceIndex of the required altitude surface for a _surface_key,
+    loaded the first time a worker plans with it
+    """
+    from pathplan.intersect import SurfaceIndex
+    from pathplan import trace
+
+    if key not in _worker['indexes']:
+        with trace.span('index_build'):
+            index = SurfaceIndex.load(_worker['surfaces'][key])
+        _worker['indexes'][key] = index
+    return _worker['indexes'][key]
+
+
+def _clearance(buffers):
+    """
+    Clearance function for a (be_buffer, obs_buffer) pair. The windowed
+    sampler of the surface (see dilate.required_altitude_clearance) is built
+    the first time a worker needs its _surface_key and shared by every
+    be_buffer over it
+    """
+    from pathplan.dilate import required_altitude_clearance
+
+    be_buffer, obs_buffer = buffers
+    key = _surface_key(_worker['canopy_file'], be_buffer, obs_buffer)
+    if key not in _worker['samplers']:
+        _worker['samplers'][key] = required_altitude_clearance(_worker['tif_file'], _worker['canopy_file'], *key,
+                                                               proj=_worker['proj'])
+    sampler = _worker['samplers'][key]
+
+    def clearance(xs, ys):
+        return sampler(xs, ys) + be_buffer
+
+    return clearance
+
+
+def _run_config(indexed):
+    from pathplan.path_planner import plan_checked_path
+    from pathplan.evaluation import total_dist, area_between_curves
+
+    idx, params = indexed
+    start = time.time()
+    buffers = (params['be_buffer'], params.get('obs_buffer', 0))
+    clearance = _clearance(buffers)
+    index = _surface(_surface_key(_worker['canopy_file'], *buffers))
+    path, _, report = plan_checked_path(_worker['path'], index, clearance, params)
+    plan_time = time.time() - start
+
+    row = {'id': idx}
+    row.update({name: params.get(name, float('nan')) for name in SWEEP_PARAMS})
+
+    if len(path) < 2:
+        row.update({'total_distance': 0, 'waypoints': len(path), 'violation_length': 0,
+                    'min_clearance': float('nan'), 'area_vs_base': float('nan'), 'plan_time': plan_time})
+        return row
+
+    row['total_distance'] = total_dist(np.array(path))
+    row['waypoints'] = len(path)
+    row['violation_length'] = sum(hi - lo for lo, hi in report.violations)
+    row['min_clearance'] = report.min_clearance
+    row['area_vs_base'] = area_between_curves(_worker['base'], path)
+    row['plan_time'] = plan_time
+    return row
+
+
+def write_results_table(filepath, rows):
+    """
+    Writes the sweep results column by column, as a .csv file or, for any
+    other extension, a .npz file holding one array per column
+    """
+    columns = ['id'] + SWEEP_PARAMS + METRICS
+    rows = sorted(rows, key=lambda row: row['id'])
+
+    if filepath.endswith('.csv'):
+        with open(filepath, 'w') as table:
+            writer = csv.DictWriter(table, fieldnames=columns)
+            writer.writeheader()
+            for row in rows:
+                writer.writerow({name: row[name] for name in columns})
+        return
+
+    with open(filepath, 'wb') as table:
+        np.savez(table, **{name: np.array([row[name] for row in rows], dtype=float) for name in columns})
+
+
+def run_sweep(configs, init_path, tif_file, out_file, base_path=None, processes=None, do_transform=True, canopy_file=None):
+    """
+    Plans and evaluates every configuration across a process pool.
+
+    Args:
+        configs - iterable of parameter dicts, see grid_configs/random_configs
+        init_path - the initial path to plan over
+        tif_file - the test case raster the surfaces are built from
+        out_file - where to write the results table
+        base_path - path to compare the area against, defaults to init_path
+        processes - number of worker processes, defaults to the cpu count
+        do_transform - whether the surfaces are vectorized with a
+                       transform, see geo.shapelify_vector
+        canopy_file - canopy raster on the same grid as tif_file, if any
+
+    Returns:
+        list of result rows
+    """
+    from pathplan.dilate import required_altitude_polygons
+
+    # Build and vectorize each distinct surface once up front rather than in
+    # every worker. be_buffer is added at query time, so configs differing
+    # only in it share a surface
+    configs = list(configs)
+    surfaces = {}
+    for params in configs:
+        key = _surface_key(canopy_file, params['be_buffer'], params.get('obs_buffer', 0))
+        if key not in surfaces:
+            surfaces[key] = required_altitude_polygons(tif_file, canopy_file, *key, do_transform=do_transform)
+
+    pool = multiprocessing.Pool(processes, initializer=_init_worker,
+                                initargs=(init_path, surfaces, tif_file, canopy_file, base_path))
+    rows = []
+    try:
+        for row in pool.imap_unordered(_run_config, enumerate(configs)):
+            log.info("config %d: %s", row['id'], json.dumps({name: row[name] for name in METRICS}))
+            rows.append(row)
+    finally:
+        pool.close()
+        pool.join()
+
+    write_results_table(out_file, rows)
+    return rows
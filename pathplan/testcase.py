@@ -0,0 +1,241 @@
+'''
+Test case files and lazy loading of the data they point to.
+
+A test case is a JSON file naming a tif, an initial path and the vectorized
+shapes and altitude files of the tif, and optionally a canopy tif on the same
+grid. The results generated for it live in
+a ResultsStore; results recorded in the JSON file by older versions are
+still reported.
+The heavy pieces are only read when first used, and are memoized per process
+keyed on the file they come from, so they are reloaded when that file
+changes on disk.
+'''
+
+import json
+import os
+from os.path import splitext
+
+from pathplan.results import ResultsStore, atomic_json_dump
+
+_cache = {}
+
+
+def cached_load(filepath, loader, *args):
+    """
+    Returns loader(filepath, *args), reusing the previous result for as long
+    as the file's modification time stays the same. Results are kept apart
+    per loader, so the same file read two ways is not mixed up.
+    """
+    key = (os.path.abspath(filepath), loader.__module__, loader.__qualname__, args)
+    mtime = os.path.getmtime(filepath)
+
+    if key in _cache and _cache[key][0] == mtime:
+        return _cache[key][1]
+
+    value = loader(filepath, *args)
+    _cache[key] = (mtime, value)
+    return value
+
+
+def clear_cache():
+    _cache.clear()
+
+
+def _read_json(filepath):
+    with open(filepath) as json_file:
+        return json.load(json_file)
+
+
+class TestCase(object):
+    """
+    A test case whose path, raster, shapes and results are loaded on first
+    access.
+
+    Args:
+        case_file - the test case JSON file
+        store - ResultsStore the results are kept in
+    """
+
+    _cases = {}
+
+    def __init__(self, case_file, store=None):
+        self.case_file = case_file
+        self.store = store if store is not None else ResultsStore()
+        self._dict = None
+        self._mtime = None
+
+    @classmethod
+    def load(cls, case_file):
+        """
+        Returns the TestCase for case_file, shared within the process
+        """
+        key = os.path.abspath(case_file)
+        if key not in cls._cases:
+            cls._cases[key] = cls(case_file)
+        return cls._cases[key]
+
+    @property
+    def dict(self):
+        mtime = os.path.getmtime(self.case_file)
+        if self._dict is None or mtime != self._mtime:
+            self._dict = _read_json(self.case_file)
+            self._mtime = mtime
+        return self._dict
+
+    def __getitem__(self, key):
+        return self.dict[key]
+
+    def __contains__(self, key):
+        return key in self.dict
+
+    @property
+    def results(self):
+        results = {name: dict(result) for name, result in self.dict.get('results', {}).items()}
+        for name, result in self.store.results(self.case_file).items():
+            results.setdefault(name, {}).update(result)
+        return results
+
+    def record_path(self, name, gen_path, params_file=None, params=None, info=None):
+        self.store.add_path(self.case_file, name, gen_path, params_file, params, info)
+
+    def record_flight(self, name, flight_path, flight_logs=None):
+        self.store.add_flight(self.case_file, name, flight_path, flight_logs)
+
+    def record_metrics(self, name, metrics):
+        self.store.add_metrics(self.case_file, name, metrics)
+
+    def save(self):
+        atomic_json_dump(self.dict, self.case_file)
+        self._mtime = os.path.getmtime(self.case_file)
+
+    def _init_path(self):
+        from pathplan.utils import read_init_path
+        return cached_load(self.dict['path'], read_init_path)
+
+    @property
+    def path(self):
+        return self._init_path()[0]
+
+    @property
+    def proj(self):
+        return self._init_path()[1]
+
+    def _tif(self):
+        from pathplan.geo import read_tif
+        return cached_load(self.dict['tif'], read_tif)
+
+    @property
+    def tif(self):
+        return self._tif()[0]
+
+    @property
+    def tif_proj(self):
+        return self._tif()[1]
+
+    @property
+    def raster(self):
+        import rasterio
+        return cached_load(self.dict['tif'], rasterio.open)
+
+    def generate_shapes(self):
+        """
+        Vectorizes the tif and saves the shapes and altitude files
+        """
+        from shapely.geometry import MultiPolygon
+        from shapely.wkb import dumps
+        from pathplan.geo import vectorize_raster, shapelify_vector
+
+        name = splitext(self.case_file)[0]
+        self.dict['shapes'] = "gen/shapes/{0}.shapes".format(name)
+        self.dict['alts'] = "gen/shapes/{0}.alt.json".format(name)
+        self.save()
+
+        vecs = vectorize_raster(self.dict['tif'])
+        shapes, alt = shapelify_vector(vecs, self.dict['proj'])
+        binary = dumps(MultiPolygon(shapes))
+
+        with open(self.dict['shapes'], "wb") as wkb_file:
+            wkb_file.write(binary)
+
+        with open(self.dict['alts'], "w") as alt_dict_file:
+            json.dump(alt, alt_dict_file)
+
+    @property
+    def shapes(self):
+        from pathplan.geo import load_shapefile
+        if "shapes" not in self.dict:
+            self.generate_shapes()
+        return cached_load(self.dict['shapes'], load_shapefile)
+
+    @property
+    def alt(self):
+        from pathplan.geo import load_altfile
+        if "alts" not in self.dict:
+            self.generate_shapes()
+        return cached_load(self.dict['alts'], load_altfile)
+
+    def _surface_args(self, be_buffer, obs_buffer):
+        return self.dict['tif'], self.dict.get('canopy'), obs_buffer - be_buffer, obs_buffer
+
+    def required_surface(self, be_buffer=0, obs_buffer=0):
+        """
+        Shapes and altitude dict of the altitude a path has to fly at, less
+        be_buffer: be_buffer above the tif and obs_buffer above the canopy,
+        if the case has one, keeping obs_buffer (in feet) from
+        both horizontally. be_buffer is added back when querying, see
+        pathplan.dilate
+        """
+        from pathplan.dilate import required_altitude_shapes
+        from pathplan.geo import load_shapefile, load_altfile
+
+        shapes_file, alts_file = required_altitude_shapes(*self._surface_args(be_buffer, obs_buffer),
+                                                          do_transform=self.dict['proj'])
+        return cached_load(shapes_file, load_shapefile), cached_load(alts_file, load_altfile)
+
+    def required_index(self, be_buffer=0, obs_buffer=0):
+        """
+        Index of the same surface as required_surface for bulk intersection:
+        a SurfaceIndex over its memory mapped polygons file, or for rasters
+        wider or taller than tiles.TILE_PIXELS a TiledIndex loading tiles as
+        the path reaches them
+        """
+        from pathplan.dilate import required_altitude_polygons, required_altitude_tiles
+        from pathplan.intersect import SurfaceIndex
+        from pathplan.tiles import TILE_PIXELS, TiledIndex
+
+        args = self._surface_args(be_buffer, obs_buffer)
+        if max(self.raster.width, self.raster.height) > TILE_PIXELS:
+            return cached_load(required_altitude_tiles(*args, do_transform=self.dict['proj']), TiledIndex.load)
+        return cached_load(required_altitude_polygons(*args, do_transform=self.dict['proj']), SurfaceIndex.load)
+
+    def required_clearance(self, be_buffer=0, obs_buffer=0):
+        """
+        Clearance function of the altitude to fly at, be_buffer included,
+        for paths projected like the initial path. Only the windows of the
+        rasters the checked paths reach are read, see
+        dilate.required_altitude_clearance
+        """
+        from pathplan.dilate import required_altitude_clearance
+        return required_altitude_clearance(*self._surface_args(be_buffer, obs_buffer), buf=be_buffer, proj=self.proj)
+
+    def required_tif(self, be_buffer=0, obs_buffer=0):
+        """
+        The raster required_surface is vectorized from
+        """
+        from pathplan.dilate import required_altitude
+        return required_altitude(*self._surface_args(be_buffer, obs_buffer))
+
+    @property
+    def lines(self):
+        return cached_load(self.dict['lines'], _read_json)
+
+    def result_path(self, name, key='gen-path'):
+        """
+        Reads a generated (or, with key='flight_path', flown) path of the test
+        case, projected like the initial path
+        """
+        from pathplan.pathfile import read_path_columns
+        from pathplan.utils import project_columns
+        _, lat, lon, alt = cached_load(self.results[name][key], read_path_columns)
+        return project_columns(lat, lon, alt, self.proj)[0]
+
@@ -0,0 +1,154 @@
+'''
+Tile partitioned on-disk index for surfaces too large to hold in memory.
+
+A tiled surface is a directory holding one polygons file (see
+pathplan.polygons) per tile and a small tiles.json listing every tile's
+file, polygon count and bounding box. The required altitude surface is
+filtered and vectorized one window of tile_pixels square at a time straight
+into its tile (see dilate.required_altitude_tiles), so neither the rasters
+nor the surface are ever held whole; polygons are cut at the window edges,
+which only splits a stretch over them in two.
+
+TiledIndex answers the same bulk intersect queries as SurfaceIndex. The
+tiles a batch of segments crosses are found from the directory, and each is
+loaded the first time it is needed, with one sequential read of its file.
+Only the most recently used cache_tiles tiles are kept, so memory follows
+the mission corridor rather than the survey area.
+'''
+
+import json
+import logging
+import os
+import shutil
+from collections import OrderedDict
+
+import numpy as np
+
+from pathplan import trace
+from pathplan.intersect import BoxGrid, Crossings, SurfaceIndex, no_crossings
+from pathplan.polygons import POLYGONS_EXT, save_polygons
+
+log = logging.getLogger(__name__)
+
+DIRECTORY = 'tiles.json'
+TILE_PIXELS = 2048
+CACHE_TILES = 64
+
+
+def write_tiles(dirpath, tiles):
+    """
+    Writes a tiled surface, replacing the directory only once every tile is
+    written.
+
+    Args:
+        dirpath - directory to write
+        tiles - iterable of (name, Polygons) of every tile, empty ones are
+                left out
+
+    Returns:
+        the path of the tiles.json directory file
+    """
+    tmp = "{0}.{1}.tmp".format(dirpath.rstrip(os.sep), os.getpid())
+    os.makedirs(tmp)
+    try:
+        entries = []
+        for name, polygons in tiles:
+            if len(polygons.alts) == 0:
+                continue
+            tile_file = name + POLYGONS_EXT
+            save_polygons(os.path.join(tmp, tile_file), polygons)
+            bounds = np.concatenate((polygons.bounds[:, :2].min(axis=0), polygons.bounds[:, 2:].max(axis=0)))
+            entries.append({'file': tile_file, 'polygons': len(polygons.alts), 'bounds': bounds.tolist()})
+
+        with open(os.path.join(tmp, DIRECTORY), 'w') as directory_file:
+            json.dump({'version': 1, 'tiles': entries}, directory_file)
+        if os.path.exists(dirpath):
+            shutil.rmtree(dirpath)
+        os.rename(tmp, dirpath)
+    except Exception:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+    log.info("wrote %d tiles to %s", len(entries), dirpath)
+    return os.path.join(dirpath, DIRECTORY)
+
+
+class TiledIndex(object):
+    """
+    Bulk intersection over a tiled surface, loading tiles as queries reach
+    them.
+
+    Args:
+        directory_file - the tiles.json of the surface, see write_tiles
+        cache_tiles - most tiles kept loaded at once
+    """
+
+    def __init__(self, directory_file, cache_tiles=CACHE_TILES):
+        with open(directory_file) as tiles_json:
+            directory = json.load(tiles_json)
+        tiles = directory['tiles']
+        root = os.path.dirname(directory_file)
+
+        self.files = [os.path.join(root, tile['file']) for tile in tiles]
+        counts = np.array([tile['polygons'] for tile in tiles], dtype=np.int64)
+        # Polygon ids run on from one tile to the next
+        self.firsts = np.cumsum(counts) - counts
+        self.polygon_count = int(counts.sum())
+        self.grid = BoxGrid(np.array([tile['bounds'] for tile in tiles], dtype=float).reshape(-1, 4))
+        self.cache_tiles = cache_tiles
+        self._tiles = OrderedDict()
+
+    @classmethod
+    def load(cls, directory_file):
+        """
+        Index of a tiles.json, for cached_load like SurfaceIndex.load
+        """
+        return cls(directory_file)
+
+    def __len__(self):
+        return self.polygon_count
+
+    def tile(self, i):
+        """
+        SurfaceIndex of tile i, read whole on first use and kept while it
+        is among the cache_tiles most recently used
+        """
+        if i in self._tiles:
+            self._tiles.move_to_end(i)
+            return self._tiles[i]
+
+        with trace.span('tile_read', file=self.files[i]):
+            index = SurfaceIndex.load(self.files[i], mmap=False)
+        trace.count('tiles_loaded', 1)
+        self._tiles[i] = index
+        while len(self._tiles) > self.cache_tiles:
+            self._tiles.popitem(last=False)
+        return index
+
+    @trace.traced('intersect')
+    def intersect(self, starts, ends):
+        """
+        Clips all the segments against the polygons of the surface, see
+        SurfaceIndex.intersect. Polygon ids are global over the tiles.
+        """
+        starts, ends = np.asarray(starts, dtype=float)[:, :2], np.asarray(ends, dtype=float)[:, :2]
+        with trace.span('tile_query'):
+            seg, tile = self.grid.query(starts, ends)
+
+        if len(seg) == 0:
+            return no_crossings()
+
+        # One bulk query per tile, over the segments that reach it
+        order = np.argsort(tile, kind='mergesort')
+        seg, tile = seg[order], tile[order]
+        heads = np.flatnonzero(np.concatenate(([True], tile[1:] != tile[:-1])))
+        pieces = []
+        for start, stop in zip(heads.tolist(), np.concatenate((heads[1:], [len(tile)])).tolist()):
+            segs = seg[start:stop]
+            crossings = self.tile(int(tile[start])).intersect(starts[segs], ends[segs])
+            pieces.append((segs[crossings.segment], crossings.polygon + self.firsts[tile[start]],
+                           crossings.t_start, crossings.t_end, crossings.alt))
+
+        seg, poly, t_start, t_end, alt = (np.concatenate(column) for column in zip(*pieces))
+        order = np.lexsort((t_start, seg))
+        return Crossings(seg[order], poly[order], t_start[order], t_end[order], alt[order])
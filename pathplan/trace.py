@@ -0,0 +1,234 @@
+'''
+Stage level tracing for the planning pipeline.
+
+Stages are wrapped in named spans and notable quantities (e.g. index
+candidates vs. real intersections) are tallied in counters. Both are handed
+to whichever sinks are installed: a log, a JSON trace viewable in
+chrome://tracing, cProfile or tracemalloc. With no sink installed a span
+costs a single check.
+
+Sinks can be installed from code with add_sink, or from the environment with
+configure_from_env:
+
+    PATHPLAN_LOG=DEBUG                     level of the pathplan loggers
+    PATHPLAN_TRACE=log,json:trace.json     comma separated sinks, one of
+                                           log, json:FILE, profile:FILE,
+                                           memory
+'''
+
+import atexit
+import cProfile
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+
+log = logging.getLogger(__name__)
+
+_sinks = []
+_counters = defaultdict(float)
+_lock = threading.Lock()
+
+
+def add_sink(sink):
+    """
+    Installs a sink. Sinks may define any of begin(name), end(name, start,
+    duration, attrs), start() and stop(counters)
+    """
+    if hasattr(sink, 'start'):
+        sink.start()
+    _sinks.append(sink)
+    return sink
+
+
+def remove_sink(sink):
+    _sinks.remove(sink)
+    if hasattr(sink, 'stop'):
+        sink.stop(counters())
+
+
+def enabled():
+    return bool(_sinks)
+
+
+@contextmanager
+def span(name, **attrs):
+    """
+    Times the enclosed block as the stage `name`
+    """
+    if not _sinks:
+        yield
+        return
+
+    for sink in _sinks:
+        if hasattr(sink, 'begin'):
+            sink.begin(name)
+    start = time.time()
+    try:
+        yield
+    finally:
+        duration = time.time() - start
+        for sink in _sinks:
+            if hasattr(sink, 'end'):
+                sink.end(name, start, duration, attrs)
+
+
+def traced(name):
+    """
+    Decorator running every call of a function in a span
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, value=1):
+    if _sinks:
+        with _lock:
+            _counters[name] += value
+
+
+def counters():
+    with _lock:
+        return dict(_counters)
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+
+
+class LogSink(object):
+    """
+    Logs every span and, when removed, the counters
+    """
+
+    def __init__(self, level=logging.INFO):
+        self.level = level
+
+    def end(self, name, start, duration, attrs):
+        log.log(self.level, "%s took %.3fs %s", name, duration, attrs or '')
+
+    def stop(self, counters):
+        for name, value in sorted(counters.items()):
+            log.log(self.level, "%s = %g", name, value)
+
+
+class JsonTraceSink(object):
+    """
+    Writes the spans in the Chrome trace event format to filepath when removed
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.events = []
+
+    def end(self, name, start, duration, attrs):
+        self.events.append({'name': name, 'ph': 'X', 'ts': start * 1e6, 'dur': duration * 1e6,
+                            'pid': os.getpid(), 'tid': threading.current_thread().ident,
+                            'args': {key: str(val) for key, val in attrs.items()}})
+
+    def stop(self, counters):
+        now = time.time() * 1e6
+        events = self.events + [{'name': name, 'ph': 'C', 'ts': now, 'pid': os.getpid(), 'args': {name: value}}
+                                for name, value in counters.items()]
+        with open(self.filepath, 'w') as trace_file:
+            json.dump({'traceEvents': events}, trace_file)
+
+
+class ProfileSink(object):
+    """
+    Runs cProfile while installed, and saves the stats to filepath (or logs
+    the top functions) when removed
+    """
+
+    def __init__(self, filepath=None):
+        self.filepath = filepath
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self, counters):
+        self.profile.disable()
+        if self.filepath:
+            self.profile.dump_stats(self.filepath)
+        else:
+            import io
+            import pstats
+            out = io.StringIO()
+            pstats.Stats(self.profile, stream=out).sort_stats('cumulative').print_stats(25)
+            log.info(out.getvalue())
+
+
+class MemorySink(object):
+    """
+    Tracks allocations with tracemalloc and logs how much memory each span
+    left allocated and the peak so far
+    """
+
+    def __init__(self, level=logging.INFO):
+        self.level = level
+        self.current = {}
+
+    def start(self):
+        tracemalloc.start()
+
+    def begin(self, name):
+        self.current[name] = tracemalloc.get_traced_memory()[0]
+
+    def end(self, name, start, duration, attrs):
+        current, peak = tracemalloc.get_traced_memory()
+        log.log(self.level, "%s allocated %.1f KiB (peak %.1f KiB)", name,
+                (current - self.current.pop(name, current)) / 1024.0, peak / 1024.0)
+
+    def stop(self, counters):
+        tracemalloc.stop()
+
+
+def _make_sink(spec):
+    kind, _, arg = spec.partition(':')
+    if kind == 'log':
+        return LogSink()
+    if kind == 'json':
+        return JsonTraceSink(arg or 'trace.json')
+    if kind == 'profile':
+        return ProfileSink(arg or None)
+    if kind == 'memory':
+        return MemorySink()
+    raise ValueError("unknown trace sink {0}".format(spec))
+
+
+def configure_from_env(environ=os.environ):
+    """
+    Sets the log level and installs the sinks named by PATHPLAN_LOG and
+    PATHPLAN_TRACE. Sinks are removed (and written out) at exit
+    """
+    level = environ.get('PATHPLAN_LOG')
+    if level:
+        logging.basicConfig(format="%(asctime)s %(name)s %(levelname)s %(message)s")
+        logging.getLogger('pathplan').setLevel(level.upper())
+
+    specs = [spec for spec in environ.get('PATHPLAN_TRACE', '').split(',') if spec]
+    if not specs:
+        return
+
+    if not level:
+        logging.basicConfig(format="%(asctime)s %(name)s %(levelname)s %(message)s")
+        logging.getLogger('pathplan').setLevel(logging.INFO)
+
+    sinks = [add_sink(_make_sink(spec)) for spec in specs]
+
+    def flush():
+        for sink in sinks:
+            remove_sink(sink)
+    atexit.register(flush)
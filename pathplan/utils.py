@@ -1,38 +1,82 @@
 import json
+import logging
 import pyproj
+import numpy as np
 from pathplan.geo import utm_proj, wgs84
+from pathplan.pathfile import BINARY_PATH_EXT, read_path_columns, write_path_columns
+from pathplan import trace
 #from geo import utm_proj, wgs84
 
+log = logging.getLogger(__name__)
+
 def distance(p1, p2):
     return ((p1[0]-p2[0])**2 + (p1[1]-p2[1])**2)**.5
 
-def read_init_path(filepath, proj=None):
-    print(filepath)
-    miss_dict = json.load(open(filepath))
+def profile_arrays(path):
+    """
+    Along-track distance and altitude of every point of a path
+    """
+    points = np.asarray(path, dtype=float)
+    steps = np.hypot(np.diff(points[:, 0]), np.diff(points[:, 1]))
+    return np.concatenate(([0], np.cumsum(steps))), points[:, 2]
+
+def build_distance_lists(tups):
+    xs = [0]
+    last = tups[0]
+    ys = [last[2]]
+    acc_dist = 0
+
+    for tup in tups[1:]:
+        acc_dist += distance(last, tup)
+        xs.append(acc_dist)
+        ys.append(last[2])
+        last = tup 
+
+    return xs, ys
+
+#Projects latitude, longitude and altitude (metres) columns to (x, y, z feet)
+#points, in the UTM zone of the first point unless proj is given
+def project_columns(lat, lon, alt, proj=None):
+    if len(lat) == 0:
+        return [], proj
 
-    tups = []
-    for wp in miss_dict:
-        if proj == None:
-            proj = utm_proj(wp['latitude'], wp['longitude'])
+    if proj == None:
+        proj = utm_proj(lat[0], lon[0])
 
-        coord = pyproj.transform(wgs84, proj, wp['longitude'], wp['latitude'],0)
-        if 'altitude' in wp:
-            coord = (coord[0], coord[1], wp['altitude'] * 3.28084)
-        tups.append(coord)
+    xs, ys = pyproj.transform(wgs84, proj, np.asarray(lon), np.asarray(lat))
+    zs = np.asarray(alt) * 3.28084
 
-    return tups, proj
+    return list(zip(xs, ys, zs)), proj
+
+#Inverse of project_columns, returns latitude, longitude and altitude arrays
+def unproject_path(path, proj):
+    if len(path) == 0:
+        xs, ys, zs = np.zeros((3, 0))
+    else:
+        xs, ys, zs = np.array(path, dtype=float).T
+
+    if proj != None:
+        lon, lat, alt = pyproj.transform(proj, wgs84, xs, ys, zs)
+    else:
+        lat, lon, alt = xs, ys, zs
+    return np.asarray(lat), np.asarray(lon), np.asarray(alt) * .3048
+
+#Reads either a JSON or a binary path file
+@trace.traced('path_read')
+def read_init_path(filepath, proj=None):
+    log.debug("reading path %s", filepath)
+    _, lat, lon, alt = read_path_columns(filepath)
+    return project_columns(lat, lon, alt, proj)
 
 #Also does projection
-def save_path(filepath, path, proj):
-    arr = []
-    for stuff in path:
-        print(stuff)
-        lon, lat, alt = stuff
-        if proj != None:
-            lon, lat, alt = pyproj.transform(proj, wgs84, lon, lat, alt)
-        else:
-            lat, lon = lon, lat
-        new_dict = {'latitude' : lat, 'longitude' : lon, 'altitude' : alt * .3048}
-        arr.append(new_dict)
+#Paths saved to a file ending in BINARY_PATH_EXT use the columnar format
+@trace.traced('save')
+def save_path(filepath, path, proj, provenance=None):
+    lat, lon, alt = unproject_path(path, proj)
+
+    if filepath.endswith(BINARY_PATH_EXT):
+        write_path_columns(filepath, lat, lon, alt, provenance=provenance)
+        return
 
+    arr = [{'latitude' : la, 'longitude' : lo, 'altitude' : al} for la, lo, al in zip(lat.tolist(), lon.tolist(), alt.tolist())]
     json.dump(arr, open(filepath, 'w'))
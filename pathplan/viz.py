@@ -4,95 +4,79 @@ from matplotlib.patches import Polygon
 from matplotlib.collections import PatchCollection
 from mpl_toolkits.mplot3d import Axes3D
 from matplotlib import cm
-from pathplan.utils import distance, read_init_path
+from pathplan.utils import distance, read_init_path, profile_arrays, build_distance_lists
+from pathplan.lidar import cell_area, coverage_counts, coverage_stats, to_pixels
 from pathplan.geo import wgs84
-from scipy.interpolate import interp1d,griddata
 import numpy as np
 import pyproj
+import logging
 
-def build_distance_lists(tups):
-    print(tups)
-    xs = [0]
-    last = tups[0]
-    ys = [last[2]]
-    acc_dist = 0
+log = logging.getLogger(__name__)
 
-    for tup in tups[1:]:
-        acc_dist += distance(last, tup)
-        xs.append(acc_dist)
-        ys.append(last[2])
-        last = tup 
+#Pixels of the canvas per cell of the rendered DSM mesh
+SURFACE_CELL_PIXELS = 4
+#Points along and across the ribbon drawn between two paths
+DIFF_SAMPLES = 500
+DIFF_ROWS = 2
 
-    return xs, ys
+def profile_surface(path_one, path_two, samples=DIFF_SAMPLES, rows=DIFF_ROWS):
+    """
+    Mesh of the ribbon between two paths. The paths are matched by distance
+    along them (over the length of the shorter one) rather than by index,
+    resampled to at most `samples` points each.
+    Returns:
+        X, Y, Z arrays of shape (rows, samples)
+    """
+    one = np.asarray(path_one, dtype=float)
+    two = np.asarray(path_two, dtype=float)
+    d1, _ = profile_arrays(one)
+    d2, _ = profile_arrays(two)
+
+    count = max(min(samples, max(len(one), len(two))), 2)
+    along = np.linspace(0, min(d1[-1], d2[-1]), count)
 
-def reduce_points(less, gt):
-    tup_set = set([(x,y) for (x,y,z) in less])
- 
-    return [(x,y,z) for (x,y,z) in gt if (x,y) in tup_set]
+    # (3, count) coordinates of each path at the same distances along it
+    c1 = np.array([np.interp(along, d1, one[:, k]) for k in range(3)])
+    c2 = np.array([np.interp(along, d2, two[:, k]) for k in range(3)])
 
-def display_surface(path_one, path_two, ax):
+    h = np.linspace(0, 1, rows)[None, :, None]
+    X, Y, Z = c1[:, None, :] + (c2 - c1)[:, None, :] * h
+    return X, Y, Z
+
+def display_surface(path_one, path_two, ax=None, samples=DIFF_SAMPLES):
     """
-    Display a graph of the a surface between two paths. Expects the two
-    input paths to have the same amount of data points. (ie len(one) == len(two))
+    Display a graph of the surface between two paths, matched up by
+    distance along them.
     Args:
         path_one - List of waypoints in format [(x, y, z), (x, y, z), ...]
         path_two - List of waypoints in format [(x, y, z), (x, y, z), ...]
+        ax - 3d axes to draw on, a new figure is made if not given
+        samples - most points of the paths to mesh
     """
+    if ax is None:
+        fig = plt.figure()
+        ax = fig.add_subplot(111, projection='3d')
 
-    if len(path_one) > len(path_two):
-        path_one = reduce_points(path_two, path_one)
-    else:
-        path_two = reduce_points(path_one, path_two)
-
-    Z1 = 8.0
-    Z2 = 9.0
-
-    x1, y1, z1 = np.array(path_one).T
-    x2, y2, z2 = np.array(path_two).T
-
-    i, h = np.meshgrid(np.arange(len(x1)), np.linspace(Z1, Z2, 10))
-    X = (x2[i] - x1[i]) / (Z2 - Z1) * (h - Z1) + x1[i]
-    Y = (y2[i] - y1[i]) / (Z2 - Z1) * (h - Z1) + y1[i]
-    Z = (z2[i] - z1[i]) / (Z2 - Z1) * (h - Z1) + z1[i]
+    X, Y, Z = profile_surface(path_one, path_two, samples)
 
     ax.set_xlabel("Distance along path (ft)")
     ax.set_ylabel("Distance along path (ft)")
     ax.set_zlabel("Altitude")
-    #ax.plot(x1, y1, z1, 'k-', linewidth=1.4, color='b', label="Planned Path")
-    #ax.plot(x2, y2, z2, 'k-', linewidth=1.4, color='r', label="Flown Path")
-    ax.plot_surface(X, Y, Z, color='g', alpha=0.4, linewidth=0, label="Highlighted Error")
-
-    # Proxy for displaying legend, as legends are not supported in 3d Plots:
-    colors = ["blue", "red", "green"]
-    proxy1 = matplotlib.lines.Line2D([0],[0], c=colors[0])
-    proxy2 = matplotlib.lines.Line2D([0],[0], c=colors[1])
-    proxy3 = matplotlib.lines.Line2D([0],[0], c=colors[2])
-    #ax.legend([proxy1, proxy2, proxy3], ['Path1', 'Path2', 'Highlighted Error'], numpoints = 1)
-
-def plot_lidar_penetration(path, dist, **kwargs):
+    return ax.plot_surface(X, Y, Z, rstride=1, cstride=1, color='g', alpha=0.4, linewidth=0, label="Highlighted Error")
+
+def plot_coverage(counts, **kwargs):
+  """
+  Shows how many scan lines cover each cell of the raster, see
+  pathplan.lidar.coverage_counts
+  """
   if 'ax' not in kwargs:
       fig = plt.figure()
-      if 'dimen' not in kwargs:
-          ax = fig.add_subplot(111)
-      else:
-          ax = fig.add_subplot(111, projection=kwargs['dimen'])
+      ax = fig.add_subplot(111)
   else:
       ax = kwargs['ax']
 
-  xs, ys = build_distance_lists(path)
-
-  y_interp = interp1d(xs, ys)
-
-  new_xs = np.arange(xs[0], xs[-1], abs(xs[0]-xs[-1]) / 1000)
-  fake_ys = [y_interp(x) for x in new_xs]
-
-  ys2 = []
-
-  for y in fake_ys:
-    ys2.append(y - dist)
-
-  ax.fill_between(new_xs, fake_ys, ys2)
-    
+  masked = np.ma.masked_equal(counts, 0)
+  return ax.imshow(masked, cmap=cm.viridis, interpolation='nearest')
 
 #Lines: tuple ((x1, y1), (x2, y2)) mapped to a list of LineStrings
 # Each path is a tuple mapped to a list of LineStrings
@@ -126,7 +110,7 @@ def plot2d(lines, *paths, **kwargs):
       colors = kwargs['colors']
 
   for ((name,path), col) in zip(paths, colors):
-      print("plotting path {0}".format(name))
+      log.debug("plotting path %s", name)
       path_x, path_y = build_distance_lists(path)
 
       ax.plot(path_x, path_y, label=name, color=col)
@@ -144,7 +128,49 @@ def plot2d(lines, *paths, **kwargs):
   #plt.legend(loc='bottom left')
   #plt.show()
 
-import rasterio
+_mesh_cache = {}
+
+def surface_mesh(image, raster, proj, max_cells):
+  """
+  The raster as X, Y, Z grids in proj, max pooled down to at most max_cells
+  cells a side so peaks survive the downsampling. Meshes are cached per
+  raster, projection and resolution.
+  Args:
+      image - 2d array of surface heights read from raster
+      raster - the open rasterio dataset
+      proj - projection of the plotted paths
+      max_cells - most cells along either side of the mesh
+  """
+  stride = int(np.ceil(max(image.shape) / float(max_cells)))
+  stride = max(min(stride, min(image.shape)), 1)
+
+  key = (raster.name, image.shape, proj.srs, stride)
+  if key in _mesh_cache:
+    return _mesh_cache[key]
+
+  rows, cols = image.shape[0] // stride, image.shape[1] // stride
+  Z = image[:rows*stride, :cols*stride].reshape(rows, stride, cols, stride).max(axis=(1, 3))
+
+  #Centers of the pooled blocks
+  col_idx, row_idx = np.meshgrid((np.arange(cols) + .5) * stride, (np.arange(rows) + .5) * stride)
+  aff = raster.affine
+  xs = aff.a * col_idx + aff.b * row_idx + aff.c
+  ys = aff.d * col_idx + aff.e * row_idx + aff.f
+  X, Y = pyproj.transform(pyproj.Proj(raster.crs, preserve_units=True), proj, xs, ys)
+
+  _mesh_cache[key] = (X, Y, Z)
+  return X, Y, Z
+
+def canvas_cells(fig):
+  """
+  Mesh resolution matching the figure's size on screen
+  """
+  width, height = fig.get_size_inches() * fig.dpi
+  return max(int(max(width, height)) // SURFACE_CELL_PIXELS, 2)
+
+def plot_surface_mesh(ax, X, Y, Z):
+  return ax.plot_surface(X, Y, Z, rstride=1, cstride=1, cmap=cm.coolwarm, linewidth=0, antialiased=False)
+
 def plot3d(image, raster, proj, *paths, **kwargs):
 
   if 'ax' not in kwargs:
@@ -153,56 +179,187 @@ def plot3d(image, raster, proj, *paths, **kwargs):
   else:
       ax = kwargs['ax']
 
-  print(paths)
-
-
   if 'colors' in kwargs:
     colors = kwargs['colors']
   else:
     colors = ['b'] * len(paths)
 
   for (name,waypoints),color in zip(paths,colors):
-      print(waypoints)
       x_points, y_points, z_points = zip(*waypoints)
       ax.plot(x_points, y_points, zs=z_points, label=name, color=color)
 
-  max_x = max(x_points)
-  max_y = max(y_points)
+  if kwargs.get('plot_surface', True):
+    plot_surface_mesh(ax, *surface_mesh(image, raster, proj, canvas_cells(ax.figure)))
 
-  if 'plot_surface' in kwargs and not kwargs['plot_surface']:
-    init_proj = pyproj.Proj(raster.crs, preserve_units=True)
-    bounds = raster.bounds
-
-    left, top = pyproj.transform(init_proj, proj, bounds.left, bounds.top)
-    right, bottom = pyproj.transform(init_proj, proj, bounds.right, bounds.bottom)
-
-    print(bounds)
-    print(raster.width)
-    print(raster.height)
-
-    width = right - left 
-    x_step = width / raster.width
-
-    
-    height = abs(top - bottom)
-    y_step = height / raster.height
-
-    print(x_step)
-    print(y_step)
-
-    x_raster = np.arange(int(left), int(right), step=x_step)
-    y_raster = np.arange(int(bottom), int(top), step=y_step)
-
-    print(len(x_raster))
-    print(len(y_raster))
+  if 'ax' not in kwargs:
+    plt.show()
 
-    x_raster, y_raster = np.meshgrid(x_raster, y_raster)
 
-    print(len(x_raster))
-    print(len(y_raster))
-    print(image.shape)
-    print(x_raster.shape)
-    print(y_raster.shape)
-    ax.plot_surface(x_raster[:, 1:], y_raster[:, 1:], image, cmap=cm.coolwarm,linewidth=0, antialiased=False)
+class PathView(object):
+  """
+  Draws paths on a figure in 2D (altitude along the path) or 3D, keeping
+  one artist per path and view so redrawing only touches what changed.
+
+  Artists are created the first time a path is shown, after which they are
+  hidden, recolored or given new data in place. The DSM mesh is built once
+  per axes at the canvas resolution.
+  Args:
+      fig - matplotlib figure to draw on
+  """
+
+  def __init__(self, fig):
+    self.fig = fig
+    self.axes = {}
+    self.artists = {}
+    self.data = {}
+    self.surface = None
+    self.coverage = {}
+
+  def ax(self, dimen):
+    if dimen not in self.axes:
+      if dimen == '3d':
+        ax = self.fig.add_subplot(111, projection='3d')
+        ax.set_zlabel("Altitude (feet)")
+      elif dimen == 'coverage':
+        ax = self.fig.add_subplot(111)
+        ax.set_xlabel("Raster column")
+        ax.set_ylabel("Raster row")
+      else:
+        ax = self.fig.add_subplot(111)
+        ax.set_xlabel("Distance Along Path (feet)")
+        ax.set_ylabel("Altitude (feet)")
+      self.axes[dimen] = ax
+    return self.axes[dimen]
 
-    plt.show()
+  def _artist(self, key, data, create):
+    """
+    Returns the artist for key, calling create() when it doesn't exist yet
+    or was drawn from different data (a tuple of the paths it shows)
+    """
+    if key in self.artists and (len(self.data[key]) != len(data) or
+                                not all(a is b for a, b in zip(self.data[key], data))):
+      self.artists.pop(key).remove()
+    if key not in self.artists:
+      self.artists[key] = create()
+      self.data[key] = data
+    return self.artists[key]
+
+  def _line(self, dimen, name, path, color, to_raster=None):
+    ax = self.ax(dimen)
+
+    def create():
+      if dimen == '3d':
+        xs, ys, zs = np.asarray(path, dtype=float).T
+        return ax.plot(xs, ys, zs, label=name)[0]
+      if dimen == 'coverage':
+        xs, ys, _ = np.asarray(path, dtype=float).T
+        return ax.plot(*to_raster(xs, ys), label=name)[0]
+      return ax.plot(*profile_arrays(path), label=name)[0]
+
+    line = self._artist((dimen, 'path', name), (path,), create)
+    line.set_color(color)
+    return line
+
+  def show(self, dimen, paths, colors, surface=None, lidar=None, diffs=False, **kwargs):
+    """
+    Shows exactly the given paths (and extras) and redraws the canvas.
+    Args:
+        dimen - '2d', '3d' or 'coverage' (a map of the lidar coverage of
+                the paths over the raster)
+        paths - list of (name, waypoints)
+        colors - color of each path
+        surface - in 2D the (name, waypoints) surface profile to draw,
+                  in 3D and coverage views (image, raster, proj) of the DSM
+        lidar - in the coverage view, (fov, max_range) of the sensor
+        diffs - in 3D, draw the difference surface between every pair
+        surf_color - color of the 2D surface profile
+    """
+    ax = self.ax(dimen)
+    for other, other_ax in self.axes.items():
+      other_ax.set_visible(other == dimen)
+
+    visible = set()
+    lines = []
+
+    to_raster = None
+    if dimen == 'coverage':
+      image, raster, proj = surface
+      raster_proj = pyproj.Proj(raster.crs, preserve_units=True)
+      to_raster = lambda xs, ys: to_pixels(xs, ys, raster.affine, proj, raster_proj)
+
+      key = (dimen, 'map', lidar)
+      self._artist(key, tuple(path for _, path in paths),
+                   lambda: plot_coverage(self._coverage(paths, surface, lidar), ax=ax))
+      visible.add(key)
+
+    for (name, path), color in zip(paths, colors):
+      lines.append(self._line(dimen, name, path, color, to_raster))
+      visible.add((dimen, 'path', name))
+
+    if diffs and dimen == '3d':
+      for i in range(len(paths)):
+        for j in range(i+1, len(paths)):
+          (n1, p1), (n2, p2) = paths[i], paths[j]
+          key = (dimen, 'diff', n1, n2)
+          self._artist(key, (p1, p2), lambda: display_surface(p1, p2, ax))
+          visible.add(key)
+
+    if surface is not None and dimen == '2d':
+      surf_name, surf_path = surface
+      if len(surf_path) > 0:
+        line = self._line(dimen, surf_name, surf_path, kwargs.get('surf_color', 'r'))
+        lines.append(line)
+        visible.add((dimen, 'path', surf_name))
+
+    if dimen == 'coverage':
+      image, raster, _ = surface
+      stats = coverage_stats(self._coverage(paths, surface, lidar), cell_area(raster.affine, raster.crs, image.shape))
+      ax.set_title("{0:.1%} covered ({1:.0f} m2), {2:.1f} scan lines per covered cell".format(
+        stats['covered_fraction'], stats['covered_area'], stats['mean_lines']))
+
+    if surface is not None and dimen == '3d':
+      image, raster, proj = surface
+      if self.surface is None:
+        self.surface = plot_surface_mesh(ax, *surface_mesh(image, raster, proj, canvas_cells(self.fig)))
+      self.surface.set_visible(True)
+    elif self.surface is not None:
+      self.surface.set_visible(False)
+
+    for key, artist in self.artists.items():
+      artist.set_visible(key in visible)
+
+    self._rescale(dimen, ax, [self.data[key][0] for key in visible if key[1] == 'path'])
+    #a fixed corner, 'best' scans every vertex of the mesh on each draw
+    if lines:
+      ax.legend(handles=lines, loc='upper right')
+    self.fig.canvas.draw_idle()
+
+  def _coverage(self, paths, surface, lidar):
+    """
+    Coverage counts of all paths together, cached per path and sensor
+    """
+    image, raster, proj = surface
+    fov, max_range = lidar
+    raster_proj = pyproj.Proj(raster.crs, preserve_units=True)
+
+    total = np.zeros(image.shape, dtype=np.int64)
+    for name, path in paths:
+      key = (name, lidar)
+      if key not in self.coverage or self.coverage[key][0] is not path:
+        counts = coverage_counts(path, image, raster.affine, proj, raster_proj, fov, max_range)
+        self.coverage[key] = (path, counts)
+      total += self.coverage[key][1]
+    return total
+
+  def _rescale(self, dimen, ax, paths):
+    if not paths or dimen == 'coverage':
+      return
+
+    points = np.concatenate([np.asarray(path, dtype=float) for path in paths])
+    if dimen == '3d':
+      ax.set_xlim(points[:, 0].min(), points[:, 0].max())
+      ax.set_ylim(points[:, 1].min(), points[:, 1].max())
+      ax.set_zlim(points[:, 2].min(), points[:, 2].max())
+    else:
+      ax.relim(visible_only=True)
+      ax.autoscale_view()
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from pathplan.alignment import align_trajectory
+
+PLANNED = [(0.0, 0.0, 100.0), (200.0, 0.0, 140.0), (200.0, 100.0, 140.0)]
+
+
+def plan_alt(along):
+    return np.interp(along, [0, 200, 300], [100, 140, 140])
+
+
+def synthetic_flight():
+    """
+    Flown points at known distances along the planned path with known
+    signed cross track and vertical offsets, away from the corner
+    """
+    rand = np.random.RandomState(0)
+    along = np.concatenate((np.linspace(5, 190, 60), np.linspace(210, 295, 30)))
+    cross = rand.uniform(-4, 4, len(along))
+    vertical = rand.uniform(-10, 10, len(along))
+
+    first = along <= 200
+    # Left of the first leg is +y, left of the second is -x
+    xs = np.where(first, along, 200 - cross)
+    ys = np.where(first, cross, along - 200)
+    flown = np.column_stack((xs, ys, plan_alt(along) + vertical))
+    return flown, along, cross, vertical
+
+
+def test_known_offsets():
+    flown, along, cross, vertical = synthetic_flight()
+    alignment = align_trajectory(PLANNED, flown)
+
+    np.testing.assert_allclose(alignment.along_track, along, atol=1e-9)
+    np.testing.assert_allclose(alignment.cross_track, cross, atol=1e-9)
+    np.testing.assert_allclose(alignment.vertical, vertical, atol=1e-9)
+    np.testing.assert_array_equal(alignment.segment, np.where(along <= 200, 0, 1))
+    assert alignment.timestamp is None
+    assert alignment.along_track_error is None
+
+
+def test_along_track_error_with_timestamps_and_speed():
+    flown, along, _, _ = synthetic_flight()
+    speed = 5.0
+    lag = np.linspace(0, 3, len(along))
+    timestamps = 100 + (along - along[0] + lag) / speed
+
+    alignment = align_trajectory(PLANNED, flown, timestamps, speed)
+    np.testing.assert_array_equal(alignment.timestamp, timestamps)
+    np.testing.assert_allclose(alignment.along_track_error, along[0] - lag, atol=1e-9)
+
+
+def test_timestamps_without_speed():
+    flown, along, _, _ = synthetic_flight()
+    alignment = align_trajectory(PLANNED, flown, np.arange(len(along), dtype=float))
+    assert alignment.along_track_error is None
+    np.testing.assert_allclose(alignment.along_track, along, atol=1e-9)
+
+
+@pytest.mark.parametrize('spacing', [0.5, 10.0, 1000.0])
+def test_spacing_does_not_change_the_projection(spacing):
+    flown, along, cross, _ = synthetic_flight()
+    alignment = align_trajectory(PLANNED, flown, spacing=spacing)
+    np.testing.assert_allclose(alignment.along_track, along, atol=1e-9)
+    np.testing.assert_allclose(alignment.cross_track, cross, atol=1e-9)
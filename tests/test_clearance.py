@@ -0,0 +1,38 @@
+import numpy as np
+
+from pathplan.clearance import check_clearance, raster_clearance, windowed_clearance
+
+
+def test_windowed_clearance_matches_the_whole_raster():
+    surface = np.random.RandomState(0).rand(37, 29) * 50
+    reads = []
+
+    def read_window(window):
+        reads.append(window)
+        (row_start, row_stop), (col_start, col_stop) = window
+        return surface[row_start:row_stop, col_start:col_stop]
+
+    whole = raster_clearance(surface, 5)
+    windowed = windowed_clearance(read_window, surface.shape, 5, window_pixels=8, cache_windows=2)
+
+    rand = np.random.RandomState(1)
+    for _ in range(5):
+        xs, ys = rand.uniform(-3, 32, 200), rand.uniform(-3, 40, 200)
+        np.testing.assert_array_equal(windowed(xs, ys), whole(xs, ys))
+    assert all(row_stop - row_start <= 8 and col_stop - col_start <= 8
+               for (row_start, row_stop), (col_start, col_stop) in reads)
+
+
+def test_windowed_clearance_only_reads_the_corridor():
+    surface = np.zeros((100, 100))
+    reads = []
+
+    def read_window(window):
+        reads.append(window)
+        (row_start, row_stop), (col_start, col_stop) = window
+        return surface[row_start:row_stop, col_start:col_stop]
+
+    clearance = windowed_clearance(read_window, surface.shape, 0, window_pixels=10)
+    report = check_clearance([(5, 5, 1), (95, 5, 1)], clearance)
+    assert report.violations == []
+    assert sorted(reads) == [((0, 10), (col, col + 10)) for col in range(0, 100, 10)]
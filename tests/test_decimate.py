@@ -0,0 +1,31 @@
+import numpy as np
+
+from pathplan.decimate import decimate_path
+
+
+def flat(xs, ys):
+    return np.zeros(np.shape(xs))
+
+
+def test_turning_route_keeps_corners():
+    path = [(0, 0, 10), (100, 0, 10), (100, 20, 10), (0, 20, 10), (0, 40, 10), (100, 40, 10)]
+    decimated, _ = decimate_path(path, flat)
+    assert [p[:2] for p in decimated] == [p[:2] for p in path]
+
+
+def test_straight_run_is_simplified():
+    path = [(0, 0, 10), (25, 0, 10), (50, 0, 10), (100, 0, 10), (100, 50, 10)]
+    decimated, _ = decimate_path(path, flat)
+    assert [p[:2] for p in decimated] == [(0, 0), (100, 0), (100, 50)]
+
+
+def test_keeps_waypoints_needed_for_clearance():
+    def ridge(xs, ys):
+        return np.where(np.abs(np.asarray(xs) - 50) < 5, 30.0, 0.0)
+
+    path = [(0, 0, 10), (40, 0, 10), (40, 0, 35), (60, 0, 35), (60, 0, 10), (100, 0, 10)]
+    decimated, _ = decimate_path(path, ridge)
+    xs = np.linspace(0, 100, 1001)
+    d = np.array([p[0] for p in decimated])
+    z = np.array([p[2] for p in decimated])
+    assert np.all(np.interp(xs, d, z) >= ridge(xs, xs * 0) - 1e-9)
@@ -0,0 +1,73 @@
+import numpy as np
+from affine import Affine
+from rasterio.crs import CRS
+
+from pathplan.dilate import dilate, radius_pixels
+
+
+def test_dilate_is_a_square_max_filter():
+    image = np.zeros((7, 7))
+    image[3, 3] = 1
+    dilated = dilate(image, 2)
+    assert dilated.sum() == 25
+    assert dilated[1:6, 1:6].all()
+
+
+def test_radius_of_a_projected_raster_in_metres():
+    utm = CRS.from_epsg(32611)
+    assert radius_pixels(Affine(1, 0, 500000, 0, -1, 3600000), 10, utm, (100, 100)) == 4
+
+
+def test_radius_of_a_projected_raster_in_feet():
+    state_plane = CRS.from_epsg(2230)
+    assert radius_pixels(Affine(1, 0, 6000000, 0, -1, 2000000), 10, state_plane, (100, 100)) == 10
+
+
+def test_radius_of_a_geographic_raster():
+    # About 0.93m by 1.11m pixels at 33 degrees north, 10 feet is 3.048m
+    affine = Affine(1e-5, 0, -117.0, 0, -1e-5, 33.0)
+    assert radius_pixels(affine, 10, CRS.from_epsg(4326), (100, 100)) == 4
+    assert radius_pixels(affine, 2, CRS.from_epsg(4326), (100, 100)) == 1
+
+
+def test_vectorized_surfaces_are_cached_per_projection(tmp_path):
+    from pathplan.dilate import _vector_stem
+    from pathplan.geo import proj_utm
+
+    tif_file = tmp_path / 'surface.tif'
+    tif_file.write_bytes(b'')
+    stems = {_vector_stem(str(tif_file), False, None),
+             _vector_stem(str(tif_file), True, None),
+             _vector_stem(str(tif_file), True, proj_utm(11, True)),
+             _vector_stem(str(tif_file), True, proj_utm(12, True))}
+    assert len(stems) == 4
+    assert _vector_stem(str(tif_file), False, proj_utm(11, True)) == _vector_stem(str(tif_file), False, None)
+
+
+class ArraySource(object):
+    """
+    Stands in for a single band rasterio dataset over an array
+    """
+
+    def __init__(self, image):
+        self.image = image
+        self.shape = image.shape
+
+    def read(self, band, window):
+        (row_start, row_stop), (col_start, col_stop) = window
+        return self.image[row_start:row_stop, col_start:col_stop]
+
+
+def test_windows_with_a_halo_match_the_whole_raster():
+    from pathplan.dilate import _required_window, _windows
+
+    rand = np.random.RandomState(0)
+    bare_earth, canopy = rand.rand(23, 17) * 100, rand.rand(23, 17) * 100
+    expected = np.maximum(dilate(bare_earth, 3), dilate(canopy, 3) + 5)
+
+    required = np.zeros_like(expected)
+    for window in _windows(bare_earth.shape, 5):
+        (row_start, row_stop), (col_start, col_stop) = window
+        required[row_start:row_stop, col_start:col_stop] = _required_window(
+            ArraySource(bare_earth), ArraySource(canopy), window, 5, 3)
+    np.testing.assert_array_equal(required, expected)
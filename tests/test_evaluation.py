@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from pathplan.evaluation import StreamingError, mse
+
+PLANNED = np.array([[0.0, 0.0, 100.0], [100.0, 0.0, 150.0], [100.0, 80.0, 110.0]])
+
+
+def planned_alt(along):
+    return np.interp(along, [0, 100, 180], PLANNED[:, 2])
+
+
+def synthetic_flight(n=400):
+    """
+    Flown points weaving either side of the planned path, hovering and
+    doubling back, with a known altitude error at every point
+    """
+    rng = np.random.RandomState(0)
+    along = np.concatenate((np.linspace(0, 90, n // 2), np.full(n // 8, 90.0),
+                            np.linspace(90, 60, n // 8), np.linspace(60, 170, n // 4)))
+    # Weave less near the corner so every point projects onto its own leg
+    side = 3 * np.sin(along / 7) * np.clip(np.abs(along - 100) / 10, 0, 1)
+    on_first = along <= 100
+    xs = np.where(on_first, along, 100 + side)
+    ys = np.where(on_first, side, along - 100)
+    errors = rng.normal(0, 4, len(along))
+    return np.column_stack((xs, ys, planned_alt(along) + errors)), errors
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 64, 1000])
+def test_streamed_metrics_match_in_memory(chunk_size):
+    flown, errors = synthetic_flight()
+    streamed = StreamingError(PLANNED)
+    for start in range(0, len(flown), chunk_size):
+        streamed.update(flown[start:start + chunk_size])
+
+    assert streamed.count == len(flown)
+    assert streamed.mse == pytest.approx(mse(PLANNED, flown))
+    assert streamed.mse == pytest.approx(np.mean(errors**2))
+    assert streamed.mean_error == pytest.approx(np.mean(errors))
+    assert streamed.max_error == pytest.approx(np.abs(errors).max())
+    for q in (50, 90, 99):
+        assert abs(streamed.percentile(q) - np.percentile(np.abs(errors), q)) < 0.05
+
+
+def test_empty_planned_path_is_rejected():
+    with pytest.raises(ValueError):
+        StreamingError([])
+
+
+def test_single_waypoint_plan():
+    errors = StreamingError([[0.0, 0.0, 100.0]]).update([[5.0, 5.0, 103.0], [-2.0, 1.0, 96.0]])
+    assert errors.mse == pytest.approx((9 + 16) / 2.0)
@@ -0,0 +1,23 @@
+import importlib
+import os
+import pkgutil
+
+import pytest
+
+import pathplan
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = (['pathplan.' + name for _, name, _ in pkgutil.iter_modules(pathplan.__path__)] +
+           [name for name in ('main', 'gui', 'jobs') if os.path.exists(os.path.join(ROOT, name + '.py'))])
+
+
+@pytest.mark.parametrize('module', MODULES)
+def test_module_imports(module):
+    try:
+        importlib.import_module(module)
+    except ModuleNotFoundError as error:
+        # Optional dependencies (e.g. dronekit for the SITL) may be missing,
+        # pathplan's own modules and names may not
+        if error.name is None or error.name.split('.')[0] in ('pathplan', 'main', 'gui', 'jobs'):
+            raise
+        pytest.skip("{0} needs {1}".format(module, error.name))
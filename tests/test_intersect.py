@@ -0,0 +1,84 @@
+import numpy as np
+from shapely.geometry import LineString, Polygon, box
+
+from pathplan.intersect import SurfaceIndex
+from pathplan.polygons import load_polygons, save_polygons
+
+
+def grid_shapes(size):
+    """
+    A size by size grid of unit cells: plain squares, squares with a hole
+    and concave L shapes
+    """
+    shapes = []
+    for i in range(size):
+        for j in range(size):
+            if (i + j) % 7 == 0:
+                shapes.append(Polygon([(i, j), (i + 1, j), (i + 1, j + 0.4), (i + 0.4, j + 0.4), (i + 0.4, j + 1),
+                                       (i, j + 1)]))
+            elif (i * j) % 5 == 0:
+                shapes.append(Polygon([(i, j), (i + 1, j), (i + 1, j + 1), (i, j + 1)],
+                                      [[(i + .3, j + .3), (i + .7, j + .3), (i + .7, j + .7), (i + .3, j + .7)]]))
+            else:
+                shapes.append(box(i, j, i + 1, j + 1))
+    return shapes
+
+
+def stretch_lengths(index, starts, ends):
+    """
+    Length of every (segment, polygon) pair's stretches
+    """
+    crossings = index.intersect(starts, ends)
+    lengths = np.hypot(*(ends - starts).T)
+    result = {}
+    for seg, poly, t_start, t_end in zip(crossings.segment, crossings.polygon, crossings.t_start, crossings.t_end):
+        result[seg, poly] = result.get((seg, poly), 0) + (t_end - t_start) * lengths[seg]
+    return result
+
+
+def test_intersect_matches_shapely(tmp_path):
+    shapes = grid_shapes(20)
+    index = SurfaceIndex.from_shapes(shapes, {shape.wkt: float(i) for i, shape in enumerate(shapes)})
+    polygons_file = str(tmp_path / 'surface.polys.npy')
+    save_polygons(polygons_file, index.polygons)
+    index = SurfaceIndex.load(polygons_file)
+
+    points = np.random.RandomState(0).uniform(-3, 23, (80, 2))
+    starts, ends = points[:-1], points[1:]
+    lengths = stretch_lengths(index, starts, ends)
+
+    expected = {}
+    for seg, (start, end) in enumerate(zip(starts, ends)):
+        line = LineString([start, end])
+        for poly, shape in enumerate(shapes):
+            length = shape.intersection(line).length
+            if length > 0:
+                expected[seg, poly] = length
+
+    assert set(lengths) == set(expected)
+    for pair, length in expected.items():
+        assert abs(lengths[pair] - length) < 1e-9
+    np.testing.assert_array_equal(np.asarray(index.alts)[[poly for _, poly in lengths]],
+                                  [float(poly) for _, poly in lengths])
+
+
+def test_shared_edges_are_covered_once():
+    shapes = grid_shapes(10)
+    index = SurfaceIndex.from_shapes(shapes, {shape.wkt: 0.0 for shape in shapes})
+    starts = np.array([[-1.0, 4.0], [3.0, -1.0]])
+    ends = np.array([[11.0, 4.0], [3.0, 11.0]])
+
+    lengths = stretch_lengths(index, starts, ends)
+    for seg in range(2):
+        covered = sum(length for (s, _), length in lengths.items() if s == seg)
+        assert abs(covered - 10) < 1e-9
+
+
+def test_polygons_round_trip(tmp_path):
+    shapes = grid_shapes(4)
+    polygons = SurfaceIndex.from_shapes(shapes, {shape.wkt: float(i) for i, shape in enumerate(shapes)}).polygons
+    polygons_file = str(tmp_path / 'surface.polys.npy')
+    save_polygons(polygons_file, polygons)
+
+    for expected, loaded in zip(polygons, load_polygons(polygons_file)):
+        np.testing.assert_array_equal(loaded, expected)
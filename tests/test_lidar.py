@@ -0,0 +1,45 @@
+import numpy as np
+from affine import Affine
+from rasterio.crs import CRS
+
+from pathplan.lidar import cell_area, coverage_counts, coverage_stats, swath_half_widths
+
+FEET_PER_METRE = 1 / 0.3048
+
+
+def test_half_width_is_in_metres():
+    # 100 feet is 30.48m, a 90 degree field of view sees as far to each side
+    np.testing.assert_allclose(swath_half_widths([100.0], fov=90), [30.48])
+
+
+def test_half_width_out_of_range_or_below_ground():
+    np.testing.assert_array_equal(swath_half_widths([-5.0, 0.0, 400 * FEET_PER_METRE + 1], fov=90, max_range=400),
+                                  [0, 0, 0])
+
+
+def test_half_width_is_limited_by_range():
+    # The edges of a 170 degree field of view are out of a 100m range
+    np.testing.assert_allclose(swath_half_widths([100.0], fov=170, max_range=100), [np.sqrt(100**2 - 30.48**2)])
+
+
+def test_counts_over_a_flat_raster():
+    # 10m above a flat 1m grid, a 90 degree swath is 20m wide
+    altitude = 10 * FEET_PER_METRE
+    counts = coverage_counts([(5, 25, altitude), (45, 25, altitude)], np.zeros((50, 50)), fov=90)
+
+    rows = np.flatnonzero(counts.any(axis=1))
+    cols = np.flatnonzero(counts.any(axis=0))
+    assert 14 <= rows.min() <= 16 and 34 <= rows.max() <= 35
+    assert cols.min() == 5 and cols.max() == 45
+    # One scan line per metre, each cell crossed by one of them
+    assert set(np.unique(counts[counts > 0]).tolist()) == {1}
+
+    stats = coverage_stats(counts, cell_area=2.0)
+    assert stats['covered_area'] == 2.0 * (counts > 0).sum()
+    assert stats['min_lines'] == 1
+
+
+def test_cell_area_in_square_metres():
+    assert cell_area(Affine(2, 0, 500000, 0, -2, 3600000), CRS.from_epsg(32611), (10, 10)) == 4.0
+    area = cell_area(Affine(1e-5, 0, -117, 0, -1e-5, 33), CRS.from_epsg(4326), (10, 10))
+    assert 0.9 < area < 1.1
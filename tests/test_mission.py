@@ -0,0 +1,120 @@
+import json
+import queue
+import threading
+from types import SimpleNamespace
+
+from pathplan.mission import MAV_MISSION_ACCEPTED, MissionUploader
+
+MAV_MISSION_ERROR = 1
+
+
+class MockVehicle(object):
+    """
+    MAVLink mission endpoint holding a mission, answering from its own
+    thread like a connection would. A partial list write is rejected unless
+    it ends within the mission the vehicle already holds.
+    """
+
+    def __init__(self, items=()):
+        self.items = list(items)
+        self.requested = []
+        self.partial_writes = []
+        self.message_factory = self
+        self._listeners = {}
+        self._expected = 0
+        self._outbox = queue.Queue()
+        self._thread = threading.Thread(target=self._dispatch)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def add_message_listener(self, name, fn):
+        self._listeners.setdefault(name, []).append(fn)
+
+    def remove_message_listener(self, name, fn):
+        self._listeners[name].remove(fn)
+
+    def _dispatch(self):
+        while True:
+            name, msg = self._outbox.get()
+            for fn in list(self._listeners.get(name, [])):
+                fn(self, name, msg)
+
+    def _request(self, seq):
+        self.requested.append(seq)
+        self._outbox.put(('MISSION_REQUEST', SimpleNamespace(seq=seq)))
+
+    def _ack(self, result):
+        self._outbox.put(('MISSION_ACK', SimpleNamespace(type=result)))
+
+    def mission_request_list_send(self, target_system, target_component):
+        self._outbox.put(('MISSION_COUNT', SimpleNamespace(count=len(self.items))))
+
+    def mission_count_send(self, target_system, target_component, count):
+        self.items = [None] * count
+        self._expected = count
+        self._request(0)
+
+    def mission_write_partial_list_send(self, target_system, target_component, start, end):
+        self.partial_writes.append((start, end))
+        if end >= len(self.items):
+            self._ack(MAV_MISSION_ERROR)
+            return
+        self._expected = end + 1
+        self._request(start)
+
+    def send_mavlink(self, cmd):
+        self.items[cmd.seq] = cmd.name
+        if cmd.seq + 1 < self._expected:
+            self._request(cmd.seq + 1)
+        else:
+            self._ack(MAV_MISSION_ACCEPTED)
+
+
+def commands(names):
+    return [SimpleNamespace(name=name) for name in names]
+
+
+def write_state(state_file, mission, total, acknowledged):
+    with open(state_file, 'w') as state:
+        json.dump({'mission': mission, 'total': total, 'acknowledged': acknowledged}, state)
+
+
+def test_upload_sends_every_item():
+    vehicle = MockVehicle()
+    uploader = MissionUploader(vehicle, commands('abcdef'), 6, chunk_size=2)
+    assert uploader.upload(timeout=1)
+    assert vehicle.items == list('abcdef')
+
+
+def test_resumes_the_same_mission_on_the_same_vehicle(tmp_path):
+    state_file = str(tmp_path / 'mission.upload')
+    write_state(state_file, 'abc', 6, 3)
+    vehicle = MockVehicle(['a', 'b', 'c', None, None, None])
+
+    uploader = MissionUploader(vehicle, commands('abcdef'), 6, state_file=state_file, mission_id='abc')
+    assert uploader.upload(timeout=1)
+    assert vehicle.partial_writes == [(3, 5)]
+    assert vehicle.requested == [3, 4, 5]
+    assert vehicle.items == list('abcdef')
+
+
+def test_restarts_on_a_wiped_vehicle(tmp_path):
+    state_file = str(tmp_path / 'mission.upload')
+    write_state(state_file, 'abc', 6, 3)
+    vehicle = MockVehicle()
+
+    uploader = MissionUploader(vehicle, commands('abcdef'), 6, state_file=state_file, mission_id='abc')
+    assert uploader.upload(timeout=1)
+    assert vehicle.partial_writes == []
+    assert vehicle.items == list('abcdef')
+
+
+def test_restarts_a_regenerated_mission_of_the_same_length(tmp_path):
+    state_file = str(tmp_path / 'mission.upload')
+    write_state(state_file, 'abc', 6, 3)
+    vehicle = MockVehicle(list('abcdef'))
+
+    uploader = MissionUploader(vehicle, commands('uvwxyz'), 6, state_file=state_file, mission_id='uvw')
+    assert uploader.upload(timeout=1)
+    assert vehicle.partial_writes == []
+    assert vehicle.items == list('uvwxyz')
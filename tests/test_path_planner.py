@@ -0,0 +1,34 @@
+from shapely.geometry import Polygon
+
+from pathplan.intersect import SurfaceIndex
+from pathplan.path_planner import plan_path
+
+
+def test_be_buffer_is_added_at_query_time():
+    square = Polygon([(10, -10), (20, -10), (20, 10), (10, 10)])
+    index = SurfaceIndex.from_shapes([square], {square.wkt: 50.0})
+
+    new_path, new_obs = plan_path([(0, 0, 0), (30, 0, 0)], index, 10, 0, 0, 10, 10, 10)
+
+    assert [z for _, _, z in new_path] == [60.0, 60.0]
+    assert [z for _, _, z in new_obs] == [50.0, 50.0]
+
+
+def test_plan_checked_path_decimates_and_checks():
+    import numpy as np
+
+    from pathplan.path_planner import plan_checked_path
+
+    square = Polygon([(-10, -10), (40, -10), (40, 10), (-10, 10)])
+    index = SurfaceIndex.from_shapes([square], {square.wkt: 50.0})
+    params = {'be_buffer': 10, 'min_length': 0, 'climb_rate': 10, 'descent_rate': 10, 'max_speed': 10,
+              'min_speed': 10}
+
+    def clearance(xs, ys):
+        return np.full(np.shape(xs), 60.0)
+
+    path = [(0, 0, 0), (10, 0, 0), (20, 0, 0), (30, 0, 0)]
+    gen_path, _, report = plan_checked_path(path, index, clearance, params)
+    assert [p[:2] for p in gen_path] == [(0.0, 0.0), (30.0, 0.0)]
+    assert report.min_clearance == 0
+    assert report.violations == []
@@ -0,0 +1,97 @@
+import os
+
+import numpy as np
+import pytest
+
+from pathplan.pathfile import (MAGIC, decode_path_columns, encode_path_columns, is_binary_path, read_path_columns,
+                               read_path_header, read_path_timestamps, read_waypoint_dicts, write_path_columns)
+from pathplan.utils import read_init_path, save_path
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'paths')
+JSON_PATH = os.path.join(DATA_DIR, 'ucsd-test.json')
+
+
+def columns():
+    rand = np.random.RandomState(0)
+    return 32.88 + rand.rand(50) * 1e-3, -117.23 + rand.rand(50) * 1e-3, rand.rand(50) * 100
+
+
+def test_encode_decode_round_trip():
+    lat, lon, alt = columns()
+    timestamps = np.arange(50, dtype=float)
+    header, dlat, dlon, dalt = decode_path_columns(encode_path_columns(lat, lon, alt, provenance={'planner': 'test'},
+                                                                       timestamps=timestamps))
+
+    np.testing.assert_array_equal(dlat, lat)
+    np.testing.assert_array_equal(dlon, lon)
+    np.testing.assert_array_equal(dalt, alt)
+    assert header['count'] == 50
+    assert header['columns'] == ['latitude', 'longitude', 'altitude', 'timestamp']
+
+
+def test_provenance_header(tmp_path):
+    filepath = str(tmp_path / 'path.path')
+    write_path_columns(filepath, *columns(), crs='epsg:4326', provenance={'planner': 'shapely', 'params': {'be_buffer': 20}})
+
+    header, offset = read_path_header(filepath)
+    assert header['crs'] == 'epsg:4326'
+    assert header['provenance'] == {'planner': 'shapely', 'params': {'be_buffer': 20}}
+    assert header['units'] == {'latitude': 'degree', 'longitude': 'degree', 'altitude': 'metre'}
+    assert offset % 8 == 0
+
+
+def test_binary_files_are_memory_mapped(tmp_path):
+    filepath = str(tmp_path / 'path.path')
+    lat, lon, alt = columns()
+    write_path_columns(filepath, lat, lon, alt, timestamps=np.arange(50, dtype=float))
+
+    _, rlat, rlon, ralt = read_path_columns(filepath)
+    assert isinstance(rlat, np.memmap)
+    np.testing.assert_array_equal(rlat, lat)
+    np.testing.assert_array_equal(rlon, lon)
+    np.testing.assert_array_equal(ralt, alt)
+    np.testing.assert_array_equal(read_path_timestamps(filepath), np.arange(50))
+
+
+def test_empty_path(tmp_path):
+    filepath = str(tmp_path / 'empty.path')
+    write_path_columns(filepath, [], [], [])
+    header, lat, lon, alt = read_path_columns(filepath)
+    assert header['count'] == 0 and len(lat) == len(lon) == len(alt) == 0
+
+
+def test_json_and_columnar_paths_read_the_same(tmp_path):
+    binary_path = str(tmp_path / 'ucsd-test.path')
+    _, lat, lon, alt = read_path_columns(JSON_PATH)
+    write_path_columns(binary_path, lat, lon, alt)
+    assert is_binary_path(binary_path) and not is_binary_path(JSON_PATH)
+
+    json_points, json_proj = read_init_path(JSON_PATH)
+    binary_points, binary_proj = read_init_path(binary_path)
+    assert json_proj.srs == binary_proj.srs
+    np.testing.assert_array_equal(binary_points, json_points)
+    assert read_waypoint_dicts(binary_path) == read_waypoint_dicts(JSON_PATH)
+
+
+def test_bad_magic_is_rejected(tmp_path):
+    data = encode_path_columns(*columns())
+    bad = b'NOTAPATH' + data[len(MAGIC):]
+    with pytest.raises(ValueError):
+        decode_path_columns(bad)
+
+    filepath = str(tmp_path / 'bad.path')
+    with open(filepath, 'wb') as path_file:
+        path_file.write(bad)
+    assert not is_binary_path(filepath)
+    with pytest.raises(ValueError):
+        read_path_header(filepath)
+
+
+@pytest.mark.parametrize('name', ['saved.json', 'saved.path'])
+def test_save_path_round_trip(tmp_path, name):
+    points, proj = read_init_path(JSON_PATH)
+    filepath = str(tmp_path / name)
+    save_path(filepath, points, proj)
+
+    saved, _ = read_init_path(filepath, proj)
+    np.testing.assert_allclose(saved, points, atol=1e-6)
@@ -0,0 +1,113 @@
+import json
+import os
+
+import pytest
+
+from pathplan import pipeline
+from pathplan.pipeline import MANIFEST, DependencyFailed, Runner, Stage, Task, run_task
+
+
+def copy_stage(inputs, params, outdir):
+    """
+    Copies its source into out.txt, noting every run in $STUB_RUNS
+    """
+    with open(os.environ['STUB_RUNS'], 'a') as runs:
+        runs.write('copy\n')
+    source = inputs['source']
+    if os.path.isdir(source):
+        source = os.path.join(source, 'out.txt')
+    with open(source) as src, open(os.path.join(outdir, 'out.txt'), 'w') as out:
+        out.write(src.read() + json.dumps(params))
+
+
+def failing_stage(inputs, params, outdir):
+    with open(os.path.join(outdir, 'out.txt'), 'w') as out:
+        out.write('partial')
+    raise RuntimeError('stage failed')
+
+
+COPY = Stage('copy', copy_stage, ['scale'], 'process', 'out.txt', 1)
+FAIL = Stage('fail', failing_stage, [], 'process', 'out.txt', 1)
+
+
+@pytest.fixture
+def stubs(tmp_path, monkeypatch):
+    monkeypatch.setitem(pipeline.STAGES, 'copy', COPY)
+    monkeypatch.setitem(pipeline.STAGES, 'fail', FAIL)
+    monkeypatch.setenv('STUB_RUNS', str(tmp_path / 'runs.txt'))
+    source = tmp_path / 'source.txt'
+    source.write_text('surface')
+    return str(source)
+
+
+def runs(tmp_path):
+    runs_file = tmp_path / 'runs.txt'
+    return runs_file.read_text().split() if runs_file.exists() else []
+
+
+def test_key_changes_with_content_params_and_version(stubs):
+    key = Task(COPY, {'source': stubs}, {'scale': 1}).key
+
+    assert Task(COPY, {'source': stubs}, {'scale': 1, 'unused': 2}).key == key
+    assert Task(COPY, {'source': stubs}, {'scale': 2}).key != key
+    assert Task(COPY._replace(version=2), {'source': stubs}, {'scale': 1}).key != key
+
+    with open(stubs, 'a') as source:
+        source.write(' changed')
+    assert Task(COPY, {'source': stubs}, {'scale': 1}).key != key
+
+
+def test_key_follows_the_producing_task(stubs):
+    first = Task(COPY, {'source': stubs}, {'scale': 1})
+    second = Task(COPY, {'source': stubs}, {'scale': 2})
+    assert Task(COPY, {'source': first}).key != Task(COPY, {'source': second}).key
+
+
+def test_run_task_marks_the_task_done(stubs, tmp_path):
+    root = str(tmp_path / 'artifacts')
+    task = Task(COPY, {'source': stubs}, {'scale': 1})
+    assert not task.done(root)
+
+    run_task('copy', task.inputs, task.params, task.outdir(root))
+    assert task.done(root)
+    with open(task.output(root)) as out:
+        assert out.read() == 'surface{"scale": 1}'
+    with open(os.path.join(task.outdir(root), MANIFEST)) as manifest:
+        assert json.load(manifest)['params'] == {'scale': 1}
+
+
+def test_failing_stage_leaves_no_outdir(stubs, tmp_path):
+    root = str(tmp_path / 'artifacts')
+    task = Task(FAIL, {'source': stubs})
+
+    with pytest.raises(RuntimeError):
+        run_task('fail', task.inputs, task.params, task.outdir(root))
+    assert not task.done(root)
+    assert os.listdir(os.path.join(root, 'fail')) == []
+
+
+def test_runner_skips_finished_tasks(stubs, tmp_path):
+    root = str(tmp_path / 'artifacts')
+    first = Task(COPY, {'source': stubs}, {'scale': 1})
+    second = Task(COPY, {'source': first}, {'scale': 2})
+
+    results = Runner(root, workers=1).run([second])
+    assert results[second] == second.outdir(root)
+    assert runs(tmp_path) == ['copy', 'copy']
+    with open(second.output(root)) as out:
+        assert out.read() == 'surface{"scale": 1}{"scale": 2}'
+
+    assert Runner(root, workers=1).run([second])[second] == second.outdir(root)
+    assert runs(tmp_path) == ['copy', 'copy']
+
+
+def test_runner_fails_dependents(stubs, tmp_path):
+    root = str(tmp_path / 'artifacts')
+    failing = Task(FAIL, {'source': stubs})
+    dependent = Task(COPY, {'source': failing}, {'scale': 1})
+
+    results = Runner(root, workers=1).run([dependent])
+    assert isinstance(results[failing], RuntimeError)
+    assert isinstance(results[dependent], DependencyFailed)
+    assert not failing.done(root) and not dependent.done(root)
+    assert runs(tmp_path) == []
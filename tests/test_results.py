@@ -0,0 +1,89 @@
+import json
+import multiprocessing
+import os
+
+import pytest
+
+from pathplan import results
+from pathplan.results import ResultsStore, atomic_json_dump
+
+WRITES = 25
+
+
+def write_results(db_path, writer):
+    store = ResultsStore(db_path)
+    for i in range(WRITES):
+        name = "{0}-{1}".format(writer, i)
+        store.add_path('cases/ucsd.json', name, name + '.path', params={'writer': writer})
+        store.add_metrics('cases/ucsd.json', name, {'mse': float(i)})
+
+
+def test_records_read_back(tmp_path):
+    store = ResultsStore(str(tmp_path / 'gen' / 'results.sqlite'))
+    store.add_path('cases/ucsd.json', 'min_alt', 'gen/min_alt.path', 'params/min_alt.json', {'be_buffer': 20},
+                   {'min_clearance': 3.5})
+    store.add_path('cases/ucsd.json', 'other', 'gen/other.path', params={'be_buffer': 40})
+    store.add_flight('cases/ucsd.json', 'min_alt', 'gen/min_alt.flight.json', 'gen/logs')
+    store.add_metrics('cases/ucsd.json', 'min_alt', {'mse': 2.0, 'rmse': 1.5})
+    store.add_metrics('cases/ucsd.json', 'min_alt', {'mse': 1.0})
+
+    paths = store.paths('./cases/ucsd.json', params={'be_buffer': 20})
+    assert len(paths) == 1
+    assert paths[0]['gen_path'] == 'gen/min_alt.path'
+    assert paths[0]['params'] == {'be_buffer': 20}
+    assert paths[0]['info'] == {'min_clearance': 3.5}
+    assert [row['name'] for row in store.paths('cases/ucsd.json')] == ['min_alt', 'other']
+    assert store.flights('cases/ucsd.json', 'min_alt')[0]['flight_logs'] == 'gen/logs'
+    assert store.metrics('cases/ucsd.json', 'min_alt') == {'mse': 1.0, 'rmse': 1.5}
+
+    assert store.results('cases/ucsd.json') == {
+        'min_alt': {'gen-path': 'gen/min_alt.path', 'params': 'params/min_alt.json', 'min_clearance': 3.5,
+                    'flight_path': 'gen/min_alt.flight.json', 'flight_logs': 'gen/logs'},
+        'other': {'gen-path': 'gen/other.path', 'params': None},
+    }
+    assert store.results('cases/other.json') == {}
+
+
+def test_concurrent_writers(tmp_path):
+    db_path = str(tmp_path / 'results.sqlite')
+    ResultsStore(db_path).paths('cases/ucsd.json')
+
+    writers = [multiprocessing.Process(target=write_results, args=(db_path, writer)) for writer in 'ab']
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+        assert writer.exitcode == 0
+
+    store = ResultsStore(db_path)
+    for writer in 'ab':
+        names = [row['name'] for row in store.paths('cases/ucsd.json', params={'writer': writer})]
+        assert names == ["{0}-{1}".format(writer, i) for i in range(WRITES)]
+        assert store.metrics('cases/ucsd.json', "{0}-3".format(writer)) == {'mse': 3.0}
+
+
+def test_atomic_json_dump(tmp_path):
+    filepath = str(tmp_path / 'case.json')
+    atomic_json_dump({'results': {'a': 1}}, filepath)
+    with open(filepath) as case_file:
+        assert json.load(case_file) == {'results': {'a': 1}}
+    assert os.listdir(str(tmp_path)) == ['case.json']
+
+
+def test_interrupted_dump_keeps_the_old_file(tmp_path, monkeypatch):
+    filepath = str(tmp_path / 'case.json')
+    atomic_json_dump({'results': {'a': 1}}, filepath)
+
+    # Fails partway through writing
+    with pytest.raises(TypeError):
+        atomic_json_dump({'results': {'a': 2, 'b': object()}}, filepath)
+
+    def crash(src, dst):
+        raise KeyboardInterrupt
+    monkeypatch.setattr(results.os, 'replace', crash)
+    with pytest.raises(KeyboardInterrupt):
+        atomic_json_dump({'results': {'a': 3}}, filepath)
+
+    with open(filepath) as case_file:
+        assert json.load(case_file) == {'results': {'a': 1}}
+    assert os.listdir(str(tmp_path)) == ['case.json']
@@ -0,0 +1,101 @@
+import json
+import threading
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import numpy as np
+import pytest
+
+from pathplan.pathfile import decode_path_columns, encode_path_columns
+from pathplan.server import PATH_CONTENT_TYPE, PlanningServer, _Handler
+
+
+def echo_request(request):
+    """
+    Endpoint replying with the path it was sent, in place of /plan
+    """
+    return {'path': request['path'], 'case': request.get('case'), 'timing': {}}
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setitem(_Handler.endpoints, '/echo', echo_request)
+    server = PlanningServer(('127.0.0.1', 0), workers=1)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield "http://127.0.0.1:{0}".format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+def send(url, data=None, headers=None):
+    """
+    Status, content type and body of the reply to a request
+    """
+    try:
+        with urlopen(Request(url, data, headers or {})) as reply:
+            return reply.status, reply.headers['Content-Type'], reply.read()
+    except HTTPError as error:
+        return error.code, error.headers['Content-Type'], error.read()
+
+
+def columns():
+    rand = np.random.RandomState(0)
+    return 32.88 + rand.rand(20) * 1e-3, -117.23 + rand.rand(20) * 1e-3, rand.rand(20) * 100
+
+
+def test_unknown_endpoints(server):
+    status, _, body = send(server + '/nowhere')
+    assert status == 404 and 'unknown endpoint' in json.loads(body.decode('utf-8'))['error']
+
+    status, _, _ = send(server + '/nowhere', b'{}', {'Content-Type': 'application/json'})
+    assert status == 404
+
+
+def test_malformed_bodies(server):
+    status, _, body = send(server + '/plan', b'{"case": ', {'Content-Type': 'application/json'})
+    assert status == 400 and 'bad request' in json.loads(body.decode('utf-8'))['error']
+
+    status, _, _ = send(server + '/plan?case=a.test', b'NOTAPATH', {'Content-Type': PATH_CONTENT_TYPE})
+    assert status == 400
+
+
+def test_columnar_path_round_trip(server):
+    lat, lon, alt = columns()
+    status, content_type, body = send(server + '/echo?case=a.test', encode_path_columns(lat, lon, alt),
+                                      {'Content-Type': PATH_CONTENT_TYPE, 'Accept': PATH_CONTENT_TYPE})
+
+    assert status == 200 and content_type == PATH_CONTENT_TYPE
+    header, rlat, rlon, ralt = decode_path_columns(body)
+    np.testing.assert_array_equal(rlat, lat)
+    np.testing.assert_array_equal(rlon, lon)
+    np.testing.assert_array_equal(ralt, alt)
+    assert header['provenance']['case'] == 'a.test'
+    assert 'latency' in header['provenance']['timing']
+
+
+def test_json_path_round_trip(server):
+    lat, lon, alt = columns()
+    waypoints = [{'latitude': la, 'longitude': lo, 'altitude': al}
+                 for la, lo, al in zip(lat.tolist(), lon.tolist(), alt.tolist())]
+    status, content_type, body = send(server + '/echo', json.dumps({'case': 'a.test', 'path': waypoints}).encode('utf-8'),
+                                      {'Content-Type': 'application/json'})
+
+    assert status == 200 and content_type == 'application/json'
+    assert json.loads(body.decode('utf-8'))['path'] == waypoints
+
+
+def test_stats(server):
+    assert json.loads(send(server + '/stats')[2].decode('utf-8')) == {}
+
+    for _ in range(3):
+        send(server + '/echo', json.dumps({'path': []}).encode('utf-8'), {'Content-Type': 'application/json'})
+    send(server + '/plan', b'not json', {'Content-Type': 'application/json'})
+
+    status, _, body = send(server + '/stats')
+    stats = json.loads(body.decode('utf-8'))
+    assert status == 200
+    assert list(stats) == ['/echo']
+    assert stats['/echo']['count'] == 3
+    assert 0 <= stats['/echo']['p50_ms'] <= stats['/echo']['max_ms']
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from pathplan.clearance import check_clearance, raster_clearance
+from pathplan.smoothing import concavity_smooth, enforce_min_length, upper_hull
+
+
+def random_profile(n=300, seed=0):
+    rand = np.random.RandomState(seed)
+    xs = np.cumsum(rand.uniform(0.1, 3, n))
+    ys = np.cumsum(rand.normal(0, 2, n))
+    return xs, ys
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_upper_hull_stays_above_every_point(seed):
+    xs, ys = random_profile(seed=seed)
+    hull = upper_hull(xs, ys)
+
+    assert hull[0] == 0 and hull[-1] == len(xs) - 1
+    assert np.all(np.diff(hull) > 0)
+    assert np.all(np.interp(xs, xs[hull], ys[hull]) >= ys - 1e-9)
+
+
+@pytest.mark.parametrize('min_length', [1.0, 5.0, 20.0])
+def test_enforce_min_length_merges_short_segments(min_length):
+    xs, ys = random_profile()
+    hull = upper_hull(xs, ys)
+    merged_x, merged_z = enforce_min_length(xs[hull], ys[hull], min_length)
+
+    assert merged_x[0] == xs[0] and merged_x[-1] == xs[-1]
+    assert np.all(np.diff(merged_x) >= min_length)
+    assert np.all(np.interp(xs, merged_x, merged_z) >= ys - 1e-9)
+
+
+def test_concavity_smooth_keeps_clearance():
+    rand = np.random.RandomState(0)
+    surface = rand.uniform(0, 20, (40, 40))
+    surface[10:20, 15:25] += 60
+    clearance = raster_clearance(surface, 5)
+    path = [(2, 2, 0), (30, 30, 0), (35, 5, 0), (5, 15, 0)]
+
+    for min_length in (0, 10):
+        smoothed = concavity_smooth(path, clearance, min_length)
+        assert smoothed[0][:2] == pytest.approx(path[0][:2])
+        assert smoothed[-1][:2] == pytest.approx(path[-1][:2])
+        assert check_clearance(smoothed, clearance).min_clearance >= -1e-9
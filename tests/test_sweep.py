@@ -0,0 +1,10 @@
+from pathplan.sweep import _surface_key
+
+
+def test_bare_earth_surface_does_not_depend_on_be_buffer():
+    assert _surface_key(None, 5, 2) == _surface_key(None, 20, 2)
+
+
+def test_canopy_surface_depends_on_the_buffer_difference():
+    assert _surface_key('canopy.tif', 5, 8) == (3, 8)
+    assert _surface_key('canopy.tif', 5, 8) != _surface_key('canopy.tif', 6, 8)
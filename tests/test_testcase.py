@@ -0,0 +1,48 @@
+from pathplan.testcase import cached_load, clear_cache
+
+
+def read_text(filepath):
+    with open(filepath) as text_file:
+        return text_file.read()
+
+
+def read_lines(filepath):
+    with open(filepath) as text_file:
+        return text_file.read().splitlines()
+
+
+def test_cached_load_keeps_loaders_apart(tmp_path):
+    filepath = tmp_path / 'case.txt'
+    filepath.write_text('a\nb\n')
+    clear_cache()
+
+    assert cached_load(str(filepath), read_text) == 'a\nb\n'
+    assert cached_load(str(filepath), read_lines) == ['a', 'b']
+    assert cached_load(str(filepath), read_text) == 'a\nb\n'
+
+
+def test_result_path_is_projected_like_the_initial_path(tmp_path):
+    import json
+
+    import numpy as np
+
+    from pathplan.results import ResultsStore
+    from pathplan.testcase import TestCase
+
+    def write_path(filepath, points):
+        with open(filepath, 'w') as path_file:
+            json.dump([{'latitude': lat, 'longitude': lon, 'altitude': alt} for lat, lon, alt in points], path_file)
+
+    init_file, gen_file, case_file = (str(tmp_path / name) for name in ('init.json', 'gen.json', 'case.json'))
+    write_path(init_file, [(32.70, -117.10, 10), (32.71, -117.10, 10)])
+    write_path(gen_file, [(32.70, -117.10, 20), (32.71, -117.10, 20)])
+    with open(case_file, 'w') as json_file:
+        json.dump({'path': init_file}, json_file)
+
+    clear_cache()
+    case = TestCase(case_file, ResultsStore(str(tmp_path / 'results.db')))
+    case.record_path('gen', gen_file)
+
+    gen_path = case.result_path('gen')
+    np.testing.assert_allclose(np.array(gen_path)[:, :2], np.array(case.path)[:, :2])
+    np.testing.assert_allclose(np.array(gen_path)[:, 2], 20 * 3.28084)
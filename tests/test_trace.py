@@ -0,0 +1,144 @@
+import json
+import logging
+
+import pytest
+
+from pathplan import trace
+
+
+class RecordingSink(object):
+
+    def __init__(self):
+        self.calls = []
+
+    def start(self):
+        self.calls.append(('start',))
+
+    def begin(self, name):
+        self.calls.append(('begin', name))
+
+    def end(self, name, start, duration, attrs):
+        self.calls.append(('end', name, attrs))
+
+    def stop(self, counters):
+        self.calls.append(('stop', counters))
+
+
+@pytest.fixture(autouse=True)
+def no_sinks():
+    yield
+    for sink in list(trace._sinks):
+        trace.remove_sink(sink)
+    trace.reset()
+
+
+def test_spans_nest():
+    sink = trace.add_sink(RecordingSink())
+    with trace.span('outer', case='a'):
+        with trace.span('inner'):
+            pass
+        with trace.span('inner'):
+            pass
+
+    assert sink.calls == [('start',), ('begin', 'outer'), ('begin', 'inner'), ('end', 'inner', {}),
+                          ('begin', 'inner'), ('end', 'inner', {}), ('end', 'outer', {'case': 'a'})]
+
+
+def test_span_ends_when_the_block_raises():
+    sink = trace.add_sink(RecordingSink())
+    with pytest.raises(RuntimeError):
+        with trace.span('failing'):
+            raise RuntimeError
+    assert sink.calls[-1] == ('end', 'failing', {})
+
+
+def test_traced_and_counters():
+    @trace.traced('stage')
+    def stage(value):
+        trace.count('calls')
+        return value * 2
+
+    assert stage(2) == 4
+    assert trace.counters() == {}
+
+    sink = trace.add_sink(RecordingSink())
+    assert stage(3) == 6
+    trace.count('candidates', 5)
+    assert sink.calls[1:] == [('begin', 'stage'), ('end', 'stage', {})]
+
+    trace.remove_sink(sink)
+    assert sink.calls[-1] == ('stop', {'calls': 1, 'candidates': 5})
+    assert not trace.enabled()
+
+
+def test_json_trace_sink(tmp_path):
+    filepath = str(tmp_path / 'trace.json')
+    sink = trace.add_sink(trace.JsonTraceSink(filepath))
+    with trace.span('outer'):
+        with trace.span('inner', segments=3):
+            trace.count('hits', 2)
+    trace.remove_sink(sink)
+
+    with open(filepath) as trace_file:
+        events = json.load(trace_file)['traceEvents']
+    inner, outer, counter = events
+    assert (inner['name'], outer['name']) == ('inner', 'outer')
+    assert inner['args'] == {'segments': '3'}
+    assert outer['ts'] <= inner['ts'] and inner['ts'] + inner['dur'] <= outer['ts'] + outer['dur']
+    assert counter['ph'] == 'C' and counter['args'] == {'hits': 2}
+
+
+def test_log_and_memory_sinks(caplog):
+    caplog.set_level(logging.INFO, 'pathplan.trace')
+    sinks = [trace.add_sink(trace.LogSink()), trace.add_sink(trace.MemorySink())]
+    with trace.span('allocate'):
+        data = [0] * 100000
+        trace.count('items', len(data))
+    for sink in sinks:
+        trace.remove_sink(sink)
+
+    messages = [record.getMessage() for record in caplog.records]
+    assert any(message.startswith('allocate took') for message in messages)
+    assert any(message.startswith('allocate allocated') for message in messages)
+    assert 'items = 100000' in messages
+
+
+def test_profile_sink(tmp_path):
+    import pstats
+
+    filepath = str(tmp_path / 'profile.out')
+    sink = trace.add_sink(trace.ProfileSink(filepath))
+    sorted(range(1000), key=lambda i: -i)
+    trace.remove_sink(sink)
+    assert pstats.Stats(filepath).total_calls > 0
+
+
+def test_configure_from_env(tmp_path, monkeypatch):
+    exits = []
+    monkeypatch.setattr(trace.atexit, 'register', exits.append)
+    logger = logging.getLogger('pathplan')
+    monkeypatch.setattr(logger, 'level', logger.level)
+
+    filepath = str(tmp_path / 'trace.json')
+    trace.configure_from_env({'PATHPLAN_LOG': 'debug', 'PATHPLAN_TRACE': 'log,json:' + filepath})
+    assert logger.level == logging.DEBUG
+    assert [type(sink) for sink in trace._sinks] == [trace.LogSink, trace.JsonTraceSink]
+
+    with trace.span('stage'):
+        pass
+    exits[0]()
+    assert not trace.enabled()
+    with open(filepath) as trace_file:
+        assert [event['name'] for event in json.load(trace_file)['traceEvents']] == ['stage']
+
+
+def test_configure_from_env_without_sinks(monkeypatch):
+    exits = []
+    monkeypatch.setattr(trace.atexit, 'register', exits.append)
+    logger = logging.getLogger('pathplan')
+    monkeypatch.setattr(logger, 'level', logger.level)
+    trace.configure_from_env({})
+    assert not trace.enabled() and exits == []
+
+    with pytest.raises(ValueError):
+        trace.configure_from_env({'PATHPLAN_TRACE': 'nowhere'})